@@ -0,0 +1,266 @@
+"""Bulk import and export of accounts, monitor relations and records.
+
+`import` reads accounts from a CSV file with a header row or a JSONL
+file with one object per line, each with `username`, `password`,
+`account_type` (PATIENT or MONITOR) and, for patients, the `monitors`
+following them (a list in JSONL, separated by ";" in CSV):
+
+    username,password,account_type,monitors
+    nurse1,secret,MONITOR,
+    patient1,secret,PATIENT,nurse1;nurse2
+
+Rows are read as a stream and inserted `BATCH_SIZE` at a time with
+`executemany` in a single transaction on `accounts.db`, which commits
+only after the empty records of the new patients are written in one
+flush. A bad row or a failed flush aborts the import without changing
+anything. Accounts that already exist are skipped, so an import can be
+run again; records already kept for a new patient are left as they are.
+
+`export accounts` writes every account and its monitors in the same
+format, and `export records` writes one JSON line per patient as it is
+read. Run it
+from the `backend` directory while the server is stopped:
+
+    python admin.py import ward.csv
+    python admin.py export accounts ward.jsonl
+    python admin.py export records records.jsonl
+"""
+
+import argparse
+import csv
+import json
+import sys
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from typing import TextIO
+
+import db
+import serialization
+from store import JsonFileBackend, RecordStore, SqliteBackend
+
+# Rows inserted per `executemany`, below SQLite's default variable limit
+BATCH_SIZE = 500
+
+FIELDS = ["username", "password", "account_type", "monitors"]
+
+
+def record_backend() -> JsonFileBackend | SqliteBackend:
+    from constants import (
+        DATA_JSON_PATH,
+        RECORD_BACKEND,
+        RECORD_FSYNC,
+        RECORD_JOURNAL_SIZE,
+        RECORDS_DB_PATH,
+    )
+
+    if RECORD_BACKEND == "sqlite":
+        return SqliteBackend(RECORDS_DB_PATH, fsync=RECORD_FSYNC)
+    return JsonFileBackend(
+        DATA_JSON_PATH, fsync=RECORD_FSYNC, compact_size=RECORD_JOURNAL_SIZE
+    )
+
+
+def read_rows(file: TextIO, jsonl: bool) -> Iterator[tuple[int, dict]]:
+    """Yield the line number and account of every row in `file`."""
+    if jsonl:
+        for line_no, line in enumerate(file, 1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"line {line_no}: {e}") from None
+        return
+
+    reader = csv.DictReader(file)
+    for row in reader:
+        monitors = row.get("monitors") or ""
+        row["monitors"] = [m for m in monitors.split(";") if m]
+        yield reader.line_num, row
+
+
+def parse_row(line_no: int, row: dict) -> tuple[str, str, str, list[str]]:
+    if not isinstance(row, dict):
+        raise ValueError(f"line {line_no}: not an object")
+    username = row.get("username")
+    password = row.get("password")
+    account_type = row.get("account_type")
+    monitors = row.get("monitors") or []
+    if not isinstance(username, str) or not username:
+        raise ValueError(f"line {line_no}: missing username")
+    if not isinstance(password, str) or not password:
+        raise ValueError(f"line {line_no}: missing password")
+    if account_type not in [db.AccountType.PATIENT, db.AccountType.MONITOR]:
+        raise ValueError(f"line {line_no}: invalid account_type")
+    if not isinstance(monitors, list) or not all(
+        isinstance(monitor, str) for monitor in monitors
+    ):
+        raise ValueError(f"line {line_no}: monitors must be a list")
+    if monitors and account_type != db.AccountType.PATIENT:
+        raise ValueError(f"line {line_no}: only patients have monitors")
+    return username, password, account_type, monitors
+
+
+def import_accounts(
+    rows: Iterable[tuple[int, dict]], records: RecordStore
+) -> dict[str, int]:
+    """Create the accounts in `rows` with their relations and records.
+
+    Returns how many accounts were created, skipped and related.
+    """
+    counts = {"created": 0, "skipped": 0, "relations": 0}
+    new_patients = []
+    staged = []
+    seen = set()
+    referenced = set()
+    conn = db.get_connection()
+    try:
+        rows = iter(rows)
+        while batch := [parse_row(*row) for row in islice(rows, BATCH_SIZE)]:
+            usernames = [username for username, *_ in batch]
+            existing = {
+                username
+                for (username,) in conn.execute(
+                    "SELECT username FROM accounts"
+                    f" WHERE username IN ({', '.join('?' * len(usernames))})",
+                    usernames,
+                )
+            }
+            accounts, relations = [], []
+            for username, password, account_type, monitors in batch:
+                relations += [(monitor, username) for monitor in monitors]
+                referenced.update(monitors)
+                if username in existing or username in seen:
+                    counts["skipped"] += 1
+                    continue
+                seen.add(username)
+                accounts.append((username, password, account_type))
+                if account_type == db.AccountType.PATIENT:
+                    new_patients.append(username)
+
+            conn.executemany(
+                "INSERT INTO accounts (username, password, account_type) VALUES (?, ?, ?)",
+                accounts,
+            )
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO monitor_patients (monitor, patient) VALUES (?, ?)",
+                relations,
+            )
+            counts["created"] += len(accounts)
+            counts["relations"] += max(cursor.rowcount, 0)
+
+        unknown = set(referenced)
+        referenced = sorted(referenced)
+        for start in range(0, len(referenced), BATCH_SIZE):
+            batch_monitors = referenced[start : start + BATCH_SIZE]
+            unknown -= {
+                monitor
+                for (monitor,) in conn.execute(
+                    "SELECT username FROM accounts WHERE account_type = ?"
+                    f" AND username IN ({', '.join('?' * len(batch_monitors))})",
+                    [db.AccountType.MONITOR, *batch_monitors],
+                )
+            }
+        if unknown:
+            raise ValueError(f"unknown monitors: {', '.join(sorted(unknown))}")
+
+        # Orphaned records of a new patient are kept
+        for patient in new_patients:
+            if patient not in records:
+                records.set(patient, {})
+                staged.append(patient)
+        records.flush()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        # A failed flush leaves them queued; write their removal instead
+        for patient in staged:
+            records.delete(patient)
+        raise
+    return counts
+
+
+def export_accounts(file: TextIO, jsonl: bool):
+    """Write every account with the monitors following it."""
+    writer = None if jsonl else csv.writer(file)
+    if writer is not None:
+        writer.writerow(FIELDS)
+    cursor = db.get_connection().execute(
+        """
+        SELECT username, password, account_type, group_concat(monitor, ';')
+        FROM accounts LEFT JOIN monitor_patients ON patient = username
+        GROUP BY accounts.id
+        ORDER BY accounts.id
+        """
+    )
+    for username, password, account_type, monitors in cursor:
+        if writer is not None:
+            writer.writerow([username, password, account_type, monitors or ""])
+            continue
+        account = {
+            "username": username,
+            "password": password,
+            "account_type": account_type,
+            "monitors": monitors.split(";") if monitors else [],
+        }
+        file.write(json.dumps(account, ensure_ascii=False) + "\n")
+
+
+def export_records(file: TextIO, records: Iterable[tuple[str, dict]]):
+    """Write one `{"patient": ..., "record": ...}` line per patient."""
+    for patient, record in records:
+        file.write(
+            serialization.dumps_str({"patient": patient, "record": record})
+            + "\n"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser(
+        "import", help="create the accounts in a .csv or .jsonl file"
+    )
+    import_parser.add_argument("path")
+    export_parser = commands.add_parser(
+        "export", help="write the accounts or records, to stdout by default"
+    )
+    export_parser.add_argument("what", choices=["accounts", "records"])
+    export_parser.add_argument("path", nargs="?")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        try:
+            # Fails while a server holds the records
+            records = RecordStore(record_backend())
+        except RuntimeError as e:
+            raise SystemExit(str(e)) from None
+        try:
+            with open(args.path, newline="") as file:
+                counts = import_accounts(
+                    read_rows(file, args.path.endswith(".jsonl")), records
+                )
+        except ValueError as e:
+            raise SystemExit(f"{args.path}: {e}, nothing imported") from None
+        finally:
+            records.close()
+        print(
+            f"Created {counts['created']} accounts"
+            f" ({counts['skipped']} already existed)"
+            f" and {counts['relations']} monitor relations"
+        )
+        return
+
+    file = open(args.path, "w", newline="") if args.path else sys.stdout
+    try:
+        if args.what == "accounts":
+            jsonl = args.path is None or not args.path.endswith(".csv")
+            export_accounts(file, jsonl)
+        else:
+            export_records(file, record_backend().iter_records())
+    finally:
+        if file is not sys.stdout:
+            file.close()
+
+
+if __name__ == "__main__":
+    main()
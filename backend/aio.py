@@ -0,0 +1,35 @@
+"""Run blocking I/O from the async handlers on a fixed thread pool.
+
+The accounts database and the record files are accessed synchronously.
+Handlers await `run` instead of calling them directly, so a slow query
+or disk write only holds up the request that made it while the event
+loop keeps serving the others. At most `IO_THREADS` calls run at once;
+further calls wait for a free thread.
+
+The pool's threads live as long as the process, so each keeps its one
+connection to the accounts database open and no connection is left
+behind by a thread that exited.
+"""
+
+import asyncio
+import contextvars
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+from constants import IO_THREADS
+
+T = TypeVar("T")
+
+executor = ThreadPoolExecutor(IO_THREADS, thread_name_prefix="io")
+
+
+async def run(func: Callable[..., T], *args) -> T:
+    """Call `func(*args)` on the pool and return its result.
+
+    The call sees the caller's context variables.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, context.run, func, *args
+    )
@@ -0,0 +1,329 @@
+"""Ward-wide reports and columnar exports of every patient's records.
+
+The records are flattened into columns with one row per item: patient,
+date, time, food, water, urination, defecation and the day's weight in
+kg (NaN when not recorded). Days without items get one row with an empty
+time and zero amounts so their weight is kept. The reports aggregate the
+columns per patient-day:
+
+- balance: distribution of the daily intake (food + water) minus
+  urination,
+- limits: patient-days whose restricted intake exceeded `limitAmount`,
+- weight: change between each patient's first and last recorded weight.
+
+The reports are computed with vectorized NumPy operations over the
+columns. Run it from the `backend` directory while the server is stopped
+or after it has flushed:
+
+    python analytics.py report --from 2025_1_1 --to 2025_1_31
+    python analytics.py export records.csv
+    python analytics.py export records.npz
+    python analytics.py export records.parquet
+
+`.parquet` files need pyarrow.
+"""
+
+import argparse
+import csv
+import json
+import math
+from datetime import date
+
+import numpy as np
+from summary import parse_weight
+from validator import parse_date_key
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+AMOUNTS = ["food", "water", "urination", "defecation"]
+COLUMNS = ["patient", "date", "time", *AMOUNTS, "weight"]
+
+# Lower edges in ml of the daily balance histogram, the last bin is open
+BALANCE_BINS = tuple(range(-2000, 2001, 500))
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def to_columns(
+    data: dict, start: date | None = None, end: date | None = None
+) -> dict[str, list]:
+    """Flatten `data` into columns, keeping the days in `start`..`end`."""
+    columns: dict[str, list] = {name: [] for name in COLUMNS}
+    patient_col, date_col, time_col = (
+        columns["patient"],
+        columns["date"],
+        columns["time"],
+    )
+    amount_cols = [columns[name] for name in AMOUNTS]
+    weight_col = columns["weight"]
+
+    for patient, record in data.items():
+        for key, day in record.items():
+            if not isinstance(day, dict):
+                continue
+            try:
+                day_date = parse_date_key(key)
+            except ValueError:
+                continue
+            if (start is not None and day_date < start) or (
+                end is not None and day_date > end
+            ):
+                continue
+
+            iso = day_date.isoformat()
+            weight = parse_weight(day.get("weight"))
+            weight = math.nan if weight is None else weight
+            items = day.get("data") or [{"time": ""}]
+            count = len(items)
+            patient_col += [patient] * count
+            date_col += [iso] * count
+            time_col += [item.get("time", "") for item in items]
+            for name, column in zip(AMOUNTS, amount_cols, strict=True):
+                column += [item.get(name, 0) for item in items]
+            weight_col += [weight] * count
+    return columns
+
+
+def as_arrays(columns: dict[str, list]) -> dict:
+    """Return `columns` as NumPy arrays."""
+    arrays = {
+        name: np.array(columns[name], dtype=str)
+        for name in ["patient", "date", "time"]
+    }
+    for name in AMOUNTS:
+        arrays[name] = np.array(columns[name], dtype=np.int64)
+    arrays["weight"] = np.array(columns["weight"], dtype=np.float64)
+    return arrays
+
+
+def restrictions(data: dict) -> dict[str, tuple[float, list[str]]]:
+    """Return the intake limit and restricted fields of each patient."""
+    limits = {}
+    for patient, record in data.items():
+        restricted = [
+            field
+            for field in ["food", "water"]
+            if record.get(f"{field}CheckboxChecked")
+        ]
+        try:
+            limit = float(record.get("limitAmount", ""))
+        except (TypeError, ValueError):
+            continue
+        if restricted:
+            limits[patient] = (limit, restricted)
+    return limits
+
+
+def daily_totals(columns: dict[str, list]) -> dict[str, list]:
+    """Sum the item columns per patient-day, sorted by patient and date.
+
+    Returns columns with one row per patient-day: patient, date, the four
+    amounts and the day's weight. A day stored under two keys (such as
+    `2025_1_5` and `2025_1_05`) is summed into one row and keeps the
+    larger recorded weight.
+    """
+    if not len(columns["patient"]):
+        return {name: [] for name in COLUMNS if name != "time"}
+    patients = np.asarray(columns["patient"], dtype=str)
+    dates = np.asarray(columns["date"], dtype=str)
+    # Sum the runs of items with the same patient-day first, so only
+    # those runs are sorted instead of every item
+    starts = np.flatnonzero(
+        np.r_[
+            True,
+            (patients[1:] != patients[:-1]) | (dates[1:] != dates[:-1]),
+        ]
+    )
+    # `lexsort` sorts by its last key first
+    order = np.lexsort((dates[starts], patients[starts]))
+    patients, dates = patients[starts][order], dates[starts][order]
+    # Runs of the same patient-day are now adjacent
+    groups = np.flatnonzero(
+        np.r_[
+            True,
+            (patients[1:] != patients[:-1]) | (dates[1:] != dates[:-1]),
+        ]
+    )
+    totals = {
+        "patient": patients[groups].tolist(),
+        "date": dates[groups].tolist(),
+    }
+    for name in AMOUNTS:
+        runs = np.add.reduceat(
+            np.asarray(columns[name], dtype=np.int64), starts
+        )
+        totals[name] = np.add.reduceat(runs[order], groups).tolist()
+    weights = np.asarray(columns["weight"], dtype=np.float64)[starts]
+    # `fmax` ignores the NaN of days without a weight
+    totals["weight"] = np.fmax.reduceat(weights[order], groups).tolist()
+    return totals
+
+
+def balance_report(days: dict[str, list]) -> dict:
+    """Distribution of the daily intake minus urination."""
+    balance = (
+        np.array(days["food"], dtype=np.int64)
+        + np.array(days["water"], dtype=np.int64)
+        - np.array(days["urination"], dtype=np.int64)
+    )
+    if not len(balance):
+        return {"days": 0}
+    bins = np.bincount(
+        np.searchsorted(BALANCE_BINS, balance, side="right"),
+        minlength=len(BALANCE_BINS) + 1,
+    )
+    return {
+        "days": len(balance),
+        "mean": float(balance.mean()),
+        "percentiles": {
+            str(q): float(value)
+            for q, value in zip(
+                PERCENTILES, np.percentile(balance, PERCENTILES), strict=True
+            )
+        },
+        "histogram": _histogram(bins.tolist()),
+    }
+
+
+def _histogram(bins: list[int]) -> dict[str, int]:
+    labels = [f"<{BALANCE_BINS[0]}"] + [
+        f"{lo}..{hi}"
+        for lo, hi in zip(BALANCE_BINS, BALANCE_BINS[1:], strict=False)
+    ]
+    labels.append(f">={BALANCE_BINS[-1]}")
+    return dict(zip(labels, bins, strict=True))
+
+
+def limit_report(
+    days: dict[str, list], limits: dict[str, tuple[float, list[str]]]
+) -> dict:
+    """Patient-days whose restricted intake exceeded the patient's limit."""
+    patients: dict[str, dict] = {}
+    over_days = []
+    if days["patient"]:
+        names, inverse = np.unique(
+            np.array(days["patient"], dtype=str), return_inverse=True
+        )
+        settings = [limits.get(name, (math.inf, [])) for name in names]
+        limit = np.array([value for value, _ in settings])[inverse]
+        food = np.array(days["food"], dtype=np.int64)
+        water = np.array(days["water"], dtype=np.int64)
+        amount = (
+            np.array(["food" in fields for _, fields in settings])[inverse]
+            * food
+            + np.array(["water" in fields for _, fields in settings])[inverse]
+            * water
+        )
+        over = np.flatnonzero(amount > limit)
+        over_days = zip(
+            names[inverse[over]].tolist(),
+            np.array(days["date"], dtype=str)[over].tolist(),
+            (amount - limit)[over].tolist(),
+            strict=True,
+        )
+
+    for name, day, excess in over_days:
+        entry = patients.setdefault(
+            name, {"limit": limits[name][0], "days": 0, "max_excess": 0.0}
+        )
+        entry["days"] += 1
+        entry["max_excess"] = max(entry["max_excess"], float(excess))
+        entry["last"] = day
+    return {
+        "limited_patients": len(limits),
+        "days_over": sum(entry["days"] for entry in patients.values()),
+        "patients": patients,
+    }
+
+
+def weight_report(days: dict[str, list]) -> dict:
+    """Change between the first and last recorded weight of each patient."""
+    changes: dict[str, float] = {}
+    weight = np.array(days["weight"], dtype=np.float64)
+    recorded = ~np.isnan(weight)
+    patient = np.array(days["patient"], dtype=str)[recorded]
+    weight = weight[recorded]
+    if len(patient):
+        # Days are sorted by patient and date
+        boundary = np.r_[True, patient[1:] != patient[:-1]]
+        first = np.flatnonzero(boundary)
+        last = np.r_[first[1:] - 1, len(patient) - 1]
+        change = np.round(weight[last] - weight[first], 2)
+        changes = dict(
+            zip(patient[first].tolist(), change.tolist(), strict=True)
+        )
+
+    values = sorted(changes.values())
+    return {
+        "patients": len(values),
+        "mean_change": sum(values) / len(values) if values else None,
+        "gained": sum(value > 0 for value in values),
+        "lost": sum(value < 0 for value in values),
+        "changes": changes,
+    }
+
+
+def report(
+    data: dict, start: date | None = None, end: date | None = None
+) -> dict:
+    days = daily_totals(to_columns(data, start, end))
+    return {
+        "patients": len(set(days["patient"])),
+        "patient_days": len(days["patient"]),
+        "balance": balance_report(days),
+        "limits": limit_report(days, restrictions(data)),
+        "weight": weight_report(days),
+    }
+
+
+def export(columns: dict[str, list], path: str):
+    """Write `columns` to `path` in the format given by its extension."""
+    if path.endswith(".npz"):
+        np.savez_compressed(path, **as_arrays(columns))
+    elif path.endswith(".parquet"):
+        if pyarrow is None:
+            raise SystemExit("Exporting .parquet files needs pyarrow installed")
+        pyarrow.parquet.write_table(pyarrow.table(columns), path)
+    else:
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(COLUMNS)
+            writer.writerows(zip(*(columns[name] for name in COLUMNS)))
+
+
+def load_data() -> dict:
+    """Load every patient's record from the configured backend."""
+    from constants import DATA_JSON_PATH, RECORD_BACKEND, RECORDS_DB_PATH
+    from store import JsonFileBackend, SqliteBackend
+
+    if RECORD_BACKEND == "sqlite":
+        return SqliteBackend(RECORDS_DB_PATH).read()
+    return JsonFileBackend(DATA_JSON_PATH).read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from", dest="start", type=parse_date_key)
+    parser.add_argument("--to", dest="end", type=parse_date_key)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="print the reports as JSON")
+    export_parser = commands.add_parser(
+        "export", help="write the columns to a .csv, .npz or .parquet file"
+    )
+    export_parser.add_argument("path")
+    args = parser.parse_args()
+
+    data = load_data()
+    if args.command == "report":
+        print(json.dumps(report(data, args.start, args.end), indent=2))
+    else:
+        columns = to_columns(data, args.start, args.end)
+        export(columns, args.path)
+        print(f"Exported {len(columns['patient'])} rows to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
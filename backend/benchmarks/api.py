@@ -0,0 +1,418 @@
+"""Load test `POST /` with simulated patient and monitor clients.
+
+Generates a synthetic ward (`accounts.db` with the monitor relations and
+`data.json`) in a temporary directory, serves it with uvicorn in a
+separate process and runs concurrent HTTP clients against it for a fixed
+time:
+
+- patient clients poll `fetch_record` with `since` like `patient/` does
+  and add an item with `patch_record` every `--write-every` polls,
+- monitor clients poll `fetch_monitoring_patients` like `monitor/` does.
+
+Every client logs in first and then sends its session token. Requests per
+second and p50/p99 latency seen by the clients are reported per event,
+along with the mean time the server itself spent handling the event,
+taken from `/metrics`. The clients run in one process; when it shares the
+CPU with the server, the client latencies include time spent waiting for
+the CPU while the server time does not. Run it from the `backend`
+directory:
+
+    python -m benchmarks.api
+    python -m benchmarks.api --save benchmarks/baseline.json
+    python -m benchmarks.api --compare benchmarks/baseline.json
+
+Compare runs made with the same options on the same machine only.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+from benchmarks.validation import make_document
+
+TOKEN = "benchmark"
+PASSWORD = "password"
+
+
+def make_dataset(
+    patients: int,
+    monitors: int,
+    per_monitor: int,
+    days: int,
+    items: int,
+    seed: int,
+):
+    """Write the ward to the working directory."""
+    with open("config.json", "w") as file:
+        json.dump(
+            {
+                "token": TOKEN,
+                "api_url": "http://benchmark",
+                "log_level": "WARNING",
+            },
+            file,
+        )
+
+    # Imported here since importing `constants` reads `config.json`
+    import db
+    import serialization
+    from store import write_atomic
+
+    rng = random.Random(seed)
+    patient_names = [f"patient{i}" for i in range(patients)]
+    monitor_names = [f"monitor{i}" for i in range(monitors)]
+
+    write_atomic(
+        "data.json",
+        serialization.dumps(
+            {patient: make_document(days, items) for patient in patient_names}
+        ),
+    )
+
+    db.create_table()
+    db.close_connections()
+    with sqlite3.connect(db.ACCOUNTS_DB) as conn:
+        conn.executemany(
+            "INSERT INTO accounts (username, password, account_type)"
+            " VALUES (?, ?, ?)",
+            [(p, PASSWORD, db.AccountType.PATIENT) for p in patient_names]
+            + [(m, PASSWORD, db.AccountType.MONITOR) for m in monitor_names],
+        )
+        conn.executemany(
+            "INSERT INTO monitor_patients (monitor, patient) VALUES (?, ?)",
+            [
+                (monitor, patient)
+                for monitor in monitor_names
+                for patient in rng.sample(
+                    patient_names, min(per_monitor, patients)
+                )
+            ],
+        )
+        # Skip the one-time import of `account_relations.json`
+        conn.execute("PRAGMA user_version = 1")
+
+
+def server_time(url: str) -> dict[str, tuple[float, int]]:
+    """Return the total handling time and count of every event so far."""
+    import httpx
+
+    totals: dict[str, list] = {}
+    for line in httpx.get(f"{url}/metrics").text.splitlines():
+        for suffix, index in [("_sum", 0), ("_count", 1)]:
+            prefix = f'pior_event_duration_seconds{suffix}{{event="'
+            if line.startswith(prefix):
+                event, value = line[len(prefix) :].split('"} ')
+                totals.setdefault(event, [0.0, 0])[index] = float(value)
+    return {event: (total, count) for event, (total, count) in totals.items()}
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """Return the `q`-th percentile of sorted `samples` (nearest rank)."""
+    if not samples:
+        return 0.0
+    rank = max(0, min(len(samples) - 1, round(q / 100 * len(samples)) - 1))
+    return samples[rank]
+
+
+class Client:
+    """One tablet, with its own connection to the server."""
+
+    def __init__(self, url: str, account: str):
+        import httpx
+
+        self.http = httpx.AsyncClient(
+            base_url=url, limits=httpx.Limits(max_connections=1), timeout=60
+        )
+        self.account = account
+        self.session = None
+        self.latencies: dict[str, list[float]] = {}
+        self.errors = 0
+
+    async def post(self, event: str, **body) -> dict:
+        if self.session is not None:
+            body["session"] = self.session
+        start = time.perf_counter()
+        response = await self.http.post("/", json={"event": event} | body)
+        self.latencies.setdefault(event, []).append(time.perf_counter() - start)
+        result = response.json()
+        if response.status_code != 200 or not isinstance(result, dict):
+            self.errors += 1
+            return {}
+        return result
+
+    async def login(self):
+        from constants import LOGIN
+
+        result = await self.post(LOGIN, account=self.account, password=PASSWORD)
+        self.session = result["session"]
+
+
+async def patient_client(client: Client, deadline: float, write_every: int):
+    from constants import FETCH_RECORD, PATCH_RECORD
+
+    today = date.today()
+    key = f"{today.year}_{today.month}_{today.day}"
+    revision = None
+    polls = 0
+    while time.perf_counter() < deadline:
+        result = await client.post(
+            FETCH_RECORD, patient=client.account, since=revision
+        )
+        revision = result.get("revision", revision)
+        polls += 1
+        if write_every and polls % write_every == 0:
+            item = {
+                "time": "00:00",
+                "food": 100,
+                "water": 200,
+                "urination": 1,
+                "defecation": 0,
+            }
+            await client.post(
+                PATCH_RECORD,
+                patient=client.account,
+                operation={"op": "append_item", "date": key, "item": item},
+            )
+
+
+async def monitor_client(client: Client, deadline: float):
+    from constants import FETCH_MONITORING_PATIENTS
+
+    revisions = None
+    while time.perf_counter() < deadline:
+        result = await client.post(FETCH_MONITORING_PATIENTS, since=revisions)
+        revisions = result.get("revisions", revisions)
+
+
+def start_server(backend_dir: str) -> tuple[subprocess.Popen, str]:
+    """Serve the app in the working directory, return it and its URL."""
+    import httpx
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env=os.environ | {"PYTHONPATH": backend_dir},
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while server.poll() is None and time.monotonic() < deadline:
+        try:
+            httpx.get(f"{url}/metrics")
+            return server, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The server did not start")
+
+
+async def run_load(args, url: str) -> tuple[dict[str, list[float]], int, float]:
+    patients = [
+        Client(url, f"patient{i % args.patients}")
+        for i in range(args.patient_clients)
+    ]
+    monitors = [
+        Client(url, f"monitor{i % args.monitors}")
+        for i in range(args.monitor_clients)
+    ]
+    clients = patients + monitors
+    try:
+        await asyncio.gather(*(client.login() for client in clients))
+
+        before = server_time(url)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(
+            *(
+                patient_client(client, deadline, args.write_every)
+                for client in patients
+            ),
+            *(monitor_client(client, deadline) for client in monitors),
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        await asyncio.gather(*(client.http.aclose() for client in clients))
+
+    latencies: dict[str, list[float]] = {}
+    for client in clients:
+        for event, samples in client.latencies.items():
+            latencies.setdefault(event, []).extend(samples)
+    errors = sum(client.errors for client in clients)
+    return latencies, errors, elapsed, before
+
+
+def summarize(
+    latencies: dict[str, list[float]],
+    errors: int,
+    elapsed: float,
+    before: dict[str, tuple[float, int]],
+    after: dict[str, tuple[float, int]],
+) -> dict:
+    results = {}
+    everything = []
+    for event, samples in sorted(latencies.items()):
+        if event == "login":
+            continue
+        samples.sort()
+        everything += samples
+        total, count = after.get(event, (0.0, 0))
+        total_before, count_before = before.get(event, (0.0, 0))
+        results[event] = {
+            "requests": len(samples),
+            "rps": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+            "server_ms": (total - total_before)
+            / max(count - count_before, 1)
+            * 1000,
+        }
+    everything.sort()
+    server_requests = sum(result["requests"] for result in results.values())
+    server_total = sum(
+        result["server_ms"] * result["requests"] for result in results.values()
+    )
+    results["total"] = {
+        "requests": len(everything),
+        "rps": len(everything) / elapsed,
+        "p50_ms": percentile(everything, 50) * 1000,
+        "p99_ms": percentile(everything, 99) * 1000,
+        "server_ms": server_total / max(server_requests, 1),
+        "errors": errors,
+    }
+    return results
+
+
+def print_results(results: dict, baseline: dict | None):
+    print(
+        f"{'event':<28} {'requests':>9} {'rps':>9}"
+        f" {'p50 (ms)':>9} {'p99 (ms)':>9} {'server (ms)':>12}"
+    )
+    for event, result in results.items():
+        print(
+            f"{event:<28} {result['requests']:>9} {result['rps']:>9.1f}"
+            f" {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}"
+            f" {result['server_ms']:>12.3f}"
+        )
+        if baseline is not None and event in baseline:
+            base = baseline[event]
+            changes = [
+                f"{(result[key] / base[key] - 1) * 100:+.1f}%"
+                if base.get(key)
+                else "n/a"
+                for key in ["rps", "p50_ms", "p99_ms", "server_ms"]
+            ]
+            print(
+                f"{'  vs baseline':<28} {'':>9} {changes[0]:>9}"
+                f" {changes[1]:>9} {changes[2]:>9} {changes[3]:>12}"
+            )
+    if results["total"]["errors"]:
+        print(f"\n{results['total']['errors']} requests failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--monitors", type=int, default=10)
+    parser.add_argument(
+        "--per-monitor", type=int, default=30, help="patients per monitor"
+    )
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--items", type=int, default=8, help="items per day")
+    parser.add_argument("--patient-clients", type=int, default=40)
+    parser.add_argument("--monitor-clients", type=int, default=10)
+    parser.add_argument(
+        "--write-every",
+        type=int,
+        default=10,
+        help="polls between writes of a patient client, 0 never writes",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="seconds of load"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline file to compare against")
+    args = parser.parse_args()
+
+    # `recordDate` has no year, so the history has to stay in this year
+    args.days = min(args.days, date.today().timetuple().tm_yday - 1)
+
+    options = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ["save", "compare"]
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            saved = json.load(file)
+        baseline = saved["results"]
+        if saved["options"] != options:
+            print(f"Warning: {args.compare} was run with other options\n")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The app reads its files relative to the working directory
+        backend_dir = os.getcwd()
+        os.chdir(directory)
+        try:
+            make_dataset(
+                args.patients,
+                args.monitors,
+                args.per_monitor,
+                args.days,
+                args.items,
+                args.seed,
+            )
+            server, url = start_server(backend_dir)
+            try:
+                latencies, errors, elapsed, before = asyncio.run(
+                    run_load(args, url)
+                )
+                after = server_time(url)
+            finally:
+                server.terminate()
+                server.wait()
+        finally:
+            os.chdir(backend_dir)
+
+    results = summarize(latencies, errors, elapsed, before, after)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(
+                {
+                    "options": options,
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "cpus": os.cpu_count(),
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark the JSON encoders on `data.json` and on API responses.
+
+Compares the old indented stdlib format of `data.json` with the compact
+format of every available encoder, and FastAPI's default response path
+with `EncodedJSONResponse` for a `fetch_monitoring_patients` payload. Run
+it from the `backend` directory:
+
+    python -m benchmarks.serialization
+"""
+
+import argparse
+import json
+import timeit
+
+import serialization
+from benchmarks.validation import make_document
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from serialization import ENCODERS, EncodedJSONResponse
+
+
+def make_ward(patients: int, days: int, items: int) -> dict:
+    document = make_document(days, items)
+    return {f"patient{i}": document for i in range(patients)}
+
+
+def measure(number: int, func, *args) -> float:
+    """Return the mean time of `func(*args)` in milliseconds."""
+    return timeit.timeit(lambda: func(*args), number=number) / number * 1000
+
+
+def bench_files(data: dict, number: int):
+    print(
+        f"{'data.json':<18} {'size (KiB)':>11} {'encode (ms)':>12} {'decode (ms)':>12}"
+    )
+    formats = {
+        "json, indent=4": (
+            lambda obj: json.dumps(obj, indent=4).encode(),
+            json.loads,
+        ),
+    }
+    formats.update(
+        (f"{name}, compact", encoder) for name, encoder in ENCODERS.items()
+    )
+    for name, (dumps, loads) in formats.items():
+        encoded = dumps(data)
+        print(
+            f"{name:<18} {len(encoded) / 1024:>11.1f}"
+            f" {measure(number, dumps, data):>12.3f}"
+            f" {measure(number, loads, encoded):>12.3f}"
+        )
+
+
+def bench_responses(data: dict, number: int):
+    payload = {
+        "message": "Fetched monitoring patients successfully.",
+        "patient_accounts": [[patient, "password"] for patient in data],
+        "patient_records": data,
+        "partial_records": [],
+        "revisions": dict.fromkeys(data, 1_700_000_000_000_000),
+    }
+    print(f"\n{'response':<26} {'render (ms)':>12}")
+    print(
+        f"{'jsonable_encoder + json':<26}"
+        f" {measure(number, lambda: JSONResponse(jsonable_encoder(payload))):>12.3f}"
+    )
+    for name in ENCODERS:
+        serialization.use(name)
+        print(
+            f"{'pre-encoded, ' + name:<26}"
+            f" {measure(number, EncodedJSONResponse, payload):>12.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=40)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--items", type=int, default=8, help="items per day")
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    data = make_ward(args.patients, args.days, args.items)
+    bench_files(data, args.number)
+    bench_responses(data, args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark `update_record` validation against the length of the history.
+
+Compares validating a whole patient document, as every save used to, with
+the incremental mode that only validates the days changed since the last
+accepted version. Run it from the `backend` directory:
+
+    python -m benchmarks.validation
+"""
+
+import argparse
+import copy
+import timeit
+from datetime import date, timedelta
+
+from validator import UpdateDataModel, validation_context
+
+SETTINGS = {
+    "isEditing": False,
+    "limitAmount": "",
+    "foodCheckboxChecked": False,
+    "waterCheckboxChecked": False,
+}
+
+
+def make_document(days: int, items: int) -> dict:
+    """Return a valid patient document with `days` days of `items` items."""
+    document = dict(SETTINGS)
+    today = date.today()
+    for offset in range(days, 0, -1):
+        day = today - timedelta(days=offset)
+        data = [
+            {
+                "time": f"{hour % 24:02}:00",
+                "food": 100,
+                "water": 200,
+                "urination": 1,
+                "defecation": 0,
+            }
+            for hour in range(8, 8 + items)
+        ]
+        document[f"{day.year}_{day.month}_{day.day}"] = {
+            "data": data,
+            "count": items,
+            "recordDate": f"{day.month}/{day.day}",
+            "foodSum": 100 * items,
+            "waterSum": 200 * items,
+            "urinationSum": items,
+            "defecationSum": 0,
+            "weight": "60 kg",
+        }
+    return document
+
+
+def bench(days: int, items: int, number: int) -> tuple[float, float]:
+    previous = make_document(days, items)
+    # The client sends the whole document back with the latest day changed
+    document = copy.deepcopy(previous)
+    latest = list(document)[-1]
+    if isinstance(document[latest], dict):
+        document[latest]["weight"] = "61 kg"
+
+    full = timeit.timeit(
+        lambda: UpdateDataModel.model_validate(document), number=number
+    )
+    incremental = timeit.timeit(
+        lambda: UpdateDataModel.model_validate(
+            document, context=validation_context(previous)
+        ),
+        number=number,
+    )
+    return full / number, incremental / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--days", type=int, nargs="+", default=[1, 10, 30, 90, 180, 270]
+    )
+    parser.add_argument("--items", type=int, default=8, help="items per day")
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    # `recordDate` has no year, so the history has to stay in this year
+    max_days = date.today().timetuple().tm_yday - 1
+
+    print(
+        f"{'days':>6} {'full (ms)':>12} {'incremental (ms)':>18} {'speedup':>8}"
+    )
+    for days in sorted({min(days, max_days) for days in args.days}):
+        full, incremental = bench(days, args.items, args.number)
+        print(
+            f"{days:>6} {full * 1000:>12.3f} {incremental * 1000:>18.3f}"
+            f" {full / incremental:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
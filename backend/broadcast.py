@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+
+class Subscription:
+    """Record changes waiting to be pushed to one connected client."""
+
+    def __init__(self, account: str, patients: list[str]):
+        self.account = account
+        self.patients = set(patients)
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[tuple[str, str, str | None] | None] = (
+            asyncio.Queue()
+        )
+
+    async def get(self) -> tuple[str, str, str | None] | None:
+        """Wait for the next `(event, patient, monitor)` change.
+
+        Returns None once the subscription is closed.
+        """
+        return await self.queue.get()
+
+
+class Broadcaster:
+    """Fans out record changes to the subscribed push clients.
+
+    `publish` may be called from any thread; the change is queued on the
+    event loop that owns each subscription.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions: set[Subscription] = set()
+
+    def subscribe(self, account: str, patients: list[str]) -> Subscription:
+        subscription = Subscription(account, patients)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event: str, patient: str, monitor: str | None = None):
+        """Queue `event` for subscribers of `patient`.
+
+        Relation changes pass the `monitor` whose patient list changed so
+        its subscriptions are notified even if they do not hold the
+        patient yet.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if patient in subscription.patients or (
+                monitor is not None and subscription.account == monitor
+            ):
+                subscription.loop.call_soon_threadsafe(
+                    subscription.queue.put_nowait, (event, patient, monitor)
+                )
+
+    def close_account(self, account: str):
+        """End the subscriptions of `account`, e.g. once it is revoked."""
+        with self._lock:
+            subscriptions = [
+                subscription
+                for subscription in self._subscriptions
+                if subscription.account == account
+            ]
+            self._subscriptions.difference_update(subscriptions)
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(
+                subscription.queue.put_nowait, None
+            )
@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+import time
+
+CONFIG_JSON_PATH = "./config.json"  # Token, API URL and tuning options
+
+# Seconds between checks of `config.json` for changes
+CONFIG_CHECK_INTERVAL = 1.0
+
+
+class Config:
+    """`config.json` parsed once and kept in memory.
+
+    The file's mtime is checked at most every `check_interval` seconds and
+    the file is parsed again only when it changed, so a new token takes
+    effect without a restart. `reload` forces a re-read. A file that fails
+    to parse while being edited, or disappears while being replaced, keeps
+    the previous values.
+    """
+
+    def __init__(
+        self, path: str, check_interval: float = CONFIG_CHECK_INTERVAL
+    ):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._data: dict = {}
+        self._mtime: int | None = None
+        self._checked = 0.0
+        self.reload()
+
+    def reload(self):
+        """Re-read the file now."""
+        with self._lock:
+            self._checked = time.monotonic()
+            self._load(os.stat(self.path).st_mtime_ns)
+
+    def _load(self, mtime: int):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            if self._mtime is None:
+                raise
+            return
+        self._data = data
+        self._mtime = mtime
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return
+            if mtime != self._mtime:
+                self._load(mtime)
+
+    def get(self, key: str, default=None):
+        self._refresh()
+        return self._data.get(key, default)
+
+    def __getitem__(self, key: str):
+        self._refresh()
+        return self._data[key]
+
+
+config = Config(CONFIG_JSON_PATH)
@@ -1,22 +1,57 @@
-import json
-
-with open("./config.json") as file:
-    config = json.load(file)
+from config import config
 
 API_URL = config.get("api_url", "")
 
 if not API_URL:
     raise ValueError("api_url is not set in the config file")
 
+# Where patient records are persisted: "json" (`data.json`) or "sqlite"
+RECORD_BACKEND = config.get("record_backend", "json")
+
+if RECORD_BACKEND not in ["json", "sqlite"]:
+    raise ValueError(f"Invalid record_backend: `{RECORD_BACKEND}`")
+
+# Seconds between write-behind flushes of the records, 0 writes through
+RECORD_FLUSH_INTERVAL = config.get("record_flush_interval", 1.0)
+# fsync the records after every flush
+RECORD_FSYNC = config.get("record_fsync", False)
+# Bytes of `data.json.journal` after which it is compacted into `data.json`
+RECORD_JOURNAL_SIZE = config.get("record_journal_size", 4 * 1024 * 1024)
+
+# JSON encoder: "orjson" or "json", defaults to orjson when installed
+JSON_ENCODER = config.get("json_encoder")
+
+# Seconds between keep-alive comments on idle push streams
+PUSH_KEEPALIVE_INTERVAL = config.get("push_keepalive_interval", 15.0)
+
+# Seconds a login session stays valid without being used
+SESSION_TTL = config.get("session_ttl", 900.0)
+
+# Threads running accounts.db queries and record writes for the handlers
+IO_THREADS = config.get("io_threads", 8)
+
+# Record fetch responses kept with their compressed bodies
+RESPONSE_CACHE_SIZE = config.get("response_cache_size", 1024)
+
+# Lowest level logged: "DEBUG", "INFO", "WARNING" or "ERROR"
+LOG_LEVEL = config.get("log_level", "INFO")
+# Fraction of the DEBUG records, such as authentications, that are logged
+LOG_SAMPLE_RATE = config.get("log_sample_rate", 1.0)
+
+# Operations accepted in one `batch` request
+BATCH_MAX_OPERATIONS = 20
+
 API_PORT = 8000
 FRONTEND_PORT = 5500
 
 # Paths
 DATA_JSON_PATH = "./data.json"  # Patient data
+RECORDS_DB_PATH = "./records.db"  # Patient data, one row per patient-day
 ACCT_REL_JSON_PATH = "./account_relations.json"  # Monitor <-> Patients
-CONFIG_JSON_PATH = "./config.json"  # Token
 
 # Events
+LOGIN = "login"
+LOGOUT = "logout"
 SIGN_UP_MONITOR = "sign_up_monitor"
 SIGN_UP_PATIENT = "sign_up_patient"
 ADD_PATIENT = "add_patient"
@@ -25,11 +60,15 @@ DELETE_PATIENT = "delete_patient"
 DELETE_MONITOR = "delete_monitor"
 SET_RESTRICTS = "set_restricts"
 UPDATE_RECORD = "update_record"
+PATCH_RECORD = "patch_record"
 FETCH_RECORD = "fetch_record"
 FETCH_MONITORING_PATIENTS = "fetch_monitoring_patients"
 FETCH_UNMONITORED_PATIENTS = "fetch_unmonitored_patients"
+FETCH_SUMMARY = "fetch_summary"
 CHANGE_PASSWORD = "change_password"
 CHANGE_USERNAME = "change_username"
+EVENT_STATS = "event_stats"
+BATCH = "batch"
 
 # Messages
 ACCT_CREATED = "Account created."
@@ -41,6 +80,8 @@ ACCT_CHANGE_SUCCESS = "Account changed successfully."
 
 AUTH_SUCCESS = "Authentication successful."
 AUTH_FAIL_PASSWORD = "Incorrect password."
+SESSION_EXPIRED = "Session expired."
+LOGOUT_SUCCESS = "Logged out."
 
 ADD_PATIENT_SUCCESS = "Patient added to monitor list."
 REMOVE_PATIENT_SUCCESS = "Patient removed from monitor list."
@@ -48,11 +89,21 @@ DELETE_PATIENT_SUCCESS = "Patient account deleted."
 DELETE_MONITOR_SUCCESS = "Monitor account deleted."
 SET_RESTRICTS_SUCCESS = "Restrictions set."
 UPDATE_RECORD_SUCCESS = "Update successful."
+UPDATE_CONFLICT = "Record changed by another client."
+PATCH_RECORD_SUCCESS = "Patch successful."
 FETCH_RECORD_SUCCESS = "Fetch successful."
 FETCH_MONITORING_PATIENTS_SUCCESS = "Fetched monitoring patients successfully."
 FETCH_UNMONITORED_PATIENTS_SUCCESS = (
     "Fetched all unmonitored patients successfully."
 )
+FETCH_SUMMARY_SUCCESS = "Fetched summaries successfully."
+EVENT_STATS_SUCCESS = "Fetched event statistics successfully."
+BATCH_SUCCESS = "Batch handled."
+INVALID_BATCH = "Invalid batch."
+INVALID_PATIENTS = "Invalid patients."
+
+NOT_MODIFIED = "Not modified."
+INVALID_DATE_RANGE = "Invalid date range."
 
 MISSING_PARAMETER = "Missing parameter."
 INVALID_EVENT = "Invalid event."
@@ -1,5 +1,8 @@
+import json
 import sqlite3
+import threading
 
+import logs
 from constants import (
     ACCT_ALREADY_EXISTS,
     ACCT_CREATED,
@@ -11,14 +14,63 @@ from constants import (
 
 ACCOUNTS_DB = "accounts.db"
 
+logger = logs.get_logger("db")
+
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_generation = 0
+
 
 class AccountType:
     PATIENT = "PATIENT"
     MONITOR = "MONITOR"
 
 
+def get_connection() -> sqlite3.Connection:
+    """Return this thread's connection to `ACCOUNTS_DB`.
+
+    Connections are opened once per thread and kept, together with their
+    prepared statement cache, instead of reconnecting on every call.
+    """
+    conn = getattr(_local, "conn", None)
+    if (
+        conn is not None
+        and _local.path == ACCOUNTS_DB
+        and _local.generation == _generation
+    ):
+        return conn
+
+    conn = sqlite3.connect(
+        ACCOUNTS_DB, check_same_thread=False, cached_statements=256
+    )
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -8000")
+    with _connections_lock:
+        _connections.append(conn)
+        _local.conn, _local.path, _local.generation = (
+            conn,
+            ACCOUNTS_DB,
+            _generation,
+        )
+    return conn
+
+
+def close_connections():
+    """Close the connections of every thread, e.g. before removing the DB."""
+    global _generation
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+        _generation += 1
+
+
 def create_table():
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
@@ -30,11 +82,56 @@ def create_table():
             )
             """
         )
+        # Monitor <-> patient relations, indexed both ways
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS monitor_patients (
+                monitor TEXT NOT NULL,
+                patient TEXT NOT NULL,
+                PRIMARY KEY (monitor, patient)
+            ) WITHOUT ROWID
+            """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS monitor_patients_patient
+            ON monitor_patients (patient)
+            """
+        )
         conn.commit()
 
 
+def migrate_relations(path: str):
+    """Import the relations in `account_relations.json` once.
+
+    The import is recorded in the database's `user_version`, so the file is
+    never read again and can be removed afterwards.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= 1:
+            return
+
+        try:
+            with open(path) as file:
+                monitor_accounts = json.load(file)["monitor_accounts"]
+        except FileNotFoundError:
+            monitor_accounts = {}
+
+        cursor.executemany(
+            "INSERT OR IGNORE INTO monitor_patients (monitor, patient) VALUES (?, ?)",
+            [
+                (monitor, patient)
+                for monitor, patients in monitor_accounts.items()
+                for patient in patients
+            ],
+        )
+        cursor.execute("PRAGMA user_version = 1")
+
+
 def add_account(username: str, password: str, account_type: str):
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         try:
             cursor.execute(
@@ -42,55 +139,54 @@ def add_account(username: str, password: str, account_type: str):
                 (username, password, account_type),
             )
             conn.commit()
-            print(ACCT_CREATED)
+            logger.info(ACCT_CREATED, extra={"account": username})
             return ACCT_CREATED
         except sqlite3.IntegrityError:
-            print(ACCT_ALREADY_EXISTS)
+            logger.info(ACCT_ALREADY_EXISTS, extra={"account": username})
             return ACCT_ALREADY_EXISTS
 
 
 def delete_account(username: str):
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         try:
             cursor.execute(
                 "DELETE FROM accounts WHERE username = ?", (username,)
             )
+            cursor.execute(
+                "DELETE FROM monitor_patients WHERE monitor = ? OR patient = ?",
+                (username, username),
+            )
             conn.commit()
-            print(ACCT_DELETED)
+            logger.info(ACCT_DELETED, extra={"account": username})
             return ACCT_DELETED
         except sqlite3.IntegrityError:
-            print(ACCT_NOT_EXIST)
+            logger.info(ACCT_NOT_EXIST, extra={"account": username})
             return ACCT_NOT_EXIST
 
 
 def authenticate(username: str, password: str) -> str:
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT * FROM accounts WHERE username = ?",
+            "SELECT password FROM accounts WHERE username = ?",
             (username,),
         )
         account = cursor.fetchone()
         if not account:
-            print(ACCT_NOT_EXIST)
+            logger.debug(ACCT_NOT_EXIST, extra={"account": username})
             return ACCT_NOT_EXIST
 
-        cursor.execute(
-            "SELECT * FROM accounts WHERE username = ? AND password = ?",
-            (username, password),
-        )
-        account = cursor.fetchone()
-        if account:
-            print(AUTH_SUCCESS)
+        if account[0] == password:
+            logger.debug(AUTH_SUCCESS, extra={"account": username})
             return AUTH_SUCCESS
         else:
-            print(AUTH_FAIL_PASSWORD)
+            logger.debug(AUTH_FAIL_PASSWORD, extra={"account": username})
             return AUTH_FAIL_PASSWORD
 
 
 def change_account_password(username: str, password: str):
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE accounts SET password = ? WHERE username = ?",
@@ -99,16 +195,24 @@ def change_account_password(username: str, password: str):
 
 
 def change_account_username(username: str, new_username: str):
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE accounts SET username = ? WHERE username = ?",
             (new_username, username),
         )
+        cursor.execute(
+            "UPDATE monitor_patients SET monitor = ? WHERE monitor = ?",
+            (new_username, username),
+        )
+        cursor.execute(
+            "UPDATE monitor_patients SET patient = ? WHERE patient = ?",
+            (new_username, username),
+        )
 
 
 def get_account_type(username: str) -> str | None:
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT account_type FROM accounts WHERE username = ?",
@@ -122,7 +226,7 @@ def get_account_type(username: str) -> str | None:
 
 
 def get_password(username: str) -> str | None:
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT password FROM accounts WHERE username = ?",
@@ -135,8 +239,46 @@ def get_password(username: str) -> str | None:
             return password[0]
 
 
+def get_credentials(username: str) -> tuple[str, str] | None:
+    """Return the password and account type of `username` in one query."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT password, account_type FROM accounts WHERE username = ?",
+            (username,),
+        )
+        return cursor.fetchone()
+
+
+# Usernames bound per query, below SQLite's default variable limit
+_BATCH_SIZE = 500
+
+
+def get_accounts_by_username(
+    usernames: list[str],
+) -> dict[str, tuple[str, str]]:
+    """Return the password and account type of every existing username.
+
+    The lookup takes a single `IN (...)` query per `_BATCH_SIZE` usernames;
+    usernames without an account are left out.
+    """
+    accounts = {}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for start in range(0, len(usernames), _BATCH_SIZE):
+            batch = usernames[start : start + _BATCH_SIZE]
+            cursor.execute(
+                "SELECT username, password, account_type FROM accounts"
+                f" WHERE username IN ({', '.join('?' * len(batch))})",
+                batch,
+            )
+            for username, password, account_type in cursor.fetchall():
+                accounts[username] = (password, account_type)
+    return accounts
+
+
 def get_all_accounts():
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM accounts")
         accounts = cursor.fetchall()
@@ -144,7 +286,7 @@ def get_all_accounts():
 
 
 def get_patient_accounts():
-    with sqlite3.connect(ACCOUNTS_DB) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT * FROM accounts WHERE account_type = ?",
@@ -154,4 +296,53 @@ def get_patient_accounts():
         return patient_accounts
 
 
+def add_monitored_patient(monitor: str, patient: str) -> bool:
+    """Add `patient` to `monitor`'s list, False if it was already there."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR IGNORE INTO monitor_patients (monitor, patient) VALUES (?, ?)",
+            (monitor, patient),
+        )
+        return cursor.rowcount == 1
+
+
+def remove_monitored_patient(monitor: str, patient: str) -> bool:
+    """Remove `patient` from `monitor`'s list, False if it was not there."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM monitor_patients WHERE monitor = ? AND patient = ?",
+            (monitor, patient),
+        )
+        return cursor.rowcount == 1
+
+
+def get_monitored_patients(monitor: str) -> list[str]:
+    """Return the patients of `monitor`, sorted by account name."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT patient FROM monitor_patients WHERE monitor = ? ORDER BY patient",
+            (monitor,),
+        )
+        return [patient for (patient,) in cursor.fetchall()]
+
+
+def get_unmonitored_patient_accounts():
+    """Return the patient accounts no monitor is following."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT * FROM accounts
+            WHERE account_type = ? AND NOT EXISTS (
+                SELECT 1 FROM monitor_patients WHERE patient = username
+            )
+            """,
+            (AccountType.PATIENT,),
+        )
+        return cursor.fetchall()
+
+
 create_table()
@@ -0,0 +1,94 @@
+"""Registry of the events handled by `POST /`.
+
+Handlers are registered under their event name together with what
+`handle_request` checks before calling them: how the caller
+authenticates, the `AccountType` it must have and the parameters the
+request must carry. Handlers registered with `admin=True` serve requests
+carrying the token from `config.json`, and handlers registered with an
+`etag` function answer conditional requests (see `httpcache`).
+"""
+
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from metrics import Histogram
+
+# How the caller of a handler is authenticated
+AUTH_NONE = "none"
+AUTH_PASSWORD = "password"  # `account`/`password`
+AUTH_SESSION = "session"  # `session` token or `account`/`password`
+
+
+@dataclass
+class Handler:
+    event: str
+    func: Callable[..., Awaitable]
+    auth: str
+    account_type: str | None
+    params: list[str]
+    # Returns the view key and ETag of a request, None to skip caching
+    etag: Callable[..., Awaitable[tuple[bytes, str] | None]] | None = None
+
+
+class Dispatcher:
+    """Handler tables and the time spent in each event.
+
+    Latencies go to `histogram`, labelled by event; pass a registered
+    histogram to export them at `/metrics`.
+    """
+
+    def __init__(self, histogram: Histogram | None = None):
+        self.handlers: dict[str, Handler] = {}
+        self.admin_handlers: dict[str, Handler] = {}
+        self.histogram = histogram or Histogram(
+            "event_duration_seconds",
+            "Time spent handling each event.",
+            ["event"],
+        )
+
+    def register(
+        self,
+        event: str,
+        *,
+        auth: str = AUTH_SESSION,
+        account_type: str | None = None,
+        params: list[str] | None = None,
+        admin: bool = False,
+        etag: Callable[..., Awaitable[tuple[bytes, str] | None]] | None = None,
+    ):
+        """Decorator registering the handler of `event`."""
+
+        def decorator(func):
+            handlers = self.admin_handlers if admin else self.handlers
+            handlers[event] = Handler(
+                event, func, auth, account_type, params or [], etag
+            )
+            return func
+
+        return decorator
+
+    def find(self, event, admin: bool) -> Handler | None:
+        """Return the handler of `event`, preferring admin handlers."""
+        if not isinstance(event, str):
+            return None
+        if admin and event in self.admin_handlers:
+            return self.admin_handlers[event]
+        return self.handlers.get(event)
+
+    def observe(self, event: str, seconds: float):
+        """Count one call of a registered `event` taking `seconds`."""
+        self.histogram.observe(seconds, event)
+
+    def latency(self) -> dict[str, dict]:
+        """Return the latency of every registered event."""
+        summary = self.histogram.summary()
+        latency = {}
+        for event in self.handlers.keys() | self.admin_handlers.keys():
+            stats = summary.get(
+                (event,), {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            stats["mean"] = (
+                stats["total"] / stats["count"] if stats["count"] else 0.0
+            )
+            latency[event] = stats
+        return latency
@@ -0,0 +1,157 @@
+"""Conditional and compressed responses of the record fetches.
+
+A handler registered with an `etag` function gets a view key and a strong
+ETag for the request before it runs. The key identifies what the caller
+asked for (event, account and parameters), and the ETag also covers the
+revisions of the records it returns, so it changes with every write to
+them. A request whose `If-None-Match` holds the current ETag gets a 304
+without the handler running.
+
+Requests with `since` are left out: their responses already hold only
+what changed and a "Not modified." message when nothing did.
+
+The last body of each view is kept in a `ResponseCache` together with
+its gzip (and, when the brotli package is installed, brotli) encodings,
+which are compressed once per body. A write changes the ETag, so the
+next request for the view replaces the entry. Large bodies of the other
+responses are compressed on every request.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any
+
+import serialization
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+# Request keys that only authenticate the caller
+CREDENTIALS = {"account", "password", "session", "token"}
+
+# Preferred encodings first
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def view_key(event: str, account: str, post_request: dict) -> bytes:
+    """Identify the response `account` asked for, whoever's records."""
+    params = sorted(
+        (key, value)
+        for key, value in post_request.items()
+        if key not in CREDENTIALS
+    )
+    return serialization.dumps([event, account, params])
+
+
+def make_etag(key: bytes, state: Any) -> str:
+    """Return the strong ETag of the view `key` given the `state` it has."""
+    digest = hashlib.blake2b(key, digest_size=16)
+    digest.update(serialization.dumps(state))
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an `If-None-Match` header holds `etag` (weak comparison)."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def choose_encoding(accept_encoding: str | None) -> str | None:
+    """Return the preferred encoding the client accepts, if any."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, *params = [value.strip() for value in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    for encoding in ENCODINGS:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def encoding_for(body: bytes, accept_encoding: str | None) -> str | None:
+    """Return the `Content-Encoding` to send `body` with, if any."""
+    if len(body) < MIN_COMPRESS_SIZE:
+        return None
+    return choose_encoding(accept_encoding)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+class CachedBody:
+    """A response body and its encodings, compressed on first use."""
+
+    __slots__ = ("etag", "body", "_encoded")
+
+    def __init__(self, etag: str, body: bytes):
+        self.etag = etag
+        self.body = body
+        self._encoded: dict[str, bytes] = {}
+
+    def encoding_for(self, accept_encoding: str | None) -> str | None:
+        return encoding_for(self.body, accept_encoding)
+
+    def get(self, encoding: str | None) -> bytes | None:
+        """Return the body in `encoding` if it is already compressed."""
+        if encoding is None:
+            return self.body
+        return self._encoded.get(encoding)
+
+    def compress(self, encoding: str) -> bytes:
+        encoded = self._encoded[encoding] = compress(self.body, encoding)
+        return encoded
+
+
+class ResponseCache:
+    """The last body of up to `size` views, least recently used dropped."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._lock = threading.Lock()
+        self._bodies: OrderedDict[bytes, CachedBody] = OrderedDict()
+
+    def get(self, key: bytes, etag: str) -> CachedBody | None:
+        with self._lock:
+            cached = self._bodies.get(key)
+            if cached is None or cached.etag != etag:
+                return None
+            self._bodies.move_to_end(key)
+            return cached
+
+    def put(self, key: bytes, etag: str, body: bytes) -> CachedBody:
+        cached = CachedBody(etag, body)
+        if self.size <= 0:
+            return cached
+        with self._lock:
+            self._bodies[key] = cached
+            self._bodies.move_to_end(key)
+            while len(self._bodies) > self.size:
+                self._bodies.popitem(last=False)
+        return cached
+
+    def __len__(self) -> int:
+        return len(self._bodies)
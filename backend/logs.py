@@ -0,0 +1,117 @@
+"""Logging for the backend.
+
+Modules log through `get_logger`. Records are put on a queue and written
+to stderr by a background thread, so a request never waits for the
+terminal or the container runtime. Every line is a JSON object with the
+time, level, logger and message plus the record's `extra` fields.
+
+Authentication is logged at DEBUG and dropped at the default level.
+With `log_level` set to "DEBUG", `log_sample_rate` keeps only that
+fraction of the DEBUG records so the hot path can be watched without
+logging every poll.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from typing import TextIO
+
+LOGGER_NAME = "pior"
+
+# Attributes every `LogRecord` has; the others come from `extra`
+_RECORD_ATTRIBUTES = set(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None))
+) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Queue records with their traceback apart from the message.
+
+    The stock handler formats the traceback into the message, so the
+    listener could not write it as the "exception" field.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+        # Tracebacks keep every frame alive until the record is written
+        record.exc_info = None
+        return record
+
+
+class SampleFilter(logging.Filter):
+    """Keep `rate` of the DEBUG records and every record above DEBUG."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def setup(
+    level: str = "INFO", sample_rate: float = 1.0, stream: TextIO | None = None
+):
+    """Write the backend's records at `level` and above to `stream`."""
+    global _listener
+    shutdown()
+
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    queue_handler.addFilter(SampleFilter(sample_rate))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.propagate = False
+    logger.handlers = [queue_handler]
+
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+
+def shutdown():
+    """Write the queued records and stop the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
@@ -1,6 +1,17 @@
-import json
+import asyncio
+import time
+from collections.abc import AsyncIterator, Awaitable
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
 
+import aio
 import db
+import httpcache
+import logs
+import metrics
+import serialization
+from broadcast import Broadcaster
+from config import config
 from constants import (
     ACCT_ALREADY_EXISTS,
     ACCT_CHANGE_SUCCESS,
@@ -10,391 +21,1094 @@ from constants import (
     ACCT_REL_JSON_PATH,
     ADD_PATIENT,
     ADD_PATIENT_SUCCESS,
+    AUTH_FAIL_PASSWORD,
     AUTH_SUCCESS,
+    BATCH,
+    BATCH_MAX_OPERATIONS,
+    BATCH_SUCCESS,
     CHANGE_PASSWORD,
     CHANGE_USERNAME,
-    CONFIG_JSON_PATH,
     DATA_JSON_PATH,
     DELETE_MONITOR,
     DELETE_MONITOR_SUCCESS,
     DELETE_PATIENT,
     DELETE_PATIENT_SUCCESS,
+    EVENT_STATS,
+    EVENT_STATS_SUCCESS,
     FETCH_MONITORING_PATIENTS,
     FETCH_MONITORING_PATIENTS_SUCCESS,
     FETCH_RECORD,
     FETCH_RECORD_SUCCESS,
+    FETCH_SUMMARY,
+    FETCH_SUMMARY_SUCCESS,
     FETCH_UNMONITORED_PATIENTS,
     FETCH_UNMONITORED_PATIENTS_SUCCESS,
     FRONTEND_PORT,
     INVALID_ACCT_TYPE,
+    INVALID_BATCH,
+    INVALID_DATE_RANGE,
     INVALID_EVENT,
+    INVALID_PATIENTS,
+    JSON_ENCODER,
+    LOG_LEVEL,
+    LOG_SAMPLE_RATE,
+    LOGIN,
+    LOGOUT,
+    LOGOUT_SUCCESS,
     MISSING_PARAMETER,
+    NOT_MODIFIED,
+    PATCH_RECORD,
+    PATCH_RECORD_SUCCESS,
+    PUSH_KEEPALIVE_INTERVAL,
+    RECORD_BACKEND,
+    RECORD_FLUSH_INTERVAL,
+    RECORD_FSYNC,
+    RECORD_JOURNAL_SIZE,
+    RECORDS_DB_PATH,
     REMOVE_PATIENT,
     REMOVE_PATIENT_SUCCESS,
+    RESPONSE_CACHE_SIZE,
+    SESSION_EXPIRED,
+    SESSION_TTL,
     SET_RESTRICTS,
     SIGN_UP_MONITOR,
     SIGN_UP_PATIENT,
+    UPDATE_CONFLICT,
     UPDATE_RECORD,
     UPDATE_RECORD_SUCCESS,
 )
+from dispatch import AUTH_NONE, AUTH_PASSWORD, AUTH_SESSION, Dispatcher, Handler
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import ValidationError
-from validator import UpdateDataModel
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from serialization import EncodedJSONResponse
+from sessions import SessionTable
+from starlette.datastructures import Headers
+from store import JsonFileBackend, RecordStore, SqliteBackend
+from validator import (
+    PatchModel,
+    UpdateDataModel,
+    apply_patch,
+    parse_date_key,
+    validation_context,
+)
+
+logs.setup(LOG_LEVEL, LOG_SAMPLE_RATE)
+logger = logs.get_logger("main")
+
+if JSON_ENCODER is not None:
+    serialization.use(JSON_ENCODER)
 
-app = FastAPI()
+db.migrate_relations(ACCT_REL_JSON_PATH)
+broadcaster = Broadcaster()
+sessions = SessionTable(SESSION_TTL)
+responses = httpcache.ResponseCache(RESPONSE_CACHE_SIZE)
+# Opened at startup, so importing the app leaves the record files alone
+records: RecordStore
+
+
+def open_records() -> RecordStore:
+    """Load the configured records, taking the lock on their files."""
+    if RECORD_BACKEND == "sqlite":
+        backend = SqliteBackend(RECORDS_DB_PATH, fsync=RECORD_FSYNC)
+    else:
+        backend = JsonFileBackend(
+            DATA_JSON_PATH,
+            fsync=RECORD_FSYNC,
+            compact_size=RECORD_JOURNAL_SIZE,
+        )
+    return RecordStore(backend, flush_interval=RECORD_FLUSH_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global records
+    records = open_records()
+    records.start()
+    yield
+    records.close()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*", f"http://localhost:{FRONTEND_PORT}"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 
-def load_json_file(file_path):
-    try:
-        with open(file_path) as file:
-            data = json.load(file)
-    except FileNotFoundError:
-        data = {}
-        if file_path == ACCT_REL_JSON_PATH:
-            data.setdefault("monitor_accounts", {})
-        with open(file_path, "w") as file:
-            json.dump(data, file, indent=4)
-
-    return data
-
-
-def write_json_file(file_path, data):
-    with open(file_path, "w") as file:
-        json.dump(data, file, indent=4)
-
-
-def sign_up_account(account_type: str, account: str, password: str) -> dict:
+async def sign_up_account(
+    account_type: str, account: str, password: str
+) -> dict:
     if account_type not in [
         db.AccountType.PATIENT,
         db.AccountType.MONITOR,
     ]:
         return {"message": INVALID_ACCT_TYPE}
 
-    err = db.add_account(
-        account,
-        password,
-        account_type,
-    )
+    err = await aio.run(db.add_account, account, password, account_type)
     if err != ACCT_CREATED:
         return {"message": ACCT_ALREADY_EXISTS}
 
     if account_type == db.AccountType.PATIENT:
-        data = load_json_file(DATA_JSON_PATH)
-        data[account] = {}
-        write_json_file(DATA_JSON_PATH, data)
-
-    else:
-        account_relations = load_json_file(ACCT_REL_JSON_PATH)
-        account_relations["monitor_accounts"][account] = []
-        write_json_file(ACCT_REL_JSON_PATH, account_relations)
+        await aio.run(records.set, account, {})
 
     return {"message": ACCT_CREATED}
 
 
+async def authorize(
+    post_request: dict,
+) -> tuple[str, str | None, str | None]:
+    """Authenticate the caller by `session` token or `account`/`password`.
+
+    Returns the message, the account and its `AccountType`.
+    """
+    if "session" in post_request:
+        token = post_request["session"]
+        session = sessions.get(token) if isinstance(token, str) else None
+        if session is None:
+            logger.debug(SESSION_EXPIRED)
+            return SESSION_EXPIRED, None, None
+        logger.debug(AUTH_SUCCESS, extra={"account": session.account})
+        return AUTH_SUCCESS, session.account, session.account_type
+
+    if not has_parameters(post_request, ["account", "password"]):
+        return MISSING_PARAMETER, None, None
+
+    account = post_request["account"]
+    credentials = await aio.run(db.get_credentials, account)
+    if credentials is None:
+        logger.debug(ACCT_NOT_EXIST, extra={"account": account})
+        return ACCT_NOT_EXIST, None, None
+
+    password, account_type = credentials
+    if password != post_request["password"]:
+        logger.debug(AUTH_FAIL_PASSWORD, extra={"account": account})
+        return AUTH_FAIL_PASSWORD, None, None
+
+    logger.debug(AUTH_SUCCESS, extra={"account": account})
+    return AUTH_SUCCESS, account, account_type
+
+
+def since_revision(since) -> int | None:
+    if isinstance(since, int) and not isinstance(since, bool):
+        return since
+    return None
+
+
+DATE_RANGE_PARAMETERS = ["from", "to", "limit", "cursor"]
+
+
+def parse_date_range(
+    post_request: dict,
+) -> tuple[date | None, date | None, int | None]:
+    """Parse the `from`/`to` date keys and the page `limit` of a fetch.
+
+    Raises ValueError when one of them is invalid.
+    """
+    start = end = limit = None
+    if "from" in post_request:
+        start = parse_date_key(post_request["from"])
+    if "to" in post_request:
+        end = parse_date_key(post_request["to"])
+    if "limit" in post_request:
+        limit = post_request["limit"]
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            raise ValueError(f"Invalid limit: `{limit}`")
+    return start, end, limit
+
+
+def select_days(
+    patient: str,
+    record: dict | None,
+    date_range: tuple[date | None, date | None, int | None],
+    cursor,
+) -> tuple[dict, str | None]:
+    """Keep the settings of `record` and only the days in `date_range`.
+
+    With a limit the days are paged newest first: the result holds the
+    `limit` latest days before `cursor` and the cursor of the next page,
+    or None on the last page.
+    """
+    start, end, limit = date_range
+    if cursor is not None:
+        before = parse_date_key(cursor) - timedelta(days=1)
+        end = before if end is None else min(end, before)
+
+    keys = records.day_keys(patient, start, end)
+    next_cursor = None
+    if limit is not None and len(keys) > limit:
+        keys = keys[-limit:]
+        next_cursor = keys[0]
+
+    keys = set(keys)
+    return {
+        key: value
+        for key, value in (record or {}).items()
+        if not isinstance(value, dict) or key in keys
+    }, next_cursor
+
+
+def save_record_update(
+    patient_account: str, account_type: str, post_request: dict
+) -> dict:
+    """Validate and store the document of an `update_record` request."""
+    with records.lock(patient_account):
+        original_data = records.get(patient_account) or {}
+        try:
+            with metrics.STAGE_SECONDS.time("validation"):
+                UpdateDataModel.model_validate(
+                    post_request["data"],
+                    context=validation_context(original_data),
+                )
+        except ValidationError as e:
+            return {"message": f"Invalid record format: {e}"}
+
+        update_data = post_request["data"]
+        if account_type == db.AccountType.PATIENT:
+            keys_to_filter = [
+                "isEditing",
+                "limitAmount",
+                "foodCheckboxChecked",
+                "waterCheckboxChecked",
+            ]
+
+            for key in keys_to_filter:
+                if key in update_data and key in original_data:
+                    update_data[key] = original_data[key]
+
+        # `revision` is the revision the client based the document on
+        if "revision" in post_request and records.conflicts(
+            patient_account,
+            since_revision(post_request["revision"]),
+            update_data,
+        ):
+            return {
+                "message": UPDATE_CONFLICT,
+                "revision": records.revision(patient_account),
+            }
+
+        with metrics.STAGE_SECONDS.time("write"):
+            records.set(patient_account, update_data)
+    return {"message": UPDATE_RECORD_SUCCESS}
+
+
+def save_record_patch(patient_account: str, patch: BaseModel) -> dict:
+    """Apply a `patch_record` operation to the stored record."""
+    with records.lock(patient_account):
+        try:
+            with metrics.STAGE_SECONDS.time("validation"):
+                changes = apply_patch(records.get(patient_account) or {}, patch)
+        except ValueError as e:
+            return {"message": f"Invalid record format: {e}"}
+
+        with metrics.STAGE_SECONDS.time("write"):
+            records.update(patient_account, changes)
+    return {"message": PATCH_RECORD_SUCCESS}
+
+
 def has_parameters(post_request: dict, required_parameters: list[str]) -> bool:
     return not any(
         parameter not in post_request for parameter in required_parameters
     )
 
 
+dispatcher = Dispatcher(metrics.EVENT_SECONDS)
+
+
 @app.post("/")
 async def handle_request(request: Request):
     try:
-        post_request = await request.json()
+        with metrics.STAGE_SECONDS.time("parse"):
+            post_request = await request.json()
     except Exception as e:
         return {"message": e}
 
-    token = load_json_file(CONFIG_JSON_PATH).get("token")
+    token = config.get("token")
     post_request_token = post_request.get("token")
     if not token or (post_request_token and post_request_token != token):
         return {"message": "Incorrect token"}
 
     event = post_request.get("event")
-    if post_request_token:
-        if event == SIGN_UP_MONITOR:
-            if not has_parameters(post_request, ["account", "password"]):
-                return {"message": MISSING_PARAMETER}
-
-            return sign_up_account(
-                db.AccountType.MONITOR,
-                post_request["account"],
-                post_request["password"],
-            )
+    handler = dispatcher.find(event, admin=bool(post_request_token))
+    if handler is None:
+        metrics.REQUESTS.inc("unknown")
+        return {"message": INVALID_EVENT}
+
+    return await observe(
+        event, run_handler(handler, post_request, request.headers)
+    )
+
+
+async def observe(event: str, handling: Awaitable):
+    """Await the `handling` of a request, counting it in the metrics."""
+    metrics.REQUESTS.inc(event)
+    start = time.perf_counter()
+    try:
+        return await handling
+    except Exception:
+        metrics.ERRORS.inc(event)
+        raise
+    finally:
+        dispatcher.observe(event, time.perf_counter() - start)
+
+
+async def run_handler(
+    handler: Handler, post_request: dict, headers: Headers | None = None
+):
+    """Authenticate the caller, then handle the request."""
+    account = account_type = None
+    if handler.auth != AUTH_NONE:
+        if handler.auth == AUTH_SESSION:
+            credentials = post_request
+        else:
+            credentials = {
+                key: post_request[key]
+                for key in ["account", "password"]
+                if key in post_request
+            }
+        with metrics.STAGE_SECONDS.time("auth"):
+            err, account, account_type = await authorize(credentials)
+        if err != AUTH_SUCCESS:
+            return {"message": err}
 
-        elif event == DELETE_MONITOR:
-            if not has_parameters(post_request, ["account"]):
-                return {"message": MISSING_PARAMETER}
+    return await call_handler(
+        handler, post_request, account, account_type, headers
+    )
 
-            if (
-                err := db.delete_account(post_request["account"])
-            ) != ACCT_DELETED:
-                return {"message": err}
-            else:
-                return {"message": DELETE_MONITOR_SUCCESS}
 
-        elif event in [CHANGE_PASSWORD, CHANGE_USERNAME]:
-            if not has_parameters(post_request, ["account", "password"]):
-                return {"message": MISSING_PARAMETER}
+async def call_handler(
+    handler: Handler,
+    post_request: dict,
+    account: str | None,
+    account_type: str | None,
+    headers: Headers | None = None,
+):
+    """Check the caller's account type and the parameters, then handle it.
+
+    Given the HTTP request `headers`, handlers registered with an `etag`
+    answer conditional requests and send cached bodies, and large bodies
+    are sent compressed.
+    """
+    if (
+        handler.auth != AUTH_NONE
+        and handler.account_type is not None
+        and account_type != handler.account_type
+    ):
+        return {"message": INVALID_ACCT_TYPE}
 
-            err = db.authenticate(
-                post_request["account"], post_request["password"]
+    if not has_parameters(post_request, handler.params):
+        return {"message": MISSING_PARAMETER}
+
+    if headers is not None and handler.etag is not None:
+        view = await handler.etag(post_request, account, account_type)
+        if view is not None:
+            return await cached_response(
+                handler, post_request, account, account_type, headers, view
             )
-            if err != AUTH_SUCCESS:
-                return {"message": err}
-
-            if event == CHANGE_PASSWORD:
-                if not has_parameters(post_request, ["new_password"]):
-                    return {"message": MISSING_PARAMETER}
-                db.change_account_password(
-                    post_request["account"], post_request["new_password"]
-                )
-            elif event == CHANGE_USERNAME:
-                if not has_parameters(post_request, ["new_account"]):
-                    return {"message": MISSING_PARAMETER}
-                db.change_account_username(
-                    post_request["account"], post_request["new_account"]
-                )
 
-            return {"message": ACCT_CHANGE_SUCCESS}
+    response = await handler.func(post_request, account, account_type)
+    if headers is None or not isinstance(response, EncodedJSONResponse):
+        return response
+    body = response.body
+    encoding = httpcache.encoding_for(body, headers.get("accept-encoding"))
+    if encoding is not None:
+        body = await aio.run(httpcache.compress, body, encoding)
+    return encoded_response(body, encoding, {})
+
+
+def encoded_response(
+    body: bytes, encoding: str | None, headers: dict[str, str]
+) -> Response:
+    headers["Vary"] = "Accept-Encoding"
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def cached_response(
+    handler: Handler,
+    post_request: dict,
+    account: str,
+    account_type: str,
+    headers: Headers,
+    view: tuple[bytes, str],
+):
+    """Answer with a 304 or the cached body of the view, else handle it.
+
+    The ETag is computed before the handler runs, so a body built after
+    a concurrent write is cached under the older ETag and is replaced by
+    the next request.
+    """
+    key, etag = view
+    if httpcache.etag_matches(headers.get("if-none-match"), etag):
+        metrics.RESPONSE_CACHE.inc("not_modified")
+        return Response(status_code=304, headers={"ETag": etag})
+
+    cached = responses.get(key, etag)
+    if cached is not None:
+        metrics.RESPONSE_CACHE.inc("hit")
+    else:
+        response = await handler.func(post_request, account, account_type)
+        # Only successful fetches are encoded up front and cached
+        if not isinstance(response, EncodedJSONResponse):
+            return response
+        metrics.RESPONSE_CACHE.inc("miss")
+        cached = responses.put(key, etag, response.body)
+
+    encoding = cached.encoding_for(headers.get("accept-encoding"))
+    body = cached.get(encoding)
+    if body is None:
+        body = await aio.run(cached.compress, encoding)
+    return encoded_response(body, encoding, {"ETag": etag})
+
+
+@dispatcher.register(
+    SIGN_UP_MONITOR, auth=AUTH_NONE, params=["account", "password"], admin=True
+)
+async def sign_up_monitor(
+    post_request: dict, account: str | None, account_type: str | None
+) -> dict:
+    return await sign_up_account(
+        db.AccountType.MONITOR,
+        post_request["account"],
+        post_request["password"],
+    )
 
-    if event in [
-        FETCH_MONITORING_PATIENTS,
-        FETCH_UNMONITORED_PATIENTS,
-        ADD_PATIENT,
-        REMOVE_PATIENT,
-        DELETE_PATIENT,
-        SET_RESTRICTS,
-        SIGN_UP_PATIENT,
-    ]:
-        if not has_parameters(post_request, ["account", "password"]):
-            return {"message": MISSING_PARAMETER}
 
-        monitor_account = post_request["account"]
-        monitor_password = post_request["password"]
-        err = db.authenticate(monitor_account, monitor_password)
-        if err != AUTH_SUCCESS:
-            return {"message": err}
+@dispatcher.register(
+    DELETE_MONITOR, auth=AUTH_NONE, params=["account"], admin=True
+)
+async def delete_monitor(
+    post_request: dict, account: str | None, account_type: str | None
+) -> dict:
+    if (
+        err := await aio.run(db.delete_account, post_request["account"])
+    ) != ACCT_DELETED:
+        return {"message": err}
+
+    sessions.revoke_account(post_request["account"])
+    broadcaster.close_account(post_request["account"])
+    return {"message": DELETE_MONITOR_SUCCESS}
+
+
+# With the token any account may be changed, without it only patients
+@dispatcher.register(
+    CHANGE_PASSWORD, auth=AUTH_PASSWORD, params=["new_password"], admin=True
+)
+@dispatcher.register(
+    CHANGE_PASSWORD,
+    auth=AUTH_PASSWORD,
+    account_type=db.AccountType.PATIENT,
+    params=["new_password"],
+)
+async def change_password(
+    post_request: dict, account: str, account_type: str
+) -> dict:
+    await aio.run(
+        db.change_account_password, account, post_request["new_password"]
+    )
+    # End the account's streams before they could see the new password
+    sessions.revoke_account(account)
+    broadcaster.close_account(account)
 
-        if db.get_account_type(monitor_account) != db.AccountType.MONITOR:
-            return {"message": INVALID_ACCT_TYPE}
-
-        if event == FETCH_MONITORING_PATIENTS:
-            account_relations = load_json_file(ACCT_REL_JSON_PATH)
-            patient_accounts = []
-            for patient_account in account_relations["monitor_accounts"][
-                monitor_account
-            ]:
-                patient_password = db.get_password(patient_account)
-                if patient_password:
-                    patient_accounts.append(
-                        [patient_account, db.get_password(patient_account)]
-                    )
-
-            data = load_json_file(DATA_JSON_PATH)
-            patient_records = {}
-            for patient_account, _ in patient_accounts:
-                if patient_account not in data:
-                    patient_records[patient_account] = {}
-                else:
-                    patient_records[patient_account] = data[patient_account]
+    await aio.run(records.touch, account)
+    broadcaster.publish(UPDATE_RECORD, account)
+    return {"message": ACCT_CHANGE_SUCCESS}
 
-            return {
-                "message": FETCH_MONITORING_PATIENTS_SUCCESS,
-                "patient_accounts": patient_accounts,
-                "patient_records": patient_records,
-            }
 
-        if event == FETCH_UNMONITORED_PATIENTS:
-            account_list = db.get_patient_accounts()
-            account_relations = load_json_file(ACCT_REL_JSON_PATH)
-            monitored_patients = set()
-            for patients in account_relations["monitor_accounts"].values():
-                monitored_patients.update(patients)
-
-            patient_accounts = [
-                account
-                for account in account_list
-                if account[1]
-                not in monitored_patients  # account[1] -> account name
-            ]
+def rename_account(account: str, new_account: str):
+    """Rename an account together with its monitor relations and record."""
+    with records.lock(account):
+        db.change_account_username(account, new_account)
+        records.rename(account, new_account)
 
-            return {
-                "message": FETCH_UNMONITORED_PATIENTS_SUCCESS,
-                "unmonitored_patients": patient_accounts,
-            }
 
-        if "patient" not in post_request:
-            return {"message": MISSING_PARAMETER}
+@dispatcher.register(
+    CHANGE_USERNAME, auth=AUTH_PASSWORD, params=["new_account"], admin=True
+)
+@dispatcher.register(
+    CHANGE_USERNAME,
+    auth=AUTH_PASSWORD,
+    account_type=db.AccountType.PATIENT,
+    params=["new_account"],
+)
+async def change_username(
+    post_request: dict, account: str, account_type: str
+) -> dict:
+    await aio.run(rename_account, account, post_request["new_account"])
+
+    sessions.revoke_account(account)
+    broadcaster.close_account(account)
+    return {"message": ACCT_CHANGE_SUCCESS}
+
 
-        patient = post_request["patient"]
+@dispatcher.register(LOGIN, auth=AUTH_PASSWORD)
+async def login(post_request: dict, account: str, account_type: str) -> dict:
+    return {
+        "message": AUTH_SUCCESS,
+        "session": sessions.create(account, account_type),
+        "account_type": account_type,
+        "expires_in": SESSION_TTL,
+    }
 
-        if event == ADD_PATIENT:
-            account_type = db.get_account_type(patient)
-            if account_type is None:
-                return {"message": ACCT_NOT_EXIST}
 
-            if account_type != db.AccountType.PATIENT:
-                return {"message": INVALID_ACCT_TYPE}
+@dispatcher.register(LOGOUT, auth=AUTH_NONE, params=["session"])
+async def logout(
+    post_request: dict, account: str | None, account_type: str | None
+) -> dict:
+    if isinstance(post_request["session"], str):
+        sessions.revoke(post_request["session"])
+    return {"message": LOGOUT_SUCCESS}
 
-            account_relations = load_json_file(ACCT_REL_JSON_PATH)
-            if (
-                patient
-                not in account_relations["monitor_accounts"][monitor_account]
-            ):
-                account_relations["monitor_accounts"][monitor_account].append(
-                    patient
+
+@dispatcher.register(
+    FETCH_MONITORING_PATIENTS, account_type=db.AccountType.MONITOR
+)
+async def fetch_monitoring_patients(
+    post_request: dict, monitor_account: str, account_type: str
+):
+    monitored_patients = await aio.run(
+        db.get_monitored_patients, monitor_account
+    )
+    accounts = await aio.run(db.get_accounts_by_username, monitored_patients)
+    patient_accounts = [
+        [patient_account, accounts[patient_account][0]]
+        for patient_account in monitored_patients
+        if patient_account in accounts and accounts[patient_account][0]
+    ]
+
+    # `since` maps each patient to the last revision the client saw
+    since = post_request.get("since")
+    if not isinstance(since, dict):
+        since = None
+
+    date_range = None
+    if any(key in post_request for key in DATE_RANGE_PARAMETERS):
+        cursors = post_request.get("cursor")
+        if not isinstance(cursors, dict):
+            cursors = {}
+        try:
+            date_range = parse_date_range(post_request)
+        except ValueError:
+            return {"message": INVALID_DATE_RANGE}
+
+    patient_records = {}
+    partial_records = []
+    revisions = {}
+    next_cursors = {}
+    for patient_account, _ in patient_accounts:
+        revisions[patient_account] = records.revision(patient_account)
+        changes = records.changes_since(
+            patient_account,
+            since_revision(since.get(patient_account))
+            if since is not None
+            else None,
+        )
+        if changes is None:
+            continue
+        record, partial = changes
+        if date_range is not None:
+            try:
+                record, next_cursor = select_days(
+                    patient_account,
+                    record,
+                    date_range,
+                    cursors.get(patient_account),
                 )
-                account_relations["monitor_accounts"][monitor_account].sort()
+            except ValueError:
+                return {"message": INVALID_DATE_RANGE}
+            if next_cursor is not None:
+                next_cursors[patient_account] = next_cursor
+        patient_records[patient_account] = record or {}
+        if partial:
+            partial_records.append(patient_account)
+
+    if (
+        since is not None
+        and not patient_records
+        and since.keys() == revisions.keys()
+    ):
+        return {"message": NOT_MODIFIED, "revisions": revisions}
+
+    response = {
+        "message": FETCH_MONITORING_PATIENTS_SUCCESS,
+        "patient_accounts": patient_accounts,
+        "patient_records": patient_records,
+        "partial_records": partial_records,
+        "revisions": revisions,
+    }
+    if date_range is not None:
+        response["next_cursors"] = next_cursors
+    return EncodedJSONResponse(response)
+
+
+@dispatcher.register(
+    FETCH_UNMONITORED_PATIENTS, account_type=db.AccountType.MONITOR
+)
+async def fetch_unmonitored_patients(
+    post_request: dict, monitor_account: str, account_type: str
+) -> dict:
+    return {
+        "message": FETCH_UNMONITORED_PATIENTS_SUCCESS,
+        "unmonitored_patients": await aio.run(
+            db.get_unmonitored_patient_accounts
+        ),
+    }
+
+
+@dispatcher.register(
+    ADD_PATIENT, account_type=db.AccountType.MONITOR, params=["patient"]
+)
+async def add_patient(
+    post_request: dict, monitor_account: str, account_type: str
+) -> dict:
+    patient = post_request["patient"]
+    patient_type = await aio.run(db.get_account_type, patient)
+    if patient_type is None:
+        return {"message": ACCT_NOT_EXIST}
+
+    if patient_type != db.AccountType.PATIENT:
+        return {"message": INVALID_ACCT_TYPE}
 
-                write_json_file(ACCT_REL_JSON_PATH, account_relations)
+    if await aio.run(db.add_monitored_patient, monitor_account, patient):
+        broadcaster.publish(ADD_PATIENT, patient, monitor_account)
 
-            return {"message": ADD_PATIENT_SUCCESS}
+    return {"message": ADD_PATIENT_SUCCESS}
 
-        if "patient_password" not in post_request:
-            return {"message": MISSING_PARAMETER}
 
-        patient_password = post_request["patient_password"]
+@dispatcher.register(
+    SIGN_UP_PATIENT,
+    account_type=db.AccountType.MONITOR,
+    params=["patient", "patient_password"],
+)
+async def sign_up_patient(
+    post_request: dict, monitor_account: str, account_type: str
+) -> dict:
+    return await sign_up_account(
+        db.AccountType.PATIENT,
+        post_request["patient"],
+        post_request["patient_password"],
+    )
 
-        if event == SIGN_UP_PATIENT:
-            return sign_up_account(
-                db.AccountType.PATIENT, patient, patient_password
-            )
 
-        err = db.authenticate(patient, patient_password)
-        if err != AUTH_SUCCESS:
-            return {"message": err}
+async def authenticate_patient(post_request: dict) -> str:
+    """Check the `patient_password` a monitor gave for `patient`."""
+    patient = post_request["patient"]
+    err = await aio.run(
+        db.authenticate, patient, post_request["patient_password"]
+    )
+    if err != AUTH_SUCCESS:
+        return err
 
-        if db.get_account_type(patient) != db.AccountType.PATIENT:
-            return {"message": INVALID_ACCT_TYPE}
+    if await aio.run(db.get_account_type, patient) != db.AccountType.PATIENT:
+        return INVALID_ACCT_TYPE
 
-        if event == REMOVE_PATIENT:
-            account_relations = load_json_file(ACCT_REL_JSON_PATH)
-            patient_accounts = account_relations["monitor_accounts"][
-                monitor_account
-            ]
-            if patient in patient_accounts:
-                del account_relations["monitor_accounts"][monitor_account][
-                    patient_accounts.index(patient)
-                ]
-            write_json_file(ACCT_REL_JSON_PATH, account_relations)
-
-            return {"message": REMOVE_PATIENT_SUCCESS}
-
-        if event == DELETE_PATIENT:
-            err = db.delete_account(patient)
-            if err != ACCT_DELETED:
-                return {"message": err}
-
-            account_relations = load_json_file(ACCT_REL_JSON_PATH)
-            for monitor_account, patient_accounts in account_relations[
-                "monitor_accounts"
-            ].items():
-                if patient in patient_accounts:
-                    del account_relations["monitor_accounts"][monitor_account][
-                        patient_accounts.index(patient)
-                    ]
-                    break
-            write_json_file(ACCT_REL_JSON_PATH, account_relations)
-
-            data = load_json_file(DATA_JSON_PATH)
-            if patient in data:
-                del data[patient]
-            write_json_file(DATA_JSON_PATH, data)
+    return AUTH_SUCCESS
 
-            return {
-                "message": DELETE_PATIENT_SUCCESS,
-            }
 
-        if (
-            event == SET_RESTRICTS
-        ):  # Use `UPDATE_RECORD` until we have payload record template verification
-            return {"message": "WIP"}
+@dispatcher.register(
+    REMOVE_PATIENT,
+    account_type=db.AccountType.MONITOR,
+    params=["patient", "patient_password"],
+)
+async def remove_patient(
+    post_request: dict, monitor_account: str, account_type: str
+) -> dict:
+    if (err := await authenticate_patient(post_request)) != AUTH_SUCCESS:
+        return {"message": err}
 
-    elif event in [UPDATE_RECORD, FETCH_RECORD]:
-        if not has_parameters(post_request, ["account", "password", "patient"]):
-            return {"message": MISSING_PARAMETER}
+    patient = post_request["patient"]
+    await aio.run(db.remove_monitored_patient, monitor_account, patient)
+    broadcaster.publish(REMOVE_PATIENT, patient, monitor_account)
 
-        account, password = post_request["account"], post_request["password"]
-        err = db.authenticate(account, password)
-        if err != AUTH_SUCCESS:
-            return {"message": err}
+    return {"message": REMOVE_PATIENT_SUCCESS}
 
-        patient_account = post_request["patient"]
-        if event == UPDATE_RECORD:
-            if db.get_account_type(patient_account) != db.AccountType.PATIENT:
-                return {"message": INVALID_ACCT_TYPE}
 
-            try:
-                UpdateDataModel.model_validate(post_request["data"])
-            except ValidationError as e:
-                return {"message": f"Invalid record format: {e}"}
-
-            data = load_json_file(DATA_JSON_PATH)
-            original_data = data[patient_account]
-            update_data = post_request["data"]
-            if db.get_account_type(account) == db.AccountType.PATIENT:
-                keys_to_filter = [
-                    "isEditing",
-                    "limitAmount",
-                    "foodCheckboxChecked",
-                    "waterCheckboxChecked",
-                ]
-
-                for key in keys_to_filter:
-                    if key in update_data and key in original_data:
-                        update_data[key] = original_data[key]
-
-            data[patient_account] = update_data
-            write_json_file(DATA_JSON_PATH, data)
-
-            return {"message": UPDATE_RECORD_SUCCESS}
-
-        elif event == FETCH_RECORD:
-            if db.get_account_type(patient_account) == db.AccountType.PATIENT:
-                data = load_json_file(DATA_JSON_PATH)
-                return {
-                    "message": FETCH_RECORD_SUCCESS,
-                    "account_records": data[patient_account],
-                }
-            else:
-                return {"message": INVALID_ACCT_TYPE}
-
-    elif event in [CHANGE_PASSWORD, CHANGE_USERNAME]:
-        if not has_parameters(post_request, ["account", "password"]):
-            return {"message": MISSING_PARAMETER}
-
-        err = db.authenticate(post_request["account"], post_request["password"])
-        if err != AUTH_SUCCESS:
-            return {"message": err}
+@dispatcher.register(
+    DELETE_PATIENT,
+    account_type=db.AccountType.MONITOR,
+    params=["patient", "patient_password"],
+)
+async def delete_patient(
+    post_request: dict, monitor_account: str, account_type: str
+) -> dict:
+    if (err := await authenticate_patient(post_request)) != AUTH_SUCCESS:
+        return {"message": err}
 
-        if (
-            db.get_account_type(post_request["account"])
-            != db.AccountType.PATIENT
-        ):
-            return {"message": INVALID_ACCT_TYPE}
+    patient = post_request["patient"]
+    # Also drops the patient from every monitor's list
+    err = await aio.run(db.delete_account, patient)
+    if err != ACCT_DELETED:
+        return {"message": err}
 
-        if event == CHANGE_PASSWORD:
-            if not has_parameters(post_request, ["new_password"]):
-                return {"message": MISSING_PARAMETER}
-            db.change_account_password(
-                post_request["account"], post_request["new_password"]
-            )
-        elif event == CHANGE_USERNAME:
-            if not has_parameters(post_request, ["new_account"]):
-                return {"message": MISSING_PARAMETER}
-            db.change_account_username(
-                post_request["account"], post_request["new_account"]
+    await aio.run(records.delete, patient)
+    sessions.revoke_account(patient)
+    broadcaster.close_account(patient)
+    broadcaster.publish(DELETE_PATIENT, patient)
+
+    return {
+        "message": DELETE_PATIENT_SUCCESS,
+    }
+
+
+@dispatcher.register(
+    SET_RESTRICTS,
+    account_type=db.AccountType.MONITOR,
+    params=["patient", "patient_password"],
+)
+async def set_restricts(
+    post_request: dict, monitor_account: str, account_type: str
+) -> dict:
+    if (err := await authenticate_patient(post_request)) != AUTH_SUCCESS:
+        return {"message": err}
+
+    # Use `UPDATE_RECORD` until we have payload record template verification
+    return {"message": "WIP"}
+
+
+async def get_patient_type(
+    patient_account: str, account: str, account_type: str
+) -> str | None:
+    if patient_account == account:
+        return account_type
+    return await aio.run(db.get_account_type, patient_account)
+
+
+@dispatcher.register(UPDATE_RECORD, params=["patient", "data"])
+async def update_record(
+    post_request: dict, account: str, account_type: str
+) -> dict:
+    patient_account = post_request["patient"]
+    patient_type = await get_patient_type(
+        patient_account, account, account_type
+    )
+    if patient_type != db.AccountType.PATIENT:
+        return {"message": INVALID_ACCT_TYPE}
+
+    response = await aio.run(
+        save_record_update, patient_account, account_type, post_request
+    )
+    if response["message"] != UPDATE_RECORD_SUCCESS:
+        return response
+    broadcaster.publish(UPDATE_RECORD, patient_account)
+
+    return {"message": UPDATE_RECORD_SUCCESS}
+
+
+@dispatcher.register(PATCH_RECORD, params=["patient", "operation"])
+async def patch_record(
+    post_request: dict, account: str, account_type: str
+) -> dict:
+    patient_account = post_request["patient"]
+    patient_type = await get_patient_type(
+        patient_account, account, account_type
+    )
+    if patient_type != db.AccountType.PATIENT:
+        return {"message": INVALID_ACCT_TYPE}
+
+    try:
+        with metrics.STAGE_SECONDS.time("validation"):
+            patch = PatchModel.model_validate(post_request["operation"]).root
+    except ValidationError as e:
+        return {"message": f"Invalid record format: {e}"}
+
+    if patch.op == "set_restricts" and account_type != db.AccountType.MONITOR:
+        return {"message": INVALID_ACCT_TYPE}
+
+    response = await aio.run(save_record_patch, patient_account, patch)
+    if response["message"] != PATCH_RECORD_SUCCESS:
+        return response
+    broadcaster.publish(UPDATE_RECORD, patient_account)
+
+    return {"message": PATCH_RECORD_SUCCESS}
+
+
+async def record_etag(
+    post_request: dict, account: str, account_type: str
+) -> tuple[bytes, str] | None:
+    revision = records.revision(post_request["patient"])
+    if revision is None or "since" in post_request:
+        return None
+    key = httpcache.view_key(FETCH_RECORD, account, post_request)
+    return key, httpcache.make_etag(key, revision)
+
+
+@dispatcher.register(FETCH_RECORD, params=["patient"], etag=record_etag)
+async def fetch_record(post_request: dict, account: str, account_type: str):
+    patient_account = post_request["patient"]
+    patient_type = await get_patient_type(
+        patient_account, account, account_type
+    )
+    if patient_type != db.AccountType.PATIENT:
+        return {"message": INVALID_ACCT_TYPE}
+
+    revision = records.revision(patient_account)
+    changes = records.changes_since(
+        patient_account, since_revision(post_request.get("since"))
+    )
+    if changes is None:
+        return {"message": NOT_MODIFIED, "revision": revision}
+
+    account_records, partial = changes
+    response = {
+        "message": FETCH_RECORD_SUCCESS,
+        "account_records": account_records,
+        "partial": partial,
+        "revision": revision,
+    }
+    if any(key in post_request for key in DATE_RANGE_PARAMETERS):
+        try:
+            (
+                response["account_records"],
+                response["next_cursor"],
+            ) = select_days(
+                patient_account,
+                account_records,
+                parse_date_range(post_request),
+                post_request.get("cursor"),
             )
+        except ValueError:
+            return {"message": INVALID_DATE_RANGE}
+    return EncodedJSONResponse(response)
+
 
-        return {"message": ACCT_CHANGE_SUCCESS}
+@dispatcher.register(FETCH_SUMMARY)
+async def fetch_summary(post_request: dict, account: str, account_type: str):
+    """Today's totals, rolling balances and weight trend per patient.
 
+    A monitor gets the summaries of its monitored patients, a patient its
+    own.
+    """
+    if account_type == db.AccountType.MONITOR:
+        patients = await aio.run(db.get_monitored_patients, account)
     else:
+        patients = [account]
+
+    today = date.today()
+    summaries = {}
+    for patient in patients:
+        if (summary := records.summary(patient, today)) is not None:
+            summaries[patient] = summary
+    return EncodedJSONResponse(
+        {"message": FETCH_SUMMARY_SUCCESS, "summaries": summaries}
+    )
+
+
+@dispatcher.register(BATCH, params=["operations"])
+async def batch(post_request: dict, account: str, account_type: str):
+    """Handle several events of the caller in one request.
+
+    `operations` is a list of requests without credentials, handled in
+    order as the caller authenticated once for the batch. Each sees the
+    changes of the ones before it, and the record changes of all of them
+    are written together. The response holds the response of every
+    operation in `results`.
+    """
+    operations = post_request["operations"]
+    if (
+        not isinstance(operations, list)
+        or not 0 < len(operations) <= BATCH_MAX_OPERATIONS
+        or not all(isinstance(operation, dict) for operation in operations)
+    ):
+        return {"message": INVALID_BATCH}
+
+    results = []
+    try:
+        with records.deferred():
+            for operation in operations:
+                result = await run_operation(operation, account, account_type)
+                results.append(
+                    result.body
+                    if isinstance(result, Response)
+                    else serialization.dumps(result)
+                )
+    finally:
+        await aio.run(records.write_through)
+
+    # The operations' responses are already encoded, so they are joined
+    # instead of decoded and encoded again
+    with metrics.STAGE_SECONDS.time("serialize"):
+        content = b"".join(
+            [
+                b'{"message":',
+                serialization.dumps(BATCH_SUCCESS),
+                b',"results":[',
+                b",".join(results),
+                b"]}",
+            ]
+        )
+    return Response(content, media_type="application/json")
+
+
+async def run_operation(operation: dict, account: str, account_type: str):
+    """Handle one operation of a `batch` for the authenticated caller."""
+    event = operation.get("event")
+    handler = dispatcher.find(event, admin=False)
+    # Events that authenticate differently cannot run in a batch
+    if handler is None or handler.auth != AUTH_SESSION or event == BATCH:
+        metrics.REQUESTS.inc("unknown")
         return {"message": INVALID_EVENT}
+
+    return await observe(
+        event, call_handler(handler, operation, account, account_type)
+    )
+
+
+@dispatcher.register(EVENT_STATS, auth=AUTH_NONE, admin=True)
+async def event_stats(
+    post_request: dict, account: str | None, account_type: str | None
+) -> dict:
+    return {"message": EVENT_STATS_SUCCESS, "latency": dispatcher.latency()}
+
+
+@app.get("/metrics")
+def export_metrics():
+    """Request counters and latency histograms for Prometheus."""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+def format_event(data: dict) -> str:
+    return f"data: {serialization.dumps_str(data)}\n\n"
+
+
+def record_changes(
+    known: dict[str, int | None], patient: str, password: str | None
+) -> str | None:
+    changes = records.changes_since(patient, known.get(patient))
+    if changes is None:
+        return None
+
+    record, partial = changes
+    known[patient] = records.revision(patient)
+    return format_event(
+        {
+            "event": UPDATE_RECORD,
+            "patient": patient,
+            "password": password,
+            "record": record or {},
+            "partial": partial,
+            "revision": known[patient],
+        }
+    )
+
+
+async def record_events(
+    account: str,
+    account_type: str,
+    patients: list[str],
+    known: dict[str, int | None],
+) -> AsyncIterator[str]:
+    # Only a monitor logs in as its patients
+    with_password = account_type == db.AccountType.MONITOR
+    subscription = broadcaster.subscribe(account, patients)
+    try:
+        yield format_event({"message": AUTH_SUCCESS})
+        patients = list(subscription.patients)
+        accounts = {}
+        if with_password:
+            accounts = await aio.run(db.get_accounts_by_username, patients)
+        for patient in patients:
+            password = accounts[patient][0] if patient in accounts else None
+            if event := record_changes(known, patient, password):
+                yield event
+
+        while True:
+            try:
+                change = await asyncio.wait_for(
+                    subscription.get(), PUSH_KEEPALIVE_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if change is None:
+                # The account was revoked
+                return
+
+            event, patient, monitor = change
+
+            if event in [ADD_PATIENT, REMOVE_PATIENT]:
+                if monitor != subscription.account:
+                    continue
+
+            if event == ADD_PATIENT:
+                subscription.patients.add(patient)
+                known[patient] = None
+            elif event in [REMOVE_PATIENT, DELETE_PATIENT]:
+                subscription.patients.discard(patient)
+                known.pop(patient, None)
+                yield format_event({"event": event, "patient": patient})
+                continue
+
+            password = None
+            if with_password:
+                password = await aio.run(db.get_password, patient)
+            if event := record_changes(known, patient, password):
+                yield event
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+@app.post("/events")
+async def push_records(request: Request):
+    """Stream record changes as Server-Sent Events instead of polling.
+
+    The body authenticates like `handle_request` and may list the
+    `patients` to follow (a monitor defaults to its monitored patients, a
+    patient to itself) and the `since` revisions the client already has.
+    Patients the account may not view are left out. Every committed
+    change is then pushed as it happens.
+    """
+    try:
+        post_request = await request.json()
+    except Exception as e:
+        return {"message": e}
+
+    err, account, account_type = await authorize(post_request)
+    if err != AUTH_SUCCESS:
+        return {"message": err}
+
+    if account_type == db.AccountType.MONITOR:
+        patients = await aio.run(db.get_monitored_patients, account)
+    else:
+        patients = [account]
+
+    if "patients" in post_request:
+        requested = post_request["patients"]
+        if not isinstance(requested, list) or not all(
+            isinstance(patient, str) for patient in requested
+        ):
+            return {"message": INVALID_PATIENTS}
+        allowed = set(patients)
+        patients = [
+            patient
+            for patient in dict.fromkeys(requested)
+            if patient in allowed
+        ]
+
+    accounts = await aio.run(db.get_accounts_by_username, patients)
+    patients = [
+        patient
+        for patient in patients
+        if patient in accounts
+        and accounts[patient][1] == db.AccountType.PATIENT
+    ]
+
+    since = post_request.get("since")
+    if not isinstance(since, dict):
+        since = {}
+    known = {
+        patient: since_revision(since.get(patient)) for patient in patients
+    }
+
+    return StreamingResponse(
+        record_events(account, account_type, patients, known),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
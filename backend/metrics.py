@@ -0,0 +1,218 @@
+"""Request metrics exported in the Prometheus text format at `/metrics`.
+
+Counters and histograms are kept in memory with one lock each, so
+recording a sample costs a dict lookup and a few additions and stays
+enabled in production.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    def escape(value: str) -> str:
+        return (
+            value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+        )
+
+    labels = ",".join(
+        f'{name}="{escape(str(value))}"'
+        for name, value in zip(names, values, strict=True)
+    )
+    return f"{{{labels}}}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: list[str]):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}{label_text} {value}")
+        return lines
+
+
+class HistogramSeries:
+    """Samples of a histogram for one set of label values."""
+
+    __slots__ = ("buckets", "count", "sum", "max")
+
+    def __init__(self, size: int):
+        # The last bucket counts samples above every bound (`+Inf`)
+        self.buckets = [0] * (size + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: list[str],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.bounds = buckets
+        self._lock = threading.Lock()
+        self._series: dict[tuple[str, ...], HistogramSeries] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = HistogramSeries(
+                    len(self.bounds)
+                )
+            series.buckets[index] += 1
+            series.count += 1
+            series.sum += value
+            if value > series.max:
+                series.max = value
+
+    def time(self, *labels: str) -> "Timer":
+        """Return a context manager observing the time spent in it."""
+        return Timer(self, labels)
+
+    def summary(self) -> dict[tuple[str, ...], dict]:
+        """Return the count, sum and maximum of every series."""
+        with self._lock:
+            return {
+                labels: {
+                    "count": series.count,
+                    "total": series.sum,
+                    "max": series.max,
+                }
+                for labels, series in self._series.items()
+            }
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = sorted(
+                (labels, list(s.buckets), s.count, s.sum)
+                for labels, s in self._series.items()
+            )
+        for labels, buckets, count, total in series:
+            cumulative = 0
+            for bound, bucket in zip(
+                [*map(str, self.bounds), "+Inf"], buckets, strict=True
+            ):
+                cumulative += bucket
+                bucket_labels = format_labels(
+                    (*self.labelnames, "le"), (*labels, bound)
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+REGISTRY: list[Counter | Histogram] = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render() -> str:
+    """Return every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = register(
+    Counter("pior_requests_total", "Requests to the API by event.", ["event"])
+)
+ERRORS = register(
+    Counter(
+        "pior_request_errors_total",
+        "Requests that failed with an unhandled error, by event.",
+        ["event"],
+    )
+)
+EVENT_SECONDS = register(
+    Histogram(
+        "pior_event_duration_seconds",
+        "Time spent handling a request, by event.",
+        ["event"],
+    )
+)
+RESPONSE_CACHE = register(
+    Counter(
+        "pior_response_cache_total",
+        "Record fetches with an ETag, by `not_modified`, `hit` or `miss`.",
+        ["result"],
+    )
+)
+# Stages: parse, auth, validation, write, flush and serialize
+STAGE_SECONDS = register(
+    Histogram(
+        "pior_stage_duration_seconds",
+        "Time spent in one stage of handling requests.",
+        ["stage"],
+    )
+)
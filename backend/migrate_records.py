@@ -0,0 +1,61 @@
+"""Migrate `data.json` into the per-patient SQLite record store.
+
+Every patient in `data.json`, with its journal replayed, is copied, and
+patients that only appear in `account_relations.json` get an empty record.
+Run it once from the `backend` directory, then set
+`"record_backend": "sqlite"` in `config.json`.
+"""
+
+import argparse
+import json
+
+from constants import ACCT_REL_JSON_PATH, DATA_JSON_PATH, RECORDS_DB_PATH
+from store import JsonFileBackend, SqliteBackend
+
+
+def load_json(path: str, default: dict) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return default
+
+
+def migrate(
+    data_path: str, relations_path: str, db_path: str, force: bool = False
+):
+    backend = SqliteBackend(db_path)
+    if backend.read() and not force:
+        raise SystemExit(
+            f"{db_path} already contains records, use --force to overwrite"
+        )
+
+    data = JsonFileBackend(data_path).read()
+    account_relations = load_json(relations_path, {"monitor_accounts": {}})
+    for patients in account_relations["monitor_accounts"].values():
+        for patient in patients:
+            data.setdefault(patient, {})
+
+    backend.write(backend.prepare(data, dict.fromkeys(data)))
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=DATA_JSON_PATH)
+    parser.add_argument("--relations", default=ACCT_REL_JSON_PATH)
+    parser.add_argument("--db", default=RECORDS_DB_PATH)
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    data = migrate(args.data, args.relations, args.db, args.force)
+    days = sum(
+        isinstance(value, dict)
+        for record in data.values()
+        for value in record.values()
+    )
+    print(f"Migrated {len(data)} patients ({days} daily records) to {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""JSON encoding shared by the API, the push stream and the record files.
+
+orjson is used when it is installed and the standard library otherwise.
+Both encoders write compact UTF-8 JSON, so `data.json` and the SQLite rows
+have the same format whichever one wrote them.
+"""
+
+import json
+from collections.abc import Callable
+from typing import Any
+
+import metrics
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+ENCODERS: dict[str, tuple[Callable[[Any], bytes], Callable[[Any], Any]]] = {
+    "json": (_json_dumps, json.loads)
+}
+if orjson is not None:
+    ENCODERS["orjson"] = (orjson.dumps, orjson.loads)
+
+ENCODER = "orjson" if orjson is not None else "json"
+dumps, loads = ENCODERS[ENCODER]
+
+
+def use(encoder: str):
+    """Switch every caller to `encoder`, one of `ENCODERS`."""
+    global ENCODER, dumps, loads
+    if encoder not in ENCODERS:
+        raise ValueError(f"JSON encoder `{encoder}` is not available")
+    ENCODER = encoder
+    dumps, loads = ENCODERS[encoder]
+
+
+def dumps_str(obj: Any) -> str:
+    return dumps(obj).decode()
+
+
+class EncodedJSONResponse(Response):
+    """A JSON response encoded by `dumps` in one pass.
+
+    Returning a dict from an endpoint makes FastAPI walk it with
+    `jsonable_encoder` before encoding it; large payloads such as
+    `patient_records` are returned through this class instead.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        with metrics.STAGE_SECONDS.time("serialize"):
+            return dumps(content)
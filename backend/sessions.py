@@ -0,0 +1,63 @@
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class Session:
+    account: str
+    account_type: str
+    expires: float
+
+
+class SessionTable:
+    """In-memory table of login sessions.
+
+    A session binds a random token to an account and its `AccountType`, so
+    requests carrying the token are authorized without touching the
+    accounts database. Sessions expire after `ttl` seconds without use.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions: dict[str, Session] = {}
+
+    def create(self, account: str, account_type: str) -> str:
+        token = secrets.token_urlsafe(32)
+        now = time.monotonic()
+        with self._lock:
+            self._sessions = {
+                token: session
+                for token, session in self._sessions.items()
+                if session.expires > now
+            }
+            self._sessions[token] = Session(
+                account, account_type, now + self.ttl
+            )
+        return token
+
+    def get(self, token: str) -> Session | None:
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session.expires <= now:
+                del self._sessions[token]
+                return None
+            session.expires = now + self.ttl
+            return session
+
+    def revoke(self, token: str):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def revoke_account(self, account: str):
+        with self._lock:
+            self._sessions = {
+                token: session
+                for token, session in self._sessions.items()
+                if session.account != account
+            }
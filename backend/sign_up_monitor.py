@@ -1,10 +1,8 @@
-import json
-
 import requests
+from config import config
 from constants import API_URL, SIGN_UP_MONITOR
 
-with open("./config.json") as f:
-    token = json.load(f)["token"]
+token = config["token"]
 
 
 ACCOUNT = input("Enter the monitor account you want to sign up: ")
@@ -0,0 +1,703 @@
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import date, timedelta
+from operator import itemgetter
+
+import logs
+import metrics
+import serialization
+from summary import ROLLING_DAYS, summarize
+from validator import parse_date_key
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logs.get_logger("store")
+
+# Set in the context of a `RecordStore.deferred` block
+_deferred = contextvars.ContextVar("deferred", default=False)
+
+
+def split_record(record: dict) -> tuple[dict, dict]:
+    """Split a patient document into its settings and its daily records."""
+    settings, days = {}, {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            days[key] = value
+        else:
+            settings[key] = value
+    return settings, days
+
+
+def index_days(record: dict) -> list[tuple[date, str]]:
+    """Return the `(date, key)` pairs of a record's days, oldest first."""
+    index = []
+    for key, value in record.items():
+        if not isinstance(value, dict):
+            continue
+        try:
+            index.append((parse_date_key(key), key))
+        except ValueError:
+            continue
+    index.sort()
+    return index
+
+
+# Journal size in bytes after which the next flush writes a new snapshot
+JOURNAL_COMPACT_SIZE = 4 * 1024 * 1024
+
+
+def write_atomic(path: str, payload: bytes):
+    """Replace `path` with `payload` so readers see the old or new file.
+
+    The payload goes to a temporary file that is fsynced and renamed over
+    `path`; a crash mid-write leaves the previous file intact.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(payload)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(os.path.dirname(path) or ".", os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class JsonFileBackend:
+    """Keeps every patient in a JSON snapshot plus an append-only journal.
+
+    A flush appends one line per changed patient to `<path>.journal`, and
+    with `fsync` the whole batch is fsynced once (group commit). Once the
+    journal outgrows `compact_size` bytes, the next flush atomically
+    replaces the snapshot and empties the journal. `read` replays the
+    journal over the snapshot in memory and drops a torn last line, so a
+    crash mid-write loses at most the batch being written.
+
+    `read` leaves the files alone and may be used by any tool; `load`
+    also writes the replayed snapshot and empties the journal, so only
+    the process holding the records' lock may call it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fsync: bool = False,
+        compact_size: int = JOURNAL_COMPACT_SIZE,
+    ):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.fsync = fsync
+        self.compact_size = compact_size
+        self._journal_size = 0
+
+    def read(self) -> dict:
+        """Return the snapshot with the journal replayed, in memory only."""
+        return self._read()[0]
+
+    def iter_records(self) -> Iterator[tuple[str, dict]]:
+        """Yield every patient and record, like `read`.
+
+        The journal may change any patient in the snapshot, so both are
+        read whole before the first patient is yielded.
+        """
+        yield from self.read().items()
+
+    def load(self) -> dict:
+        """Read the records and fold the journal into a new snapshot.
+
+        A missing snapshot is created, and the journal is emptied so that
+        later flushes do not append after a torn line.
+        """
+        data, recover = self._read()
+        if recover:
+            self.compact(serialization.dumps(data))
+        return data
+
+    def _read(self) -> tuple[dict, bool]:
+        """Return the records and whether the files need recovering."""
+        try:
+            with open(self.path, "rb") as file:
+                data = serialization.loads(file.read())
+            recover = False
+        except FileNotFoundError:
+            data = {}
+            recover = True
+
+        try:
+            with open(self.journal_path, "rb") as file:
+                journal = file.read()
+        except FileNotFoundError:
+            journal = b""
+
+        # Every complete entry ends with a newline; the rest is torn
+        *entries, _ = journal.split(b"\n")
+        for line in entries:
+            try:
+                patient, replace, value = serialization.loads(line)
+            except ValueError:
+                break
+            if replace is None:
+                data.pop(patient, None)
+            elif replace:
+                data[patient] = value
+            else:
+                data.setdefault(patient, {}).update(value)
+        return data, recover or bool(journal)
+
+    def prepare(
+        self, data: dict, dirty: dict[str, set[str] | None]
+    ) -> tuple[bytes, bytes | None]:
+        """Serialize the journal entries of the dirty patients.
+
+        Each entry is `[patient, replace, value]`, where `replace` is None
+        for a deleted patient, true for a whole new document and false for
+        the top-level keys in `value` that changed. The snapshot is only
+        serialized when the journal is due for compaction.
+        """
+        lines = []
+        for patient, keys in dirty.items():
+            if patient not in data:
+                entry = [patient, None, None]
+            elif keys is None:
+                entry = [patient, True, data[patient]]
+            else:
+                record = data[patient]
+                entry = [
+                    patient,
+                    False,
+                    {key: record[key] for key in keys if key in record},
+                ]
+            lines.append(serialization.dumps(entry))
+        entries = b"\n".join(lines) + b"\n"
+
+        if self._journal_size + len(entries) > self.compact_size:
+            return entries, serialization.dumps(data)
+        return entries, None
+
+    def write(self, payload: tuple[bytes, bytes | None]):
+        entries, snapshot = payload
+        with open(self.journal_path, "ab") as file:
+            file.write(entries)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        self._journal_size += len(entries)
+
+        if snapshot is not None:
+            self.compact(snapshot)
+
+    def compact(self, snapshot: bytes):
+        """Replace the snapshot and empty the journal it includes."""
+        write_atomic(self.path, snapshot)
+        # The journal holds every change up to the snapshot, so replaying
+        # it after a crash here ends with the snapshot's values.
+        with open(self.journal_path, "wb"):
+            pass
+        self._journal_size = 0
+
+
+class SqliteBackend:
+    """Keeps one row per patient and one row per patient-day.
+
+    A flush only rewrites the rows of the patients that changed, so its
+    cost does not grow with the history of the rest of the ward.
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.create_tables()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        synchronous = "FULL" if self.fsync else "NORMAL"
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+        return conn
+
+    def create_tables(self):
+        with self.connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS patient_records (
+                    username TEXT PRIMARY KEY,
+                    settings TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS daily_records (
+                    username TEXT NOT NULL,
+                    date_key TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (username, date_key)
+                )
+                """
+            )
+        conn.close()
+
+    def read(self) -> dict:
+        data = {}
+        with self.connect() as conn:
+            for username, settings in conn.execute(
+                "SELECT username, settings FROM patient_records"
+            ):
+                data[username] = serialization.loads(settings)
+            for username, date_key, record in conn.execute(
+                "SELECT username, date_key, record FROM daily_records"
+            ):
+                data.setdefault(username, {})[date_key] = serialization.loads(
+                    record
+                )
+        conn.close()
+        return data
+
+    def iter_records(self) -> Iterator[tuple[str, dict]]:
+        """Yield every patient and record, one patient in memory at a time."""
+        conn = self.connect()
+        try:
+            patients = conn.execute(
+                """
+                SELECT username, settings FROM patient_records
+                UNION ALL
+                SELECT DISTINCT username, NULL FROM daily_records
+                WHERE username NOT IN (SELECT username FROM patient_records)
+                ORDER BY username
+                """
+            )
+            for username, settings in patients:
+                record = (
+                    {} if settings is None else serialization.loads(settings)
+                )
+                for date_key, day in conn.execute(
+                    "SELECT date_key, record FROM daily_records WHERE username = ?",
+                    (username,),
+                ):
+                    record[date_key] = serialization.loads(day)
+                yield username, record
+        finally:
+            conn.close()
+
+    def load(self) -> dict:
+        # SQLite rolls back a torn transaction itself
+        return self.read()
+
+    def prepare(self, data: dict, dirty: dict[str, set[str] | None]) -> list:
+        """Serialize the dirty rows.
+
+        `dirty` maps each patient to the top-level keys that changed, or
+        to None when the whole document was replaced or deleted. Patients
+        whose settings or days were patched only get those rows rewritten.
+        """
+        payload = []
+        for patient, keys in dirty.items():
+            if patient not in data:
+                payload.append((patient, None, None, None))
+                continue
+            settings, days = split_record(data[patient])
+            if keys is None:
+                payload.append(
+                    (
+                        patient,
+                        True,
+                        serialization.dumps_str(settings),
+                        [
+                            (key, serialization.dumps_str(day))
+                            for key, day in days.items()
+                        ],
+                    )
+                )
+                continue
+
+            changed_days = [
+                (key, serialization.dumps_str(days[key]))
+                for key in keys
+                if key in days
+            ]
+            settings_changed = any(key not in days for key in keys)
+            payload.append(
+                (
+                    patient,
+                    False,
+                    serialization.dumps_str(settings)
+                    if settings_changed
+                    else None,
+                    changed_days,
+                )
+            )
+        return payload
+
+    def write(self, payload: list):
+        with self.connect() as conn:
+            for patient, replace, settings, days in payload:
+                if replace is not False:
+                    conn.execute(
+                        "DELETE FROM daily_records WHERE username = ?",
+                        (patient,),
+                    )
+                if replace is None:
+                    conn.execute(
+                        "DELETE FROM patient_records WHERE username = ?",
+                        (patient,),
+                    )
+                    continue
+
+                if settings is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO patient_records (username, settings) VALUES (?, ?)",
+                        (patient, settings),
+                    )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO daily_records (username, date_key, record) VALUES (?, ?, ?)",
+                    [(patient, key, day) for key, day in days],
+                )
+        conn.close()
+
+
+_DATE = itemgetter(0)
+
+
+class RecordStore:
+    """Resident copy of the patient records.
+
+    The backend is read once when the store is created and every read is
+    served from memory. Writes only mark the patient dirty; a background
+    flusher hands all dirty patients to the backend in one batch every
+    `flush_interval` seconds, so a burst of updates costs a single write.
+    A `flush_interval` of 0 writes through on every change, or once for
+    all the changes of a `deferred` block.
+
+    Every write also bumps the patient's revision, and the revision of
+    each top-level key it changed, so polling clients can ask only for
+    what changed since the revision they last saw. Revisions come from a
+    clock seeded with the start time, so they keep increasing across
+    restarts.
+
+    The day keys of each patient are also kept sorted by date, so a date
+    range is found by bisection instead of scanning the whole history.
+    The `summary` of a patient is computed from the days of its windows
+    and kept until the next write to the patient or the next day.
+
+    Handlers that read a record, change it and write it back hold the
+    patient's `lock` for the whole cycle. The records are only held by
+    one process: the store takes an exclusive lock on `<path>.lock`
+    before loading them, so a second server on the same files fails
+    without touching them instead of losing updates. `close` releases it.
+    """
+
+    def __init__(
+        self,
+        backend: JsonFileBackend | SqliteBackend,
+        flush_interval: float = 1.0,
+    ):
+        self.backend = backend
+        self.flush_interval = flush_interval
+
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._lock_file = None
+        # Loading may rewrite the files, so it waits for the lock
+        self.acquire_process_lock()
+        try:
+            self._data = backend.load()
+        except BaseException:
+            self.release_process_lock()
+            raise
+        self._dirty: dict[str, set[str] | None] = {}
+
+        self._clock = time.time_ns() // 1000
+        self._revisions = dict.fromkeys(self._data, self._clock)
+        # Revision at which the document was last replaced and keys may
+        # have been dropped; deltas can only be served after it.
+        self._resets = dict(self._revisions)
+        self._key_revisions: dict[str, dict[str, int]] = {}
+        self._date_index = {
+            patient: index_days(record)
+            for patient, record in self._data.items()
+        }
+        self._summaries: dict[str, tuple[int, date, dict]] = {}
+        self._patient_locks: dict[str, threading.Lock] = {}
+        self._stop = threading.Event()
+        self._flusher: threading.Thread | None = None
+
+    def __contains__(self, patient: str) -> bool:
+        return patient in self._data
+
+    def get(self, patient: str) -> dict | None:
+        return self._data.get(patient)
+
+    def patients(self) -> list[str]:
+        with self._lock:
+            return list(self._data)
+
+    def revision(self, patient: str) -> int | None:
+        return self._revisions.get(patient)
+
+    def day_keys(
+        self,
+        patient: str,
+        start: date | None = None,
+        end: date | None = None,
+    ) -> list[str]:
+        """Return the patient's day keys from `start` to `end`, oldest first.
+
+        Both bounds are inclusive and may be None for an open range.
+        """
+        with self._lock:
+            return [key for _, key in self._days(patient, start, end)]
+
+    def _days(
+        self, patient: str, start: date | None, end: date | None
+    ) -> list[tuple[date, str]]:
+        index = self._date_index.get(patient, [])
+        lo = 0 if start is None else bisect_left(index, start, key=_DATE)
+        hi = len(index) if end is None else bisect_right(index, end, key=_DATE)
+        return index[lo:hi]
+
+    def summary(self, patient: str, today: date) -> dict | None:
+        """Return the patient's `summary.summarize` as of `today`."""
+        with self._lock:
+            record = self._data.get(patient)
+            if record is None:
+                return None
+            revision = self._revisions[patient]
+            cached = self._summaries.get(patient)
+            if cached is not None and cached[:2] == (revision, today):
+                return cached[2]
+
+            start = today - timedelta(days=max(ROLLING_DAYS) - 1)
+            result = summarize(record, self._days(patient, start, today), today)
+            self._summaries[patient] = (revision, today, result)
+            return result
+
+    def lock(self, patient: str) -> threading.Lock:
+        """Return the lock serializing read-modify-write cycles of a patient."""
+        with self._lock:
+            return self._patient_locks.setdefault(patient, threading.Lock())
+
+    def conflicts(self, patient: str, since: int | None, record: dict) -> bool:
+        """Whether writing `record` would overwrite changes after `since`.
+
+        `since` is the revision the writer based `record` on. Only keys
+        changed after it by someone else and holding a different value in
+        `record` conflict, so a client's own earlier writes do not.
+        """
+        with self._lock:
+            current = self._data.get(patient)
+            revision = self._revisions.get(patient)
+            if current is None or since is None or revision <= since:
+                return False
+            if self._resets[patient] > since:
+                return record != current
+
+            key_revisions = self._key_revisions.get(patient, {})
+            return any(
+                key_revision > since and record.get(key) != current.get(key)
+                for key, key_revision in key_revisions.items()
+            )
+
+    def changes_since(
+        self, patient: str, since: int | None
+    ) -> tuple[dict | None, bool] | None:
+        """Return the patient's record as it changed after `since`.
+
+        The result is `(record, partial)`, where a partial record only
+        holds the top-level keys changed after `since`. Returns None when
+        nothing changed.
+        """
+        with self._lock:
+            revision = self._revisions.get(patient)
+            if since is None or revision is None:
+                return self._data.get(patient), False
+            if revision <= since:
+                return None
+            if self._resets[patient] > since:
+                return self._data[patient], False
+
+            key_revisions = self._key_revisions.get(patient, {})
+            record = self._data[patient]
+            return {
+                key: record[key]
+                for key, key_revision in key_revisions.items()
+                if key_revision > since
+            }, True
+
+    def _tick(self, patient: str) -> int:
+        self._clock = max(self._clock + 1, time.time_ns() // 1000)
+        self._revisions[patient] = self._clock
+        return self._clock
+
+    def touch(self, patient: str):
+        """Bump the revision of a patient whose account details changed."""
+        with self._lock:
+            if patient in self._data:
+                self._tick(patient)
+
+    def set(self, patient: str, record: dict):
+        with self._lock:
+            old = self._data.get(patient)
+            revision = self._tick(patient)
+            if old is None or any(key not in record for key in old):
+                self._resets[patient] = revision
+                self._key_revisions[patient] = {}
+            else:
+                key_revisions = self._key_revisions.setdefault(patient, {})
+                for key, value in record.items():
+                    if key not in old or old[key] != value:
+                        key_revisions[key] = revision
+
+            self._data[patient] = record
+            self._date_index[patient] = index_days(record)
+            self._dirty[patient] = None
+        self._written()
+
+    def update(self, patient: str, changes: dict):
+        """Replace some top-level keys (settings or days) of a patient."""
+        with self._lock:
+            revision = self._tick(patient)
+            self._resets.setdefault(patient, revision)
+            key_revisions = self._key_revisions.setdefault(patient, {})
+            for key in changes:
+                key_revisions[key] = revision
+
+            old = self._data.get(patient, {})
+            index = self._date_index.setdefault(patient, [])
+            for day, key in index_days(changes):
+                if not isinstance(old.get(key), dict):
+                    insort(index, (day, key))
+
+            self._data[patient] = {**old, **changes}
+            if patient not in self._dirty:
+                self._dirty[patient] = set(changes)
+            elif self._dirty[patient] is not None:
+                self._dirty[patient].update(changes)
+        self._written()
+
+    def delete(self, patient: str):
+        with self._lock:
+            if patient not in self._data:
+                return
+            del self._data[patient]
+            del self._revisions[patient]
+            del self._resets[patient]
+            self._key_revisions.pop(patient, None)
+            self._date_index.pop(patient, None)
+            self._summaries.pop(patient, None)
+            self._dirty[patient] = None
+        self._written()
+
+    def rename(self, patient: str, new_patient: str):
+        """Move a patient's record to `new_patient` in one write."""
+        with self._lock:
+            record = self._data.get(patient)
+            if record is None:
+                return
+            with self.deferred():
+                self.set(new_patient, record)
+                self.delete(patient)
+        self._written()
+
+    @contextmanager
+    def deferred(self):
+        """Hold back the write-through of the changes made in this block.
+
+        Only changes made in the current context, including the threads
+        it runs calls on, are held back; call `write_through` after the
+        block to write them together.
+        """
+        token = _deferred.set(True)
+        try:
+            yield
+        finally:
+            _deferred.reset(token)
+
+    def write_through(self):
+        """Flush now if every change is written through."""
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def _written(self):
+        if not _deferred.get():
+            self.write_through()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                dirty, self._dirty = self._dirty, {}
+                # Writes replace whole records instead of changing them,
+                # so a shallow copy is a consistent snapshot to encode
+                # without holding up the writers
+                data = dict(self._data)
+
+            try:
+                payload = self.backend.prepare(data, dirty)
+                with metrics.STAGE_SECONDS.time("flush"):
+                    self.backend.write(payload)
+            except (OSError, sqlite3.Error):
+                with self._lock:
+                    for patient, keys in dirty.items():
+                        if patient not in self._dirty:
+                            self._dirty[patient] = keys
+                        elif keys is None or self._dirty[patient] is None:
+                            self._dirty[patient] = None
+                        else:
+                            self._dirty[patient] |= keys
+                raise
+
+    def acquire_process_lock(self):
+        """Take the exclusive lock on the records' files for this process."""
+        if fcntl is None or self._lock_file is not None:
+            return
+        lock_file = open(f"{self.backend.path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(
+                f"{self.backend.path} is used by another server process;"
+                " run a single worker"
+            ) from None
+        self._lock_file = lock_file
+
+    def release_process_lock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def start(self):
+        if self._flusher is not None or self.flush_interval <= 0:
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(
+            target=self._run, name="record-flusher", daemon=True
+        )
+        self._flusher.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except (OSError, sqlite3.Error):
+                logger.exception("Failed to flush records")
+
+    def close(self):
+        if self._flusher is not None:
+            self._stop.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        self.release_process_lock()
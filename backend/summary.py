@@ -0,0 +1,109 @@
+"""Intake/output summaries of a patient for `fetch_summary`.
+
+A summary covers today's totals against the patient's restriction, the
+intake/output balance over the last `ROLLING_DAYS` and the weight trend.
+It is computed from the daily sums kept in each day, so it only reads
+the days inside the longest window, however long the history is.
+"""
+
+from datetime import date, timedelta
+
+# Lengths in days of the rolling windows, today included
+ROLLING_DAYS = (7, 30)
+
+FIELDS = ["food", "water", "urination", "defecation"]
+
+
+def parse_weight(weight) -> float | None:
+    """Return the kilograms of a day's `weight` such as "60.5 kg"."""
+    if not isinstance(weight, str) or not weight.endswith(" kg"):
+        return None
+    try:
+        return float(weight.removesuffix(" kg"))
+    except ValueError:
+        return None
+
+
+def day_totals(day: dict) -> dict:
+    totals = {field: day.get(f"{field}Sum", 0) for field in FIELDS}
+    totals["intake"] = totals["food"] + totals["water"]
+    # Defecation is counted in times, so only urination is output volume
+    totals["output"] = totals["urination"]
+    totals["balance"] = totals["intake"] - totals["output"]
+    return totals
+
+
+def restriction(record: dict, totals: dict) -> dict | None:
+    """Return today's restricted intake against `limitAmount`, if set."""
+    restricted = [
+        field
+        for field in ["food", "water"]
+        if record.get(f"{field}CheckboxChecked")
+    ]
+    try:
+        limit = float(record.get("limitAmount", ""))
+    except (TypeError, ValueError):
+        return None
+    if not restricted:
+        return None
+
+    amount = sum(totals[field] for field in restricted)
+    return {
+        "limit": limit,
+        "restricted": restricted,
+        "amount": amount,
+        "remaining": limit - amount,
+        "exceeded": amount > limit,
+    }
+
+
+def summarize(record: dict, days: list[tuple[date, str]], today: date) -> dict:
+    """Summarize `record` given the `(date, key)` days of its windows.
+
+    `days` are sorted oldest first, from the first day of the longest
+    window to today. Today is found by date, whether its key pads the
+    day (as the pages write it) or not.
+    """
+    # The pages' key format, unless today is already stored
+    today_key = f"{today.year}_{today.month}_{today.day:02}"
+    totals = [(day, day_totals(record[key])) for day, key in days]
+    today_totals = day_totals({})
+    for (day, key), (_, sums) in zip(days, totals, strict=True):
+        if day == today:
+            today_key = key
+            for name, value in sums.items():
+                today_totals[name] += value
+
+    rolling = {}
+    for length in ROLLING_DAYS:
+        start = today - timedelta(days=length - 1)
+        window = [sums for day, sums in totals if day >= start]
+        rolling_sums = dict.fromkeys(today_totals, 0)
+        for sums in window:
+            for name, value in sums.items():
+                rolling_sums[name] += value
+        rolling[str(length)] = {"days": len(window)} | rolling_sums
+
+    weights = [
+        (day, weight)
+        for day, key in days
+        if (weight := parse_weight(record[key].get("weight"))) is not None
+    ]
+    trend = {"latest": None, "date": None}
+    if weights:
+        latest_day, latest = weights[-1]
+        trend = {"latest": latest, "date": latest_day.isoformat()}
+    for length in ROLLING_DAYS:
+        start = today - timedelta(days=length - 1)
+        window = [weight for day, weight in weights if day >= start]
+        trend[f"change_{length}"] = (
+            round(window[-1] - window[0], 2) if len(window) > 1 else None
+        )
+
+    return {
+        "date": today_key,
+        "today": today_totals,
+        "restriction": restriction(record, today_totals),
+        "rolling": rolling,
+        "weight": trend,
+    }
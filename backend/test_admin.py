@@ -0,0 +1,159 @@
+import io
+import json
+import os
+import unittest
+from unittest.mock import patch
+
+import admin
+import db
+from db import AccountType
+from store import JsonFileBackend, RecordStore
+
+TEST_DB = "test_admin_accounts.db"
+TEST_DATA_JSON = "test_admin_data.json"
+
+CSV = """username,password,account_type,monitors
+patient1,pw1,PATIENT,nurse1;nurse2
+nurse1,pw2,MONITOR,
+nurse2,pw3,MONITOR,
+patient2,pw4,PATIENT,
+"""
+
+
+class TestAdmin(unittest.TestCase):
+    def setUp(self):
+        self.accounts_db = db.ACCOUNTS_DB
+        db.ACCOUNTS_DB = TEST_DB
+        db.create_table()
+        self.records = RecordStore(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=60
+        )
+
+    def tearDown(self):
+        db.close_connections()
+        self.records.close()
+        db.ACCOUNTS_DB = self.accounts_db
+        for path in [
+            TEST_DB,
+            f"{TEST_DB}-wal",
+            f"{TEST_DB}-shm",
+            TEST_DATA_JSON,
+            f"{TEST_DATA_JSON}.journal",
+            f"{TEST_DATA_JSON}.lock",
+        ]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def import_csv(self, text: str) -> dict:
+        return admin.import_accounts(
+            admin.read_rows(io.StringIO(text), jsonl=False), self.records
+        )
+
+    def test_import(self):
+        counts = self.import_csv(CSV)
+        self.assertEqual(counts, {"created": 4, "skipped": 0, "relations": 2})
+        self.assertEqual(
+            db.get_credentials("patient1"), ("pw1", AccountType.PATIENT)
+        )
+        self.assertEqual(db.get_monitored_patients("nurse2"), ["patient1"])
+        # The records of the new patients are already on disk
+        self.assertEqual(
+            JsonFileBackend(TEST_DATA_JSON).read(),
+            {"patient1": {}, "patient2": {}},
+        )
+
+        # Existing accounts are skipped, new relations still added
+        counts = self.import_csv(
+            "username,password,account_type,monitors\n"
+            "patient2,other,PATIENT,nurse1\n"
+        )
+        self.assertEqual(counts, {"created": 0, "skipped": 1, "relations": 1})
+        self.assertEqual(db.get_password("patient2"), "pw4")
+
+    def test_import_jsonl(self):
+        lines = [
+            {"username": "nurse1", "password": "pw", "account_type": "MONITOR"},
+            {
+                "username": "patient1",
+                "password": "pw",
+                "account_type": "PATIENT",
+                "monitors": ["nurse1"],
+            },
+        ]
+        text = "".join(json.dumps(line) + "\n" for line in lines)
+        counts = admin.import_accounts(
+            admin.read_rows(io.StringIO(text), jsonl=True), self.records
+        )
+        self.assertEqual(counts["created"], 2)
+        self.assertEqual(db.get_monitored_patients("nurse1"), ["patient1"])
+
+    def test_import_is_atomic(self):
+        for text, error in [
+            (CSV + "patient3,pw,NURSE,\n", "line 6: invalid account_type"),
+            (CSV + "patient3,pw,PATIENT,nurse3\n", "unknown monitors: nurse3"),
+        ]:
+            with self.assertRaisesRegex(ValueError, error):
+                self.import_csv(text)
+            self.assertEqual(db.get_all_accounts(), [])
+            self.assertEqual(db.get_monitored_patients("nurse1"), [])
+            self.assertEqual(JsonFileBackend(TEST_DATA_JSON).read(), {})
+
+    def test_import_rejects_non_objects(self):
+        for text in ['["patient1"]\n', "{\n"]:
+            with self.assertRaisesRegex(ValueError, "line 1: "):
+                admin.import_accounts(
+                    admin.read_rows(io.StringIO(text), jsonl=True),
+                    self.records,
+                )
+
+    def test_import_keeps_orphaned_records(self):
+        self.records.set("patient2", {"limitAmount": "500"})
+        self.import_csv(CSV)
+        self.assertEqual(self.records.get("patient2"), {"limitAmount": "500"})
+        self.assertEqual(self.records.get("patient1"), {})
+
+    def test_import_failed_flush(self):
+        with (
+            patch.object(
+                self.records.backend, "write", side_effect=OSError("full")
+            ),
+            self.assertRaises(OSError),
+        ):
+            self.import_csv(CSV)
+        self.assertEqual(db.get_all_accounts(), [])
+
+        # Closing does not write the records of the rolled back accounts
+        self.records.close()
+        self.assertEqual(JsonFileBackend(TEST_DATA_JSON).read(), {})
+
+    def test_export_accounts_round_trip(self):
+        self.import_csv(CSV)
+        for jsonl in [True, False]:
+            output = io.StringIO()
+            admin.export_accounts(output, jsonl)
+            rows = [
+                row
+                for _, row in admin.read_rows(
+                    io.StringIO(output.getvalue()), jsonl
+                )
+            ]
+            self.assertEqual(
+                [row["username"] for row in rows],
+                ["patient1", "nurse1", "nurse2", "patient2"],
+            )
+            self.assertEqual(sorted(rows[0]["monitors"]), ["nurse1", "nurse2"])
+            self.assertEqual(rows[3]["monitors"], [])
+
+    def test_export_records(self):
+        output = io.StringIO()
+        admin.export_records(
+            output, iter([("patient1", {"limitAmount": "500"})])
+        )
+        self.assertEqual(
+            json.loads(output.getvalue()),
+            {"patient": "patient1", "record": {"limitAmount": "500"}},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import csv
+import math
+import os
+import unittest
+from datetime import date
+
+import analytics
+
+
+def make_day(items, weight="NaN"):
+    return {
+        "data": [
+            {
+                "time": f"{8 + i:02}:00",
+                "food": food,
+                "water": water,
+                "urination": urination,
+                "defecation": 0,
+            }
+            for i, (food, water, urination) in enumerate(items)
+        ],
+        "count": len(items),
+        "recordDate": "",
+        "foodSum": sum(item[0] for item in items),
+        "waterSum": sum(item[1] for item in items),
+        "urinationSum": sum(item[2] for item in items),
+        "defecationSum": 0,
+        "weight": weight,
+    }
+
+
+DATA = {
+    "patient1": {
+        "limitAmount": "1000",
+        "foodCheckboxChecked": False,
+        "waterCheckboxChecked": True,
+        "2025_1_1": make_day([(200, 700, 100), (0, 500, 300)], "60 kg"),
+        "2025_1_2": make_day([(100, 300, 600)]),
+        "2025_1_3": make_day([], "61.5 kg"),
+    },
+    "patient2": {
+        "limitAmount": "",
+        "foodCheckboxChecked": False,
+        "waterCheckboxChecked": False,
+        "2025_1_2": make_day([(3000, 0, 0)], "80 kg"),
+    },
+}
+
+TEST_EXPORT_CSV = "test_analytics_export.csv"
+
+
+class TestAnalytics(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(TEST_EXPORT_CSV):
+            os.remove(TEST_EXPORT_CSV)
+
+    def test_to_columns(self):
+        columns = analytics.to_columns(DATA)
+        self.assertEqual(len(columns["patient"]), 5)
+        self.assertEqual(columns["date"][:2], ["2025-01-01", "2025-01-01"])
+        self.assertEqual(columns["water"][:3], [700, 500, 300])
+        self.assertEqual(columns["weight"][0], 60.0)
+        self.assertTrue(math.isnan(columns["weight"][2]))
+        # A day without items keeps its weight
+        self.assertEqual(columns["time"][3], "")
+        self.assertEqual(columns["weight"][3], 61.5)
+
+        columns = analytics.to_columns(DATA, date(2025, 1, 2), date(2025, 1, 2))
+        self.assertEqual(columns["patient"], ["patient1", "patient2"])
+
+    def check_report(self):
+        result = analytics.report(DATA)
+        self.assertEqual(result["patients"], 2)
+        self.assertEqual(result["patient_days"], 4)
+
+        balance = result["balance"]
+        self.assertEqual(balance["days"], 4)
+        # Balances are 1000, -200, 0 and 3000
+        self.assertEqual(balance["mean"], 950.0)
+        self.assertEqual(balance["percentiles"]["50"], 500.0)
+        self.assertEqual(balance["histogram"]["-500..0"], 1)
+        self.assertEqual(balance["histogram"]["0..500"], 1)
+        self.assertEqual(balance["histogram"][">=2000"], 1)
+        self.assertEqual(sum(balance["histogram"].values()), 4)
+
+        limits = result["limits"]
+        self.assertEqual(limits["limited_patients"], 1)
+        self.assertEqual(limits["days_over"], 1)
+        self.assertEqual(
+            limits["patients"],
+            {
+                "patient1": {
+                    "limit": 1000.0,
+                    "days": 1,
+                    "max_excess": 200.0,
+                    "last": "2025-01-01",
+                }
+            },
+        )
+
+        weight = result["weight"]
+        self.assertEqual(weight["changes"], {"patient1": 1.5, "patient2": 0.0})
+        self.assertEqual(weight["gained"], 1)
+        self.assertEqual(weight["lost"], 0)
+
+    def test_report(self):
+        self.check_report()
+
+    def test_day_under_two_keys(self):
+        # Unpadded and padded keys of the same day are one patient-day
+        data = {
+            "patient1": {
+                "limitAmount": "1000",
+                "waterCheckboxChecked": True,
+                "2025_1_5": make_day([(0, 600, 100)]),
+                "2025_1_6": make_day([(0, 100, 0)], "60 kg"),
+                "2025_1_05": make_day([(100, 500, 0)], "61 kg"),
+            }
+        }
+        days = analytics.daily_totals(analytics.to_columns(data))
+        self.assertEqual(days["date"], ["2025-01-05", "2025-01-06"])
+        self.assertEqual(days["food"], [100, 0])
+        self.assertEqual(days["water"], [1100, 100])
+        self.assertEqual(days["urination"], [100, 0])
+        self.assertEqual(days["weight"], [61.0, 60.0])
+
+        result = analytics.report(data)
+        self.assertEqual(result["patient_days"], 2)
+        self.assertEqual(result["limits"]["days_over"], 1)
+        self.assertEqual(
+            result["limits"]["patients"]["patient1"]["max_excess"], 100.0
+        )
+
+    def test_empty_report(self):
+        result = analytics.report({})
+        self.assertEqual(result["balance"], {"days": 0})
+        self.assertEqual(result["limits"]["days_over"], 0)
+        self.assertIsNone(result["weight"]["mean_change"])
+
+    def test_export_csv(self):
+        analytics.export(analytics.to_columns(DATA), TEST_EXPORT_CSV)
+        with open(TEST_EXPORT_CSV, newline="") as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[0], analytics.COLUMNS)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(
+            rows[1],
+            [
+                "patient1",
+                "2025-01-01",
+                "08:00",
+                "200",
+                "700",
+                "100",
+                "0",
+                "60.0",
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,79 +1,145 @@
+import asyncio
+import json
 import os
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from unittest.mock import patch
 
 import db
+import httpx
+import main
+import metrics
+from config import Config
 from constants import (
     ACCT_CHANGE_SUCCESS,
     ACCT_CREATED,
     ACCT_NOT_EXIST,
     ADD_PATIENT,
     ADD_PATIENT_SUCCESS,
+    AUTH_FAIL_PASSWORD,
     AUTH_SUCCESS,
+    BATCH,
+    BATCH_SUCCESS,
     CHANGE_PASSWORD,
     CHANGE_USERNAME,
     DELETE_MONITOR,
     DELETE_MONITOR_SUCCESS,
     DELETE_PATIENT,
     DELETE_PATIENT_SUCCESS,
+    EVENT_STATS,
+    EVENT_STATS_SUCCESS,
     FETCH_MONITORING_PATIENTS,
     FETCH_MONITORING_PATIENTS_SUCCESS,
     FETCH_RECORD,
     FETCH_RECORD_SUCCESS,
+    FETCH_SUMMARY,
+    FETCH_SUMMARY_SUCCESS,
     FETCH_UNMONITORED_PATIENTS,
     FETCH_UNMONITORED_PATIENTS_SUCCESS,
+    INVALID_ACCT_TYPE,
+    INVALID_BATCH,
+    INVALID_DATE_RANGE,
     INVALID_EVENT,
+    INVALID_PATIENTS,
+    LOGIN,
+    LOGOUT,
+    LOGOUT_SUCCESS,
+    MISSING_PARAMETER,
+    NOT_MODIFIED,
+    PATCH_RECORD,
+    PATCH_RECORD_SUCCESS,
     REMOVE_PATIENT,
     REMOVE_PATIENT_SUCCESS,
+    SESSION_EXPIRED,
     SIGN_UP_MONITOR,
     SIGN_UP_PATIENT,
+    UPDATE_CONFLICT,
     UPDATE_RECORD,
     UPDATE_RECORD_SUCCESS,
 )
 from fastapi.testclient import TestClient
+from httpcache import ResponseCache
 from main import app
+from sessions import SessionTable
+from store import JsonFileBackend, RecordStore
 
 client = TestClient(app)
 
 TEST_DB = "test_accounts.db"
 TEST_DATA_JSON = "test_data.json"
-TEST_ACCT_REL_JSON = "test_account_relations.json"
+TEST_CONFIG_JSON = "test_config.json"
 TEST_TOKEN = "testtoken123"
 
 
-def mocked_load_json_file(path):
-    if path.endswith("config.json"):
-        return {"token": TEST_TOKEN}
-    elif path.endswith("data.json"):
-        return mocked_load_json_file.data
-    elif path.endswith("account_relations.json"):
-        return mocked_load_json_file.acct_rel
-    return {}
-
-
-def mocked_write_json_file(path, data):
-    if path.endswith("data.json"):
-        mocked_load_json_file.data = data
-    elif path.endswith("account_relations.json"):
-        mocked_load_json_file.acct_rel = data
-
-
 class TestAPIEndpoints(unittest.TestCase):
     def setUp(self):
         db.ACCOUNTS_DB = TEST_DB
         db.create_table()
 
-        mocked_load_json_file.data = {}
-        mocked_load_json_file.acct_rel = {"monitor_accounts": {}}
+        with open(TEST_CONFIG_JSON, "w") as file:
+            json.dump(
+                {"api_url": "http://localhost", "token": TEST_TOKEN}, file
+            )
+        main.config = Config(TEST_CONFIG_JSON)
+        main.records = RecordStore(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=0
+        )
+        main.sessions = SessionTable(900)
+        main.responses = ResponseCache(1024)
 
     def tearDown(self):
-        if os.path.exists(TEST_DB):
-            os.remove(TEST_DB)
+        db.close_connections()
+        main.records.close()
+        for path in [
+            TEST_DB,
+            TEST_DATA_JSON,
+            f"{TEST_DATA_JSON}.journal",
+            f"{TEST_DATA_JSON}.lock",
+            TEST_CONFIG_JSON,
+        ]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_change_username_moves_record(self):
+        db.add_account("monitorU", "pw", db.AccountType.MONITOR)
+        db.add_account("patientU", "pw", db.AccountType.PATIENT)
+        db.add_monitored_patient("monitorU", "patientU")
+        record = {"limitAmount": "500", "2025_1_02": {"count": 0}}
+        main.records.set("patientU", record)
 
-    @patch("main.load_json_file", side_effect=mocked_load_json_file)
-    @patch("main.write_json_file", side_effect=mocked_write_json_file)
-    def test_full_flow_with_token(self, _, __):
+        res = client.post(
+            "/",
+            json={
+                "event": CHANGE_USERNAME,
+                "account": "patientU",
+                "password": "pw",
+                "new_account": "patientV",
+            },
+        )
+        self.assertEqual(res.json()["message"], ACCT_CHANGE_SUCCESS)
+        self.assertEqual(db.get_monitored_patients("monitorU"), ["patientV"])
+        self.assertIsNone(main.records.get("patientU"))
+        self.assertEqual(main.records.get("patientV"), record)
+        self.assertEqual(
+            JsonFileBackend(TEST_DATA_JSON).read(), {"patientV": record}
+        )
+
+    def test_records_opened_at_startup(self):
+        main.records.close()
+        with (
+            patch.object(main, "RECORD_BACKEND", "json"),
+            patch.object(main, "DATA_JSON_PATH", TEST_DATA_JSON),
+            TestClient(app),
+        ):
+            self.assertEqual(main.records.backend.path, TEST_DATA_JSON)
+            # The running server holds the records
+            with self.assertRaises(RuntimeError):
+                RecordStore(JsonFileBackend(TEST_DATA_JSON))
+        RecordStore(JsonFileBackend(TEST_DATA_JSON)).close()
+
+    def test_full_flow_with_token(self):
         res = client.post(
             "/",
             json={
@@ -163,6 +229,22 @@ class TestAPIEndpoints(unittest.TestCase):
             res.json()["message"], FETCH_MONITORING_PATIENTS_SUCCESS
         )
 
+        revisions = res.json()["revisions"]
+        self.assertEqual(list(revisions), ["patient1"])
+        self.assertEqual(res.json()["patient_records"], {"patient1": {}})
+
+        res = client.post(
+            "/",
+            json={
+                "token": TEST_TOKEN,
+                "event": FETCH_MONITORING_PATIENTS,
+                "account": "monitor1",
+                "password": "pass123",
+                "since": revisions,
+            },
+        )
+        self.assertEqual(res.json()["message"], NOT_MODIFIED)
+
         res = client.post(
             "/",
             json={
@@ -215,9 +297,7 @@ class TestAPIEndpoints(unittest.TestCase):
         self.assertEqual(res.json()["message"], DELETE_MONITOR_SUCCESS)
         self.assertEqual(db.authenticate("monitor1", "pass123"), ACCT_NOT_EXIST)
 
-    @patch("main.load_json_file", side_effect=mocked_load_json_file)
-    @patch("main.write_json_file", side_effect=mocked_write_json_file)
-    def test_change_password_and_fetch_record_without_token(self, *_):
+    def test_change_password_and_fetch_record_without_token(self):
         db.add_account("patientX", "abc123", db.AccountType.PATIENT)
 
         res = client.post(
@@ -274,7 +354,7 @@ class TestAPIEndpoints(unittest.TestCase):
             },
         }
 
-        mocked_load_json_file.data["patientX"] = {}
+        main.records.set("patientX", {})
         res = client.post(
             "/",
             json={
@@ -326,8 +406,832 @@ class TestAPIEndpoints(unittest.TestCase):
         self.assertEqual(res.json()["message"], FETCH_RECORD_SUCCESS)
         self.assertEqual(res.json()["account_records"], update_data)
 
-    @patch("main.load_json_file", side_effect=mocked_load_json_file)
-    def test_invalid_token(self, _):
+        res = client.post(
+            "/",
+            json={
+                "event": FETCH_RECORD,
+                "account": "patientX",
+                "password": "def456",
+                "patient": "patientX",
+                "since": res.json()["revision"],
+            },
+        )
+        self.assertEqual(res.json()["message"], NOT_MODIFIED)
+
+    def test_fetch_date_range(self):
+        db.add_account("patientR", "pw", db.AccountType.PATIENT)
+        db.add_account("monitorR", "pw", db.AccountType.MONITOR)
+        db.add_monitored_patient("monitorR", "patientR")
+        days = {f"2025_1_{day}": {"count": day} for day in [2, 10, 9, 1, 3]}
+        main.records.set("patientR", {"limitAmount": ""} | days)
+
+        def fetch(event="fetch_record", **kwargs):
+            return client.post(
+                "/",
+                json={
+                    "event": event,
+                    "account": "patientR",
+                    "password": "pw",
+                    "patient": "patientR",
+                }
+                | kwargs,
+            ).json()
+
+        res = fetch(**{"from": "2025_1_2", "to": "2025_1_09"})
+        self.assertEqual(res["message"], FETCH_RECORD_SUCCESS)
+        self.assertEqual(
+            set(res["account_records"]),
+            {"limitAmount", "2025_1_2", "2025_1_3", "2025_1_9"},
+        )
+        self.assertIsNone(res["next_cursor"])
+
+        pages = []
+        res = fetch(limit=2)
+        while True:
+            pages.append(
+                sorted(res["account_records"].keys() - {"limitAmount"})
+            )
+            if res["next_cursor"] is None:
+                break
+            res = fetch(limit=2, cursor=res["next_cursor"])
+        self.assertEqual(
+            pages,
+            [
+                ["2025_1_10", "2025_1_9"],
+                ["2025_1_2", "2025_1_3"],
+                ["2025_1_1"],
+            ],
+        )
+
+        self.assertEqual(fetch(limit=0)["message"], INVALID_DATE_RANGE)
+        self.assertEqual(
+            fetch(**{"from": "1/2"})["message"], INVALID_DATE_RANGE
+        )
+
+        res = client.post(
+            "/",
+            json={
+                "event": FETCH_MONITORING_PATIENTS,
+                "account": "monitorR",
+                "password": "pw",
+                "limit": 3,
+                "cursor": {"patientR": "2025_1_10"},
+            },
+        ).json()
+        self.assertEqual(res["message"], FETCH_MONITORING_PATIENTS_SUCCESS)
+        self.assertEqual(
+            set(res["patient_records"]["patientR"]),
+            {"limitAmount", "2025_1_9", "2025_1_3", "2025_1_2"},
+        )
+        self.assertEqual(res["next_cursors"], {"patientR": "2025_1_2"})
+
+    def test_concurrent_updates(self):
+        db.add_account("patientC", "pw", db.AccountType.PATIENT)
+        today = date.today()
+        key = f"{today.year}_{today.month}_{today.day}"
+        main.records.set(
+            "patientC",
+            {
+                "isEditing": False,
+                "limitAmount": "",
+                "foodCheckboxChecked": False,
+                "waterCheckboxChecked": False,
+            },
+        )
+
+        def item(food):
+            # Every write adds a distinct item so a lost one is detected
+            return {
+                "time": "00:00",
+                "food": food,
+                "water": 0,
+                "urination": 0,
+                "defecation": 0,
+            }
+
+        def post(event, **kwargs):
+            return client.post(
+                "/",
+                json={
+                    "event": event,
+                    "account": "patientC",
+                    "password": "pw",
+                    "patient": "patientC",
+                }
+                | kwargs,
+            ).json()
+
+        def patch_items(writer):
+            for i in range(10):
+                operation = {
+                    "op": "append_item",
+                    "date": key,
+                    "item": item(writer * 100 + i),
+                }
+                res = post(PATCH_RECORD, operation=operation)
+                self.assertEqual(res["message"], PATCH_RECORD_SUCCESS)
+
+        def update_items(writer):
+            conflicts = 0
+            for i in range(5):
+                while True:
+                    res = post(FETCH_RECORD)
+                    record = res["account_records"]
+                    day = record.get(key) or {
+                        "data": [],
+                        "recordDate": f"{today.month}/{today.day}",
+                        "urinationSum": 0,
+                        "waterSum": 0,
+                        "defecationSum": 0,
+                        "weight": "NaN",
+                    }
+                    day["data"] = day["data"] + [item(writer * 100 + i)]
+                    day["count"] = len(day["data"])
+                    day["foodSum"] = sum(x["food"] for x in day["data"])
+                    record[key] = day
+                    res = post(
+                        UPDATE_RECORD, data=record, revision=res["revision"]
+                    )
+                    if res["message"] == UPDATE_RECORD_SUCCESS:
+                        break
+                    self.assertEqual(res["message"], UPDATE_CONFLICT)
+                    conflicts += 1
+            return conflicts
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                executor.submit(patch_items, writer) for writer in range(1, 7)
+            ]
+            futures += [
+                executor.submit(update_items, writer) for writer in range(7, 11)
+            ]
+            for future in futures:
+                future.result()
+
+        day = main.records.get("patientC")[key]
+        expected = {w * 100 + i for w in range(1, 7) for i in range(10)}
+        expected |= {w * 100 + i for w in range(7, 11) for i in range(5)}
+        self.assertEqual(day["count"], len(expected))
+        self.assertEqual({x["food"] for x in day["data"]}, expected)
+        self.assertEqual(day["foodSum"], sum(expected))
+
+    def test_fetch_summary(self):
+        db.add_account("monitorS", "pw", db.AccountType.MONITOR)
+        db.add_account("patientS", "pw", db.AccountType.PATIENT)
+        db.add_monitored_patient("monitorS", "patientS")
+        today = date.today()
+        # Padded like the pages write it
+        key = f"{today.year}_{today.month}_{today.day:02}"
+        main.records.set(
+            "patientS",
+            {
+                "limitAmount": "500",
+                "foodCheckboxChecked": True,
+                "waterCheckboxChecked": False,
+                key: {
+                    "data": [],
+                    "count": 0,
+                    "recordDate": f"{today.month}/{today.day}",
+                    "foodSum": 600,
+                    "waterSum": 100,
+                    "urinationSum": 200,
+                    "defecationSum": 0,
+                    "weight": "60 kg",
+                },
+            },
+        )
+
+        res = client.post(
+            "/",
+            json={
+                "event": FETCH_SUMMARY,
+                "account": "monitorS",
+                "password": "pw",
+            },
+        ).json()
+        self.assertEqual(res["message"], FETCH_SUMMARY_SUCCESS)
+        summary = res["summaries"]["patientS"]
+        self.assertEqual(summary["today"]["balance"], 500)
+        self.assertTrue(summary["restriction"]["exceeded"])
+        self.assertEqual(summary["weight"]["latest"], 60.0)
+
+        res = client.post(
+            "/",
+            json={
+                "event": FETCH_SUMMARY,
+                "account": "patientS",
+                "password": "pw",
+            },
+        ).json()
+        self.assertEqual(list(res["summaries"]), ["patientS"])
+
+    def test_blocking_io_off_event_loop(self):
+        db.add_account("slowP", "pw", db.AccountType.PATIENT)
+        db.add_account("fastP", "pw", db.AccountType.PATIENT)
+        get_credentials = db.get_credentials
+
+        def slow_get_credentials(account):
+            if account == "slowP":
+                time.sleep(0.5)
+            return get_credentials(account)
+
+        async def fetch(account):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                await client.post(
+                    "/",
+                    json={
+                        "event": FETCH_RECORD,
+                        "account": account,
+                        "password": "pw",
+                        "patient": account,
+                    },
+                )
+            return account
+
+        async def fetch_both():
+            # Both requests share one event loop
+            done = []
+            for future in asyncio.as_completed(
+                [fetch("slowP"), fetch("fastP")]
+            ):
+                done.append(await future)
+            return done
+
+        with patch.object(db, "get_credentials", slow_get_credentials):
+            self.assertEqual(asyncio.run(fetch_both()), ["fastP", "slowP"])
+
+    def test_patch_record(self):
+        db.add_account("patientP", "pw", db.AccountType.PATIENT)
+        db.add_account("monitorP", "pw", db.AccountType.MONITOR)
+        main.records.set("patientP", {"limitAmount": "", "isEditing": False})
+
+        today = date.today()
+        key = f"{today.year}_{today.month}_{today.day}"
+        item = {
+            "time": datetime.now().strftime("%H:%M"),
+            "food": 100,
+            "water": 200,
+            "urination": 1,
+            "defecation": 0,
+        }
+
+        def patch_record(account, operation):
+            return client.post(
+                "/",
+                json={
+                    "event": PATCH_RECORD,
+                    "account": account,
+                    "password": "pw",
+                    "patient": "patientP",
+                    "operation": operation,
+                },
+            ).json()["message"]
+
+        operations = [
+            {"op": "append_item", "date": key, "item": item},
+            {"op": "append_item", "date": key, "item": item},
+            {
+                "op": "edit_item",
+                "date": key,
+                "index": 1,
+                "item": item | {"water": 50},
+            },
+            {"op": "remove_item", "date": key, "index": 0},
+            {"op": "set_weight", "date": key, "weight": "60 kg"},
+        ]
+        for operation in operations:
+            self.assertEqual(
+                patch_record("patientP", operation), PATCH_RECORD_SUCCESS
+            )
+
+        day = main.records.get("patientP")[key]
+        self.assertEqual(day["data"], [item | {"water": 50}])
+        self.assertEqual(day["count"], 1)
+        self.assertEqual(day["waterSum"], 50)
+        self.assertEqual(day["weight"], "60 kg")
+
+        self.assertIn(
+            "Invalid record format",
+            patch_record(
+                "patientP", {"op": "remove_item", "date": key, "index": 5}
+            ),
+        )
+        self.assertIn(
+            "Invalid record format",
+            patch_record(
+                "patientP", {"op": "set_weight", "date": key, "weight": "-1 kg"}
+            ),
+        )
+
+        restricts = {
+            "op": "set_restricts",
+            "limitAmount": "1000",
+            "foodCheckboxChecked": True,
+            "waterCheckboxChecked": False,
+        }
+        self.assertEqual(patch_record("patientP", restricts), INVALID_ACCT_TYPE)
+        self.assertEqual(
+            patch_record("monitorP", restricts), PATCH_RECORD_SUCCESS
+        )
+        self.assertEqual(main.records.get("patientP")["limitAmount"], "1000")
+        self.assertEqual(main.records.get("patientP")[key], day)
+
+    def test_batch(self):
+        db.add_account("monitorB", "pw", db.AccountType.MONITOR)
+        db.add_account("patientB", "pw", db.AccountType.PATIENT)
+        main.records.set("patientB", {"limitAmount": ""})
+
+        res = client.post(
+            "/",
+            json={
+                "event": BATCH,
+                "account": "monitorB",
+                "password": "pw",
+                "operations": [
+                    {"event": ADD_PATIENT, "patient": "patientB"},
+                    {"event": FETCH_UNMONITORED_PATIENTS},
+                    {"event": FETCH_MONITORING_PATIENTS},
+                    {"event": ADD_PATIENT},
+                    {"event": LOGIN},
+                    {"event": BATCH, "operations": []},
+                    {"event": FETCH_RECORD, "patient": "monitorB"},
+                ],
+            },
+        ).json()
+        self.assertEqual(res["message"], BATCH_SUCCESS)
+        results = res["results"]
+        self.assertEqual(results[0]["message"], ADD_PATIENT_SUCCESS)
+        # Later operations see the changes of earlier ones
+        self.assertEqual(results[1]["unmonitored_patients"], [])
+        self.assertEqual(
+            results[2]["patient_records"], {"patientB": {"limitAmount": ""}}
+        )
+        self.assertEqual(results[3]["message"], MISSING_PARAMETER)
+        self.assertEqual(results[4]["message"], INVALID_EVENT)
+        self.assertEqual(results[5]["message"], INVALID_EVENT)
+        self.assertEqual(results[6]["message"], INVALID_ACCT_TYPE)
+
+        # A patient's record changes are written once for the whole batch
+        today = date.today()
+        key = f"{today.year}_{today.month}_{today.day}"
+        item = {
+            "time": datetime.now().strftime("%H:%M"),
+            "food": 100,
+            "water": 200,
+            "urination": 1,
+            "defecation": 0,
+        }
+        operation = {
+            "event": PATCH_RECORD,
+            "patient": "patientB",
+            "operation": {"op": "append_item", "date": key, "item": item},
+        }
+        with patch.object(
+            main.records, "flush", wraps=main.records.flush
+        ) as flush:
+            res = client.post(
+                "/",
+                json={
+                    "event": BATCH,
+                    "account": "patientB",
+                    "password": "pw",
+                    "operations": [operation, operation, operation],
+                },
+            ).json()
+        self.assertEqual(
+            [result["message"] for result in res["results"]],
+            [PATCH_RECORD_SUCCESS] * 3,
+        )
+        self.assertEqual(flush.call_count, 1)
+        self.assertEqual(
+            JsonFileBackend(TEST_DATA_JSON).read()["patientB"][key]["count"], 3
+        )
+
+        for operations in [[], [operation] * 21, {"event": FETCH_RECORD}, [1]]:
+            res = client.post(
+                "/",
+                json={
+                    "event": BATCH,
+                    "account": "patientB",
+                    "password": "pw",
+                    "operations": operations,
+                },
+            ).json()
+            self.assertEqual(res["message"], INVALID_BATCH)
+
+        res = client.post(
+            "/",
+            json={
+                "event": BATCH,
+                "account": "patientB",
+                "password": "wrong",
+                "operations": [operation],
+            },
+        ).json()
+        self.assertEqual(res["message"], AUTH_FAIL_PASSWORD)
+
+    def test_etag(self):
+        db.add_account("monitorE", "pw", db.AccountType.MONITOR)
+        db.add_account("patientE", "pw", db.AccountType.PATIENT)
+        db.add_monitored_patient("monitorE", "patientE")
+        today = date.today()
+        key = f"{today.year}_{today.month}_{today.day}"
+        item = {
+            "time": "00:00",
+            "food": 100,
+            "water": 200,
+            "urination": 1,
+            "defecation": 0,
+        }
+        main.records.set(
+            "patientE",
+            {
+                "limitAmount": "",
+                key: {
+                    "data": [item] * 50,
+                    "count": 50,
+                    "recordDate": f"{today.month}/{today.day}",
+                    "foodSum": 5000,
+                    "waterSum": 10000,
+                    "urinationSum": 50,
+                    "defecationSum": 0,
+                    "weight": "NaN",
+                },
+            },
+        )
+
+        def fetch(event, headers=None, **params):
+            return client.post(
+                "/",
+                json={"event": event, "account": "monitorE", "password": "pw"}
+                | params,
+                headers=headers,
+            )
+
+        not_modified = metrics.RESPONSE_CACHE.get("not_modified")
+        hits = metrics.RESPONSE_CACHE.get("hit")
+        res = fetch(FETCH_RECORD, patient="patientE")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["content-encoding"], "gzip")
+        etag = res.headers["etag"]
+        body = res.json()
+
+        # Another session of the same account has the same view
+        res = fetch(FETCH_RECORD, {"If-None-Match": etag}, patient="patientE")
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["etag"], etag)
+        self.assertEqual(res.content, b"")
+
+        res = fetch(
+            FETCH_RECORD, {"Accept-Encoding": "identity"}, patient="patientE"
+        )
+        self.assertNotIn("content-encoding", res.headers)
+        self.assertEqual(res.json(), body)
+
+        self.assertEqual(
+            metrics.RESPONSE_CACHE.get("not_modified") - not_modified, 1
+        )
+        self.assertEqual(metrics.RESPONSE_CACHE.get("hit") - hits, 1)
+
+        # Large responses without an ETag are still compressed
+        for params in [
+            {"event": FETCH_MONITORING_PATIENTS},
+            {"event": FETCH_MONITORING_PATIENTS, "since": {}},
+            {"event": FETCH_RECORD, "patient": "patientE", "since": 0},
+        ]:
+            res = fetch(**params)
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn("etag", res.headers)
+            self.assertEqual(res.headers["content-encoding"], "gzip")
+            body = res.json()
+            res = fetch(headers={"Accept-Encoding": "identity"}, **params)
+            self.assertNotIn("content-encoding", res.headers)
+            self.assertEqual(res.json(), body)
+
+        # A write changes the ETag
+        res = client.post(
+            "/",
+            json={
+                "event": PATCH_RECORD,
+                "account": "patientE",
+                "password": "pw",
+                "patient": "patientE",
+                "operation": {
+                    "op": "set_weight",
+                    "date": key,
+                    "weight": "60 kg",
+                },
+            },
+        )
+        self.assertEqual(res.json()["message"], PATCH_RECORD_SUCCESS)
+        res = fetch(FETCH_RECORD, {"If-None-Match": etag}, patient="patientE")
+        self.assertEqual(res.status_code, 200)
+
+        res = fetch(
+            FETCH_RECORD,
+            {"If-None-Match": res.headers["etag"]},
+            patient="patientE",
+        )
+        self.assertEqual(res.status_code, 304)
+
+        # Errors are not cached
+        res = fetch(FETCH_RECORD, patient="monitorE")
+        self.assertEqual(res.json()["message"], INVALID_ACCT_TYPE)
+        self.assertNotIn("etag", res.headers)
+
+    def test_push_records(self):
+        db.add_account("monitorW", "pw", db.AccountType.MONITOR)
+        db.add_account("patientW", "pw", db.AccountType.PATIENT)
+        main.records.set("patientW", {"limitAmount": ""})
+
+        res = client.post(
+            "/events", json={"account": "monitorW", "password": "x"}
+        )
+        self.assertEqual(res.json()["message"], AUTH_FAIL_PASSWORD)
+
+        def post(event, **kwargs):
+            return client.post(
+                "/",
+                json={
+                    "event": event,
+                    "account": "monitorW",
+                    "password": "pw",
+                    "patient": "patientW",
+                }
+                | kwargs,
+            ).json()["message"]
+
+        async def receive(events):
+            return json.loads((await events.__anext__()).removeprefix("data: "))
+
+        async def follow_monitor():
+            events = main.record_events(
+                "monitorW", db.AccountType.MONITOR, [], {}
+            )
+            self.assertEqual((await receive(events))["message"], AUTH_SUCCESS)
+
+            self.assertEqual(post(ADD_PATIENT), ADD_PATIENT_SUCCESS)
+            message = await receive(events)
+            self.assertEqual(message["event"], UPDATE_RECORD)
+            self.assertEqual(message["patient"], "patientW")
+            self.assertEqual(message["password"], "pw")
+            self.assertEqual(message["record"], {"limitAmount": ""})
+            self.assertFalse(message["partial"])
+
+            operation = {
+                "op": "set_restricts",
+                "limitAmount": "800",
+                "foodCheckboxChecked": False,
+                "waterCheckboxChecked": True,
+            }
+            self.assertEqual(
+                post(PATCH_RECORD, operation=operation), PATCH_RECORD_SUCCESS
+            )
+            message = await receive(events)
+            self.assertTrue(message["partial"])
+            self.assertEqual(message["record"]["limitAmount"], "800")
+            self.assertEqual(
+                message["revision"], main.records.revision("patientW")
+            )
+
+            self.assertEqual(
+                post(REMOVE_PATIENT, patient_password="pw"),
+                REMOVE_PATIENT_SUCCESS,
+            )
+            self.assertEqual(
+                await receive(events),
+                {"event": REMOVE_PATIENT, "patient": "patientW"},
+            )
+            await events.aclose()
+
+        asyncio.run(follow_monitor())
+
+    def test_push_records_denied(self):
+        db.add_account("monitorD", "pw", db.AccountType.MONITOR)
+        db.add_account("patientD1", "pw1", db.AccountType.PATIENT)
+        db.add_account("patientD2", "pw2", db.AccountType.PATIENT)
+        db.add_monitored_patient("monitorD", "patientD1")
+        main.records.set("patientD1", {"limitAmount": "1"})
+        main.records.set("patientD2", {"limitAmount": "2"})
+
+        for patients in [5, "patientD1", [1], {"patientD1": 0}]:
+            res = client.post(
+                "/events",
+                json={
+                    "account": "monitorD",
+                    "password": "pw",
+                    "patients": patients,
+                },
+            )
+            self.assertEqual(res.json()["message"], INVALID_PATIENTS)
+
+        class Request:
+            def __init__(self, body):
+                self.body = body
+
+            async def json(self):
+                return self.body
+
+        async def follow(account, password, patients):
+            response = await main.push_records(
+                Request(
+                    {
+                        "account": account,
+                        "password": password,
+                        "patients": patients,
+                    }
+                )
+            )
+            events = response.body_iterator
+            messages = []
+            try:
+                while True:
+                    event = await asyncio.wait_for(events.__anext__(), 0.5)
+                    messages.append(json.loads(event.removeprefix("data: ")))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                await events.aclose()
+            self.assertEqual(messages[0]["message"], AUTH_SUCCESS)
+            return {message["patient"]: message for message in messages[1:]}
+
+        # A patient only follows itself and never gets passwords
+        messages = asyncio.run(
+            follow("patientD1", "pw1", ["patientD1", "patientD2", "monitorD"])
+        )
+        self.assertEqual(list(messages), ["patientD1"])
+        self.assertIsNone(messages["patientD1"]["password"])
+
+        # A monitor only follows its patients, never other monitors
+        messages = asyncio.run(
+            follow("monitorD", "pw", ["patientD1", "patientD2", "monitorD"])
+        )
+        self.assertEqual(list(messages), ["patientD1"])
+        self.assertEqual(messages["patientD1"]["password"], "pw1")
+
+    def test_push_records_revoked(self):
+        db.add_account("monitorR", "pw", db.AccountType.MONITOR)
+        for patient in ["patientR1", "patientR2", "patientR3"]:
+            db.add_account(patient, "pw", db.AccountType.PATIENT)
+            db.add_monitored_patient("monitorR", patient)
+            main.records.set(patient, {"limitAmount": ""})
+
+        async def receive(events):
+            event = await asyncio.wait_for(events.__anext__(), 5)
+            return json.loads(event.removeprefix("data: "))
+
+        async def follow(account, account_type, patients):
+            events = main.record_events(account, account_type, patients, {})
+            self.assertEqual((await receive(events))["message"], AUTH_SUCCESS)
+            for _ in patients:
+                self.assertEqual(
+                    (await receive(events))["event"], UPDATE_RECORD
+                )
+            return events
+
+        async def revoke(request):
+            monitor = await follow(
+                "monitorR", db.AccountType.MONITOR, ["patientR1", "patientR2"]
+            )
+            stale = await follow(
+                request["account"], db.AccountType.PATIENT, [request["account"]]
+            )
+            res = client.post("/", json={"password": "pw"} | request)
+            self.assertEqual(res.json()["message"], ACCT_CHANGE_SUCCESS)
+            # The stream of the revoked account ends
+            with self.assertRaises(StopAsyncIteration):
+                await receive(stale)
+            return monitor
+
+        async def change_password():
+            monitor = await revoke(
+                {
+                    "event": CHANGE_PASSWORD,
+                    "account": "patientR1",
+                    "new_password": "new",
+                }
+            )
+            # Monitors still get the new password
+            message = await receive(monitor)
+            self.assertEqual(message["patient"], "patientR1")
+            self.assertEqual(message["password"], "new")
+            await monitor.aclose()
+
+        async def change_username():
+            monitor = await revoke(
+                {
+                    "event": CHANGE_USERNAME,
+                    "account": "patientR2",
+                    "new_account": "patientR4",
+                }
+            )
+            await monitor.aclose()
+
+        async def delete_patient():
+            stale = await follow(
+                "patientR3", db.AccountType.PATIENT, ["patientR3"]
+            )
+            res = client.post(
+                "/",
+                json={
+                    "event": DELETE_PATIENT,
+                    "account": "monitorR",
+                    "password": "pw",
+                    "patient": "patientR3",
+                    "patient_password": "pw",
+                },
+            )
+            self.assertEqual(res.json()["message"], DELETE_PATIENT_SUCCESS)
+            with self.assertRaises(StopAsyncIteration):
+                await receive(stale)
+
+        asyncio.run(change_password())
+        asyncio.run(change_username())
+        asyncio.run(delete_patient())
+        self.assertFalse(main.broadcaster._subscriptions)
+
+    def test_login_session(self):
+        db.add_account("monitorS", "pw", db.AccountType.MONITOR)
+        db.add_account("patientS", "pw", db.AccountType.PATIENT)
+        db.add_monitored_patient("monitorS", "patientS")
+        main.records.set("patientS", {"limitAmount": ""})
+
+        res = client.post(
+            "/", json={"event": LOGIN, "account": "monitorS", "password": "x"}
+        )
+        self.assertEqual(res.json()["message"], AUTH_FAIL_PASSWORD)
+
+        res = client.post(
+            "/", json={"event": LOGIN, "account": "monitorS", "password": "pw"}
+        )
+        self.assertEqual(res.json()["message"], AUTH_SUCCESS)
+        self.assertEqual(res.json()["account_type"], db.AccountType.MONITOR)
+        session = res.json()["session"]
+
+        with patch("db.get_credentials") as get_credentials:
+            res = client.post(
+                "/",
+                json={"event": FETCH_MONITORING_PATIENTS, "session": session},
+            )
+            get_credentials.assert_not_called()
+        self.assertEqual(
+            res.json()["message"], FETCH_MONITORING_PATIENTS_SUCCESS
+        )
+        self.assertIn("patientS", res.json()["patient_records"])
+
+        res = client.post(
+            "/",
+            json={
+                "event": FETCH_RECORD,
+                "session": session,
+                "patient": "patientS",
+            },
+        )
+        self.assertEqual(res.json()["message"], FETCH_RECORD_SUCCESS)
+
+        res = client.post("/", json={"event": LOGOUT, "session": session})
+        self.assertEqual(res.json()["message"], LOGOUT_SUCCESS)
+        res = client.post(
+            "/", json={"event": FETCH_MONITORING_PATIENTS, "session": session}
+        )
+        self.assertEqual(res.json()["message"], SESSION_EXPIRED)
+
+        res = client.post(
+            "/", json={"event": LOGIN, "account": "patientS", "password": "pw"}
+        )
+        session = res.json()["session"]
+        res = client.post(
+            "/",
+            json={
+                "event": CHANGE_PASSWORD,
+                "account": "patientS",
+                "password": "pw",
+                "patient": "patientS",
+                "new_password": "pw2",
+            },
+        )
+        self.assertEqual(res.json()["message"], ACCT_CHANGE_SUCCESS)
+        res = client.post(
+            "/",
+            json={
+                "event": FETCH_RECORD,
+                "session": session,
+                "patient": "patientS",
+            },
+        )
+        self.assertEqual(res.json()["message"], SESSION_EXPIRED)
+
+    def test_session_expiry(self):
+        sessions = SessionTable(0.05)
+        token = sessions.create("patientS", db.AccountType.PATIENT)
+        self.assertEqual(sessions.get(token).account, "patientS")
+        time.sleep(0.1)
+        self.assertIsNone(sessions.get(token))
+
+    def test_invalid_token(self):
         res = client.post(
             "/",
             json={
@@ -339,8 +1243,70 @@ class TestAPIEndpoints(unittest.TestCase):
         )
         self.assertEqual(res.json()["message"], "Incorrect token")
 
-    @patch("main.load_json_file", side_effect=mocked_load_json_file)
-    def test_invalid_event_without_token(self, _):
+    def test_missing_parameter(self):
+        db.add_account("patientM", "pw", db.AccountType.PATIENT)
+        res = client.post(
+            "/",
+            json={
+                "event": UPDATE_RECORD,
+                "account": "patientM",
+                "password": "pw",
+                "patient": "patientM",
+            },
+        )
+        self.assertEqual(res.json()["message"], MISSING_PARAMETER)
+
+    def test_event_stats(self):
+        credentials = {"account": "patientE", "password": "pw"}
+        db.add_account("patientE", "pw", db.AccountType.PATIENT)
+        client.post("/", json={"event": LOGIN} | credentials)
+        client.post("/", json={"event": LOGIN} | credentials)
+
+        res = client.post("/", json={"event": EVENT_STATS})
+        self.assertEqual(res.json()["message"], INVALID_EVENT)
+
+        res = client.post(
+            "/", json={"event": EVENT_STATS, "token": TEST_TOKEN}
+        ).json()
+        self.assertEqual(res["message"], EVENT_STATS_SUCCESS)
+        self.assertGreaterEqual(res["latency"][LOGIN]["count"], 2)
+        self.assertGreater(res["latency"][LOGIN]["total"], 0)
+
+    def test_metrics(self):
+        db.add_account("patientX", "pw", db.AccountType.PATIENT)
+        client.post(
+            "/",
+            json={
+                "event": FETCH_RECORD,
+                "account": "patientX",
+                "password": "pw",
+                "patient": "patientX",
+            },
+        )
+
+        res = client.get("/metrics")
+        self.assertTrue(res.headers["content-type"].startswith("text/plain"))
+        lines = res.text.splitlines()
+        self.assertIn("# TYPE pior_event_duration_seconds histogram", lines)
+        self.assertTrue(
+            any(
+                line.startswith(
+                    f'pior_requests_total{{event="{FETCH_RECORD}"}}'
+                )
+                for line in lines
+            )
+        )
+        for stage in ["parse", "auth", "serialize"]:
+            self.assertTrue(
+                any(
+                    line.startswith(
+                        f'pior_stage_duration_seconds_count{{stage="{stage}"}}'
+                    )
+                    for line in lines
+                )
+            )
+
+    def test_invalid_event_without_token(self):
         res = client.post("/", json={"event": "does_not_exist"})
         self.assertEqual(res.json()["message"], INVALID_EVENT)
 
@@ -0,0 +1,69 @@
+import json
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+from config import Config
+
+TEST_CONFIG_JSON = "test_config.json"
+
+
+def write_config(data, mtime):
+    with open(TEST_CONFIG_JSON, "w") as file:
+        file.write(data if isinstance(data, str) else json.dumps(data))
+    os.utime(TEST_CONFIG_JSON, (mtime, mtime))
+
+
+class TestConfig(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(TEST_CONFIG_JSON):
+            os.remove(TEST_CONFIG_JSON)
+
+    def test_reloads_when_modified(self):
+        write_config({"token": "old"}, 1000)
+        config = Config(TEST_CONFIG_JSON, check_interval=0)
+        self.assertEqual(config.get("token"), "old")
+        self.assertEqual(config.get("api_url", ""), "")
+
+        write_config({"token": "new", "api_url": "http://localhost"}, 2000)
+        self.assertEqual(config["token"], "new")
+        self.assertEqual(config.get("api_url"), "http://localhost")
+
+    def test_checks_mtime_once_per_interval(self):
+        write_config({"token": "old"}, 1000)
+        config = Config(TEST_CONFIG_JSON, check_interval=60)
+        write_config({"token": "new"}, 2000)
+        self.assertEqual(config.get("token"), "old")
+
+        config.reload()
+        self.assertEqual(config.get("token"), "new")
+
+    def test_keeps_values_on_invalid_json(self):
+        write_config({"token": "old"}, 1000)
+        config = Config(TEST_CONFIG_JSON, check_interval=0)
+        write_config('{"token": ', 2000)
+        self.assertEqual(config.get("token"), "old")
+
+        with self.assertRaises(json.JSONDecodeError):
+            Config(TEST_CONFIG_JSON)
+
+    def test_keeps_values_when_replaced(self):
+        write_config({"token": "old"}, 1000)
+        config = Config(TEST_CONFIG_JSON, check_interval=0)
+        write_config({"token": "new"}, 2000)
+
+        # The file is replaced between the check of its mtime and opening it
+        with patch("builtins.open", side_effect=FileNotFoundError):
+            self.assertEqual(config.get("token"), "old")
+        self.assertEqual(config.get("token"), "new")
+
+    def test_reads_file_once(self):
+        write_config({"token": "old"}, time.time())
+        config = Config(TEST_CONFIG_JSON, check_interval=0)
+        os.remove(TEST_CONFIG_JSON)
+        self.assertEqual(config.get("token"), "old")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,10 @@
+import asyncio
+import json
 import os
+import threading
 import unittest
 
+import aio
 import db
 from constants import (
     ACCT_ALREADY_EXISTS,
@@ -9,10 +13,12 @@ from constants import (
     ACCT_NOT_EXIST,
     AUTH_FAIL_PASSWORD,
     AUTH_SUCCESS,
+    IO_THREADS,
 )
 from db import AccountType
 
 TEST_DB = "test_accounts.db"
+TEST_ACCT_REL_JSON = "test_account_relations.json"
 
 
 class TestDBOperations(unittest.TestCase):
@@ -21,8 +27,10 @@ class TestDBOperations(unittest.TestCase):
         db.create_table()
 
     def tearDown(self):
-        if os.path.exists(TEST_DB):
-            os.remove(TEST_DB)
+        db.close_connections()
+        for path in [TEST_DB, TEST_ACCT_REL_JSON]:
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_add_account_success(self):
         result = db.add_account("user1", "pass1", AccountType.PATIENT)
@@ -79,6 +87,96 @@ class TestDBOperations(unittest.TestCase):
         self.assertIn("patient1", usernames)
         self.assertNotIn("monitor1", usernames)
 
+    def test_get_accounts_by_username(self):
+        db.add_account("patient1", "pass1", AccountType.PATIENT)
+        db.add_account("monitor1", "pass2", AccountType.MONITOR)
+        self.assertEqual(
+            db.get_accounts_by_username(["patient1", "monitor1", "missing"]),
+            {
+                "patient1": ("pass1", AccountType.PATIENT),
+                "monitor1": ("pass2", AccountType.MONITOR),
+            },
+        )
+        self.assertEqual(db.get_accounts_by_username([]), {})
+
+        usernames = [f"patient{i}" for i in range(2, db._BATCH_SIZE + 10)]
+        for username in usernames:
+            db.add_account(username, username, AccountType.PATIENT)
+        self.assertEqual(
+            len(db.get_accounts_by_username(usernames)), len(usernames)
+        )
+
+    def test_connection_reused_per_thread(self):
+        conn = db.get_connection()
+        self.assertIs(db.get_connection(), conn)
+        self.assertEqual(
+            conn.execute("PRAGMA journal_mode").fetchone()[0], "wal"
+        )
+
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(db.get_connection())
+        )
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+        db.close_connections()
+        self.assertIsNot(db.get_connection(), conn)
+
+    def test_io_threads_keep_connections(self):
+        db.close_connections()
+
+        async def query():
+            await asyncio.gather(
+                *(aio.run(db.get_password, "user1") for _ in range(50))
+            )
+
+        # Calls from later event loops reuse the same threads
+        for _ in range(3):
+            asyncio.run(query())
+        self.assertLessEqual(len(db._connections), IO_THREADS)
+
+    def test_monitored_patients(self):
+        db.add_account("monitor1", "monitor1", AccountType.MONITOR)
+        for patient in ["patient2", "patient1", "patient3"]:
+            db.add_account(patient, patient, AccountType.PATIENT)
+
+        self.assertTrue(db.add_monitored_patient("monitor1", "patient2"))
+        self.assertTrue(db.add_monitored_patient("monitor1", "patient1"))
+        self.assertFalse(db.add_monitored_patient("monitor1", "patient1"))
+        self.assertEqual(
+            db.get_monitored_patients("monitor1"), ["patient1", "patient2"]
+        )
+        self.assertEqual(
+            [acct[1] for acct in db.get_unmonitored_patient_accounts()],
+            ["patient3"],
+        )
+
+        self.assertTrue(db.remove_monitored_patient("monitor1", "patient2"))
+        self.assertFalse(db.remove_monitored_patient("monitor1", "patient2"))
+
+        db.change_account_username("patient1", "patient4")
+        self.assertEqual(db.get_monitored_patients("monitor1"), ["patient4"])
+        db.delete_account("patient4")
+        self.assertEqual(db.get_monitored_patients("monitor1"), [])
+
+    def test_migrate_relations(self):
+        with open(TEST_ACCT_REL_JSON, "w") as file:
+            json.dump(
+                {"monitor_accounts": {"monitor1": ["patient1", "patient2"]}},
+                file,
+            )
+
+        db.migrate_relations(TEST_ACCT_REL_JSON)
+        self.assertEqual(
+            db.get_monitored_patients("monitor1"), ["patient1", "patient2"]
+        )
+
+        db.remove_monitored_patient("monitor1", "patient1")
+        db.migrate_relations(TEST_ACCT_REL_JSON)
+        self.assertEqual(db.get_monitored_patients("monitor1"), ["patient2"])
+
 
 if __name__ == "__main__":
     unittest.main()
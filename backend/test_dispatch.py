@@ -0,0 +1,44 @@
+import unittest
+
+from dispatch import AUTH_NONE, AUTH_SESSION, Dispatcher
+
+
+class TestDispatcher(unittest.TestCase):
+    def test_find(self):
+        dispatcher = Dispatcher()
+
+        @dispatcher.register("change", params=["new"])
+        async def change(post_request, account, account_type):
+            pass
+
+        @dispatcher.register("change", auth=AUTH_NONE, admin=True)
+        async def admin_change(post_request, account, account_type):
+            pass
+
+        handler = dispatcher.find("change", admin=False)
+        self.assertIs(handler.func, change)
+        self.assertEqual(handler.auth, AUTH_SESSION)
+        self.assertEqual(handler.params, ["new"])
+        self.assertIs(dispatcher.find("change", admin=True).func, admin_change)
+        self.assertIsNone(dispatcher.find("missing", admin=True))
+        self.assertIsNone(dispatcher.find(["change"], admin=False))
+
+    def test_latency(self):
+        dispatcher = Dispatcher()
+
+        @dispatcher.register("fetch")
+        async def fetch(post_request, account, account_type):
+            pass
+
+        self.assertEqual(dispatcher.latency()["fetch"]["count"], 0)
+        dispatcher.observe("fetch", 0.1)
+        dispatcher.observe("fetch", 0.3)
+        latency = dispatcher.latency()["fetch"]
+        self.assertEqual(latency["count"], 2)
+        self.assertAlmostEqual(latency["total"], 0.4)
+        self.assertAlmostEqual(latency["mean"], 0.2)
+        self.assertAlmostEqual(latency["max"], 0.3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import gzip
+import unittest
+from unittest.mock import patch
+
+import httpcache
+from httpcache import (
+    ResponseCache,
+    choose_encoding,
+    etag_matches,
+    make_etag,
+    view_key,
+)
+
+
+class TestHttpCache(unittest.TestCase):
+    def test_etag(self):
+        key = view_key("fetch_record", "patient1", {"patient": "patient1"})
+        # Credentials do not change the view
+        self.assertEqual(
+            key,
+            view_key(
+                "fetch_record",
+                "patient1",
+                {"patient": "patient1", "password": "pw", "session": "s"},
+            ),
+        )
+        self.assertNotEqual(
+            key,
+            view_key("fetch_record", "monitor1", {"patient": "patient1"}),
+        )
+
+        etag = make_etag(key, 1)
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        self.assertEqual(etag, make_etag(key, 1))
+        self.assertNotEqual(etag, make_etag(key, 2))
+
+    def test_etag_matches(self):
+        etag = '"abc"'
+        self.assertTrue(etag_matches('"abc"', etag))
+        self.assertTrue(etag_matches('"x", W/"abc"', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches('"abd"', etag))
+        self.assertFalse(etag_matches(None, etag))
+
+    def test_choose_encoding(self):
+        with patch.object(httpcache, "ENCODINGS", ["br", "gzip"]):
+            self.assertEqual(choose_encoding("gzip, deflate, br"), "br")
+            self.assertEqual(choose_encoding("gzip, br;q=0"), "gzip")
+            self.assertEqual(choose_encoding("GZIP;q=0.5"), "gzip")
+            self.assertEqual(choose_encoding("*"), "br")
+        self.assertIsNone(choose_encoding("identity"))
+        self.assertIsNone(choose_encoding(None))
+
+    def test_response_cache(self):
+        cache = ResponseCache(2)
+        body = b'{"message":"x","data":"' + b"a" * 4096 + b'"}'
+        cached = cache.put(b"view1", '"1"', body)
+        self.assertIs(cache.get(b"view1", '"1"'), cached)
+        # A write changes the ETag, the old body is not served
+        self.assertIsNone(cache.get(b"view1", '"2"'))
+
+        self.assertEqual(cached.encoding_for("gzip, deflate"), "gzip")
+        self.assertIsNone(cached.encoding_for("identity"))
+        self.assertIsNone(cached.get("gzip"))
+        encoded = cached.compress("gzip")
+        self.assertEqual(gzip.decompress(encoded), body)
+        self.assertIs(cached.get("gzip"), encoded)
+        self.assertIs(cached.get(None), body)
+        # Small bodies are not compressed
+        small = cache.put(b"view2", '"1"', b"{}")
+        self.assertIsNone(small.encoding_for("gzip"))
+
+        cache.get(b"view1", '"1"')
+        cache.put(b"view3", '"1"', b"{}")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(b"view2", '"1"'))
+        self.assertIsNotNone(cache.get(b"view1", '"1"'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import io
+import json
+import os
+import unittest
+
+import db
+import logs
+import main
+from constants import AUTH_FAIL_PASSWORD, AUTH_SUCCESS
+
+TEST_DB = "test_logs_accounts.db"
+
+
+class TestLogs(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        db.ACCOUNTS_DB = TEST_DB
+        db.create_table()
+
+    def tearDown(self):
+        logs.setup()
+        db.close_connections()
+        if os.path.exists(TEST_DB):
+            os.remove(TEST_DB)
+
+    def lines(self) -> list[dict]:
+        logs.shutdown()
+        return [
+            json.loads(line) for line in self.stream.getvalue().splitlines()
+        ]
+
+    def test_structured_records(self):
+        logs.setup("INFO", stream=self.stream)
+        db.add_account("patientL", "pw", db.AccountType.PATIENT)
+        db.authenticate("patientL", "pw")
+
+        (line,) = self.lines()
+        self.assertEqual(line["level"], "INFO")
+        self.assertEqual(line["logger"], "pior.db")
+        self.assertEqual(line["message"], "Account created.")
+        self.assertEqual(line["account"], "patientL")
+
+    def test_debug_sampling(self):
+        db.add_account("patientL", "pw", db.AccountType.PATIENT)
+        logs.setup("DEBUG", sample_rate=0, stream=self.stream)
+        for _ in range(10):
+            db.authenticate("patientL", "pw")
+        db.delete_account("patientL")
+
+        self.assertEqual(
+            [line["message"] for line in self.lines()], ["Account deleted."]
+        )
+
+        self.stream = io.StringIO()
+        logs.setup("DEBUG", sample_rate=1, stream=self.stream)
+        db.authenticate("patientL", "pw")
+        self.assertEqual(self.lines()[0]["level"], "DEBUG")
+
+    def test_exception(self):
+        logs.setup("INFO", stream=self.stream)
+        try:
+            raise OSError("disk full")
+        except OSError:
+            logs.get_logger("store").exception("Failed to flush records")
+
+        (line,) = self.lines()
+        self.assertEqual(line["message"], "Failed to flush records")
+        self.assertIn("OSError: disk full", line["exception"])
+
+    def test_authorize_logged(self):
+        db.add_account("patientL", "pw", db.AccountType.PATIENT)
+        logs.setup("DEBUG", stream=self.stream)
+        for password in ["pw", "x"]:
+            asyncio.run(
+                main.authorize({"account": "patientL", "password": password})
+            )
+
+        lines = self.lines()
+        self.assertEqual(
+            [(line["logger"], line["message"]) for line in lines],
+            [("pior.main", AUTH_SUCCESS), ("pior.main", AUTH_FAIL_PASSWORD)],
+        )
+        self.assertEqual(lines[0]["account"], "patientL")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from metrics import Counter, Histogram
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counter(self):
+        counter = Counter("requests_total", "Requests.", ["event"])
+        counter.inc("login")
+        counter.inc("login")
+        counter.inc('say "hi"')
+        self.assertEqual(counter.get("login"), 2)
+        self.assertEqual(
+            counter.render(),
+            [
+                "# HELP requests_total Requests.",
+                "# TYPE requests_total counter",
+                'requests_total{event="login"} 2',
+                'requests_total{event="say \\"hi\\""} 1',
+            ],
+        )
+
+    def test_histogram(self):
+        histogram = Histogram("seconds", "Latency.", ["stage"], (0.1, 1.0))
+        histogram.observe(0.05, "auth")
+        histogram.observe(0.1, "auth")
+        histogram.observe(0.5, "auth")
+        histogram.observe(2.0, "auth")
+        self.assertEqual(
+            histogram.render()[2:],
+            [
+                'seconds_bucket{stage="auth",le="0.1"} 2',
+                'seconds_bucket{stage="auth",le="1.0"} 3',
+                'seconds_bucket{stage="auth",le="+Inf"} 4',
+                'seconds_sum{stage="auth"} 2.65',
+                'seconds_count{stage="auth"} 4',
+            ],
+        )
+        self.assertEqual(
+            histogram.summary(),
+            {("auth",): {"count": 4, "total": 2.65, "max": 2.0}},
+        )
+
+    def test_timer(self):
+        histogram = Histogram("seconds", "Latency.", [])
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.summary()[()]["count"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import unittest
+
+import serialization
+from serialization import ENCODERS, EncodedJSONResponse
+
+DOCUMENT = {
+    "patient1": {
+        "limitAmount": "500",
+        "isEditing": False,
+        "2025_1_2": {"data": [], "count": 0, "weight": "60 kg"},
+    },
+    "病人": {},
+}
+
+
+class TestSerialization(unittest.TestCase):
+    def tearDown(self):
+        serialization.use("orjson" if "orjson" in ENCODERS else "json")
+
+    def test_encoders_agree(self):
+        for name, (dumps, loads) in ENCODERS.items():
+            with self.subTest(encoder=name):
+                encoded = dumps(DOCUMENT)
+                self.assertEqual(loads(encoded), DOCUMENT)
+                self.assertEqual(json.loads(encoded), DOCUMENT)
+                self.assertNotIn(b"\n", encoded)
+                self.assertNotIn(b", ", encoded)
+
+    def test_use(self):
+        serialization.use("json")
+        self.assertEqual(serialization.ENCODER, "json")
+        self.assertEqual(serialization.dumps_str({"a": [1, 2]}), '{"a":[1,2]}')
+        with self.assertRaises(ValueError):
+            serialization.use("pickle")
+
+    def test_encoded_response(self):
+        response = EncodedJSONResponse({"message": "ok", "records": DOCUMENT})
+        self.assertEqual(response.media_type, "application/json")
+        self.assertEqual(
+            json.loads(response.body), {"message": "ok", "records": DOCUMENT}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
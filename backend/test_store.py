@@ -0,0 +1,368 @@
+import json
+import os
+import threading
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from migrate_records import migrate
+from store import JsonFileBackend, RecordStore, SqliteBackend, write_atomic
+
+TEST_DATA_JSON = "test_store_data.json"
+TEST_ACCT_REL_JSON = "test_store_account_relations.json"
+TEST_RECORDS_DB = "test_records.db"
+
+DAY = {
+    "data": [],
+    "count": 0,
+    "recordDate": "1/2",
+    "foodSum": 0,
+    "waterSum": 0,
+    "urinationSum": 0,
+    "defecationSum": 0,
+    "weight": "NaN",
+}
+
+
+def read_file():
+    return JsonFileBackend(TEST_DATA_JSON).read()
+
+
+class TestRecordStore(unittest.TestCase):
+    def tearDown(self):
+        for path in [
+            TEST_DATA_JSON,
+            f"{TEST_DATA_JSON}.journal",
+            f"{TEST_DATA_JSON}.lock",
+            TEST_ACCT_REL_JSON,
+            TEST_RECORDS_DB,
+            f"{TEST_RECORDS_DB}.lock",
+        ]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def open_store(self, backend, **kwargs) -> RecordStore:
+        store = RecordStore(backend, **kwargs)
+        self.addCleanup(store.release_process_lock)
+        return store
+
+    def test_creates_missing_file(self):
+        self.assertEqual(read_file(), {})
+        self.assertFalse(os.path.exists(TEST_DATA_JSON))
+
+        store = self.open_store(JsonFileBackend(TEST_DATA_JSON))
+        self.assertEqual(store.patients(), [])
+        self.assertEqual(read_file(), {})
+
+    def test_write_behind_until_flush(self):
+        store = self.open_store(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=60
+        )
+        store.set("patient1", {"limitAmount": "500"})
+        store.set("patient2", {})
+        self.assertEqual(store.get("patient1"), {"limitAmount": "500"})
+        self.assertEqual(read_file(), {})
+
+        store.flush()
+        self.assertEqual(
+            read_file(), {"patient1": {"limitAmount": "500"}, "patient2": {}}
+        )
+
+    def test_write_through(self):
+        store = self.open_store(
+            JsonFileBackend(TEST_DATA_JSON, fsync=True), flush_interval=0
+        )
+        store.set("patient1", {})
+        self.assertEqual(read_file(), {"patient1": {}})
+        store.delete("patient1")
+        self.assertEqual(read_file(), {})
+
+    def test_close_flushes_and_reload(self):
+        store = self.open_store(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=60
+        )
+        store.start()
+        store.set("patient1", {"isEditing": False})
+        store.close()
+
+        reloaded = self.open_store(JsonFileBackend(TEST_DATA_JSON))
+        self.assertIn("patient1", reloaded)
+        self.assertEqual(reloaded.get("patient1"), {"isEditing": False})
+
+    def test_journal_replay(self):
+        store = self.open_store(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=0
+        )
+        store.set("patient1", {"limitAmount": "500", "2025_1_2": DAY})
+        store.set("patient2", {})
+        store.update("patient1", {"limitAmount": "400"})
+        store.delete("patient2")
+
+        with open(TEST_DATA_JSON) as file:
+            self.assertEqual(json.load(file), {})
+        with open(f"{TEST_DATA_JSON}.journal", "ab") as file:
+            file.write(b'["patient1",true,{"limitAm')
+
+        journal_size = os.path.getsize(f"{TEST_DATA_JSON}.journal")
+        self.assertEqual(
+            read_file(), {"patient1": {"limitAmount": "400", "2025_1_2": DAY}}
+        )
+        # Reading leaves the files alone
+        self.assertEqual(
+            os.path.getsize(f"{TEST_DATA_JSON}.journal"), journal_size
+        )
+        with open(TEST_DATA_JSON) as file:
+            self.assertEqual(json.load(file), {})
+
+        # Loading compacts the journal into the snapshot
+        self.assertEqual(
+            JsonFileBackend(TEST_DATA_JSON).load(),
+            {"patient1": {"limitAmount": "400", "2025_1_2": DAY}},
+        )
+        self.assertEqual(os.path.getsize(f"{TEST_DATA_JSON}.journal"), 0)
+        with open(TEST_DATA_JSON) as file:
+            self.assertEqual(
+                json.load(file),
+                {"patient1": {"limitAmount": "400", "2025_1_2": DAY}},
+            )
+
+    def test_journal_compaction(self):
+        backend = JsonFileBackend(TEST_DATA_JSON, compact_size=200)
+        store = self.open_store(backend, flush_interval=0)
+        store.set("patient1", {"limitAmount": "", "2025_1_2": DAY})
+        self.assertGreater(os.path.getsize(f"{TEST_DATA_JSON}.journal"), 0)
+
+        store.update("patient1", {"2025_1_3": DAY})
+        self.assertEqual(os.path.getsize(f"{TEST_DATA_JSON}.journal"), 0)
+        with open(TEST_DATA_JSON) as file:
+            self.assertEqual(
+                json.load(file),
+                {
+                    "patient1": {
+                        "limitAmount": "",
+                        "2025_1_2": DAY,
+                        "2025_1_3": DAY,
+                    }
+                },
+            )
+
+        # A crash between the new snapshot and emptying the journal
+        def crash(snapshot):
+            write_atomic(TEST_DATA_JSON, snapshot)
+
+        with patch.object(backend, "compact", side_effect=crash):
+            store.set("patient1", {"limitAmount": "", "2025_1_2": DAY})
+            store.update("patient1", {"limitAmount": "300"})
+        self.assertEqual(
+            read_file(), {"patient1": {"limitAmount": "300", "2025_1_2": DAY}}
+        )
+
+    def test_flush_encodes_outside_lock(self):
+        backend = JsonFileBackend(TEST_DATA_JSON, compact_size=0)
+        store = self.open_store(backend, flush_interval=60)
+        store.set("patient1", {"limitAmount": ""})
+        prepare = backend.prepare
+
+        def set_while_encoding(data, dirty):
+            writer = threading.Thread(target=store.set, args=("patient2", {}))
+            writer.start()
+            writer.join(5)
+            self.assertFalse(writer.is_alive())
+            return prepare(data, dirty)
+
+        with patch.object(backend, "prepare", side_effect=set_while_encoding):
+            store.flush()
+        self.assertEqual(read_file(), {"patient1": {"limitAmount": ""}})
+
+        store.flush()
+        self.assertEqual(
+            read_file(), {"patient1": {"limitAmount": ""}, "patient2": {}}
+        )
+
+    def test_sqlite_backend_round_trip(self):
+        store = self.open_store(
+            SqliteBackend(TEST_RECORDS_DB), flush_interval=0
+        )
+        store.set("patient1", {"limitAmount": "500", "2025_1_2": DAY})
+        store.set("patient2", {"limitAmount": ""})
+        store.set("patient1", {"limitAmount": "400", "2025_1_3": DAY})
+        store.delete("patient2")
+        store.close()
+        self.assertEqual(
+            dict(store.backend.iter_records()), store.backend.read()
+        )
+
+        reloaded = self.open_store(SqliteBackend(TEST_RECORDS_DB))
+        self.assertEqual(reloaded.patients(), ["patient1"])
+        self.assertEqual(
+            reloaded.get("patient1"), {"limitAmount": "400", "2025_1_3": DAY}
+        )
+
+    def test_sqlite_backend_partial_update(self):
+        store = self.open_store(
+            SqliteBackend(TEST_RECORDS_DB), flush_interval=60
+        )
+        store.set("patient1", {"limitAmount": "500", "2025_1_2": DAY})
+        store.flush()
+
+        changed_day = DAY | {"weight": "60 kg"}
+        store.update("patient1", {"2025_1_3": changed_day})
+        store.update("patient1", {"limitAmount": "400"})
+        store.close()
+
+        reloaded = self.open_store(SqliteBackend(TEST_RECORDS_DB))
+        self.assertEqual(
+            reloaded.get("patient1"),
+            {"limitAmount": "400", "2025_1_2": DAY, "2025_1_3": changed_day},
+        )
+
+    def test_changes_since(self):
+        store = self.open_store(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=60
+        )
+        store.set("patient1", {"limitAmount": "", "2025_1_2": DAY})
+        revision = store.revision("patient1")
+        self.assertIsNone(store.changes_since("patient1", revision))
+        self.assertEqual(
+            store.changes_since("patient1", None),
+            ({"limitAmount": "", "2025_1_2": DAY}, False),
+        )
+
+        store.update("patient1", {"2025_1_3": DAY})
+        self.assertGreater(store.revision("patient1"), revision)
+        self.assertEqual(
+            store.changes_since("patient1", revision),
+            ({"2025_1_3": DAY}, True),
+        )
+
+        revision = store.revision("patient1")
+        store.set(
+            "patient1", {"limitAmount": "500", "2025_1_2": DAY, "2025_1_3": DAY}
+        )
+        self.assertEqual(
+            store.changes_since("patient1", revision),
+            ({"limitAmount": "500"}, True),
+        )
+
+        revision = store.revision("patient1")
+        store.set("patient1", {"limitAmount": "500"})
+        self.assertEqual(
+            store.changes_since("patient1", revision),
+            ({"limitAmount": "500"}, False),
+        )
+
+        revision = store.revision("patient1")
+        store.touch("patient1")
+        self.assertEqual(store.changes_since("patient1", revision), ({}, True))
+
+    def test_day_keys(self):
+        store = self.open_store(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=60
+        )
+        store.set(
+            "patient1",
+            {"limitAmount": "", "2025_1_10": DAY, "2025_1_2": DAY},
+        )
+        store.update("patient1", {"2024_12_31": DAY, "2025_1_2": DAY})
+        self.assertEqual(
+            store.day_keys("patient1"), ["2024_12_31", "2025_1_2", "2025_1_10"]
+        )
+        self.assertEqual(
+            store.day_keys("patient1", date(2025, 1, 1), date(2025, 1, 10)),
+            ["2025_1_2", "2025_1_10"],
+        )
+        self.assertEqual(store.day_keys("patient1", end=date(2024, 1, 1)), [])
+
+        store.set("patient1", {"2025_1_3": DAY})
+        self.assertEqual(store.day_keys("patient1"), ["2025_1_3"])
+        store.delete("patient1")
+        self.assertEqual(store.day_keys("patient1"), [])
+
+    def test_summary(self):
+        store = self.open_store(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=60
+        )
+        today = date(2025, 1, 10)
+        self.assertIsNone(store.summary("patient1", today))
+
+        store.set("patient1", {"limitAmount": "", "2025_1_10": DAY})
+        summary = store.summary("patient1", today)
+        self.assertEqual(summary["today"]["intake"], 0)
+        self.assertIs(store.summary("patient1", today), summary)
+
+        store.update("patient1", {"2025_1_10": DAY | {"foodSum": 300}})
+        summary = store.summary("patient1", today)
+        self.assertEqual(summary["today"]["intake"], 300)
+        self.assertEqual(summary["rolling"]["7"]["intake"], 300)
+
+        # The next day starts from empty totals
+        summary = store.summary("patient1", date(2025, 1, 11))
+        self.assertEqual(summary["today"]["intake"], 0)
+        self.assertEqual(summary["rolling"]["7"]["intake"], 300)
+
+        store.delete("patient1")
+        self.assertIsNone(store.summary("patient1", today))
+
+    def test_conflicts(self):
+        store = self.open_store(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=60
+        )
+        store.set("patient1", {"limitAmount": "", "2025_1_2": DAY})
+        base = store.revision("patient1")
+        record = {"limitAmount": "500", "2025_1_2": DAY}
+        self.assertFalse(store.conflicts("patient1", base, record))
+
+        store.set("patient1", record)
+        # The writer's own change does not conflict with itself
+        self.assertFalse(
+            store.conflicts("patient1", base, record | {"2025_1_3": DAY})
+        )
+
+        store.update("patient1", {"2025_1_2": DAY | {"count": 1}})
+        self.assertTrue(store.conflicts("patient1", base, record))
+        self.assertFalse(store.conflicts("patient1", None, record))
+
+    def test_process_lock(self):
+        store = self.open_store(
+            JsonFileBackend(TEST_DATA_JSON), flush_interval=60
+        )
+        store.set("patient1", {"limitAmount": "500"})
+        store.flush()
+        files = {}
+        for path in [TEST_DATA_JSON, f"{TEST_DATA_JSON}.journal"]:
+            with open(path, "rb") as file:
+                files[path] = file.read()
+        self.assertTrue(files[f"{TEST_DATA_JSON}.journal"])
+
+        # A second store fails before it compacts the running one's journal
+        with self.assertRaises(RuntimeError):
+            RecordStore(JsonFileBackend(TEST_DATA_JSON))
+        for path, content in files.items():
+            with open(path, "rb") as file:
+                self.assertEqual(file.read(), content)
+
+        store.close()
+        other = self.open_store(JsonFileBackend(TEST_DATA_JSON))
+        self.assertEqual(other.get("patient1"), {"limitAmount": "500"})
+        other.close()
+
+    def test_migrate_from_json(self):
+        with open(TEST_DATA_JSON, "w") as file:
+            json.dump({"patient1": {"limitAmount": "", "2025_1_2": DAY}}, file)
+        with open(TEST_ACCT_REL_JSON, "w") as file:
+            json.dump(
+                {"monitor_accounts": {"monitor1": ["patient1", "patient2"]}},
+                file,
+            )
+
+        migrate(TEST_DATA_JSON, TEST_ACCT_REL_JSON, TEST_RECORDS_DB)
+        self.assertEqual(
+            SqliteBackend(TEST_RECORDS_DB).read(),
+            {"patient1": {"limitAmount": "", "2025_1_2": DAY}, "patient2": {}},
+        )
+        with self.assertRaises(SystemExit):
+            migrate(TEST_DATA_JSON, TEST_ACCT_REL_JSON, TEST_RECORDS_DB)
+
+
+if __name__ == "__main__":
+    unittest.main()
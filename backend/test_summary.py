@@ -0,0 +1,115 @@
+import unittest
+from datetime import date
+
+from store import index_days
+from summary import parse_weight, summarize
+
+
+def make_day(food, water, urination, defecation=0, weight="NaN"):
+    return {
+        "data": [],
+        "count": 0,
+        "recordDate": "",
+        "foodSum": food,
+        "waterSum": water,
+        "urinationSum": urination,
+        "defecationSum": defecation,
+        "weight": weight,
+    }
+
+
+class TestSummary(unittest.TestCase):
+    def test_parse_weight(self):
+        self.assertEqual(parse_weight("60.5 kg"), 60.5)
+        self.assertIsNone(parse_weight("NaN"))
+        self.assertIsNone(parse_weight("heavy kg"))
+        self.assertIsNone(parse_weight(None))
+
+    def test_summarize(self):
+        record = {
+            "limitAmount": "1000",
+            "foodCheckboxChecked": True,
+            "waterCheckboxChecked": True,
+            "2025_3_1": make_day(900, 900, 900, weight="70 kg"),
+            "2025_3_20": make_day(100, 200, 50, 1, weight="68.5 kg"),
+            "2025_3_28": make_day(300, 400, 200, 2, weight="68 kg"),
+            "2025_3_30": make_day(500, 600, 700, 1),
+        }
+        today = date(2025, 3, 30)
+        days = [day for day in index_days(record) if day[0] >= date(2025, 3, 1)]
+        summary = summarize(record, days, today)
+
+        self.assertEqual(summary["date"], "2025_3_30")
+        self.assertEqual(
+            summary["today"],
+            {
+                "food": 500,
+                "water": 600,
+                "urination": 700,
+                "defecation": 1,
+                "intake": 1100,
+                "output": 700,
+                "balance": 400,
+            },
+        )
+        self.assertEqual(
+            summary["restriction"],
+            {
+                "limit": 1000.0,
+                "restricted": ["food", "water"],
+                "amount": 1100,
+                "remaining": -100.0,
+                "exceeded": True,
+            },
+        )
+        self.assertEqual(summary["rolling"]["7"]["days"], 2)
+        self.assertEqual(summary["rolling"]["7"]["intake"], 1800)
+        self.assertEqual(summary["rolling"]["7"]["balance"], 900)
+        self.assertEqual(summary["rolling"]["30"]["days"], 4)
+        self.assertEqual(summary["rolling"]["30"]["defecation"], 4)
+        self.assertEqual(summary["rolling"]["30"]["output"], 1850)
+        self.assertEqual(
+            summary["weight"],
+            {
+                "latest": 68.0,
+                "date": "2025-03-28",
+                "change_7": None,
+                "change_30": -2.0,
+            },
+        )
+
+    def test_padded_today_key(self):
+        # The pages zero-pad the day of the month
+        record = {
+            "limitAmount": "500",
+            "waterCheckboxChecked": True,
+            "2025_3_04": make_day(0, 800, 0),
+            "2025_3_05": make_day(100, 300, 200),
+        }
+        today = date(2025, 3, 5)
+        summary = summarize(record, index_days(record), today)
+        self.assertEqual(summary["date"], "2025_3_05")
+        self.assertEqual(summary["today"]["water"], 300)
+        self.assertFalse(summary["restriction"]["exceeded"])
+
+        summary = summarize(record, index_days(record)[:1], date(2025, 3, 4))
+        self.assertEqual(summary["date"], "2025_3_04")
+        self.assertEqual(summary["restriction"]["amount"], 800)
+        self.assertTrue(summary["restriction"]["exceeded"])
+        self.assertEqual(summary["rolling"]["7"]["water"], 800)
+
+        summary = summarize(record, [], date(2025, 3, 6))
+        self.assertEqual(summary["date"], "2025_3_06")
+        self.assertEqual(summary["today"]["water"], 0)
+
+    def test_without_restriction_or_today(self):
+        record = {"limitAmount": "", "foodCheckboxChecked": True}
+        summary = summarize(record, [], date(2025, 3, 30))
+        self.assertIsNone(summary["restriction"])
+        self.assertEqual(summary["today"]["intake"], 0)
+        self.assertEqual(summary["rolling"]["30"]["days"], 0)
+        self.assertIsNone(summary["weight"]["latest"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from datetime import date, timedelta
+from datetime import time as time_cls
+
+from pydantic import ValidationError
+from validator import UpdateDataModel, validation_context
+
+SETTINGS = {
+    "isEditing": False,
+    "limitAmount": "",
+    "foodCheckboxChecked": False,
+    "waterCheckboxChecked": False,
+}
+
+
+def make_day(day: date, items: list[dict]) -> tuple[str, dict]:
+    return f"{day.year}_{day.month}_{day.day}", {
+        "data": items,
+        "count": len(items),
+        "recordDate": f"{day.month}/{day.day}",
+        "foodSum": sum(item["food"] for item in items),
+        "waterSum": sum(item["water"] for item in items),
+        "urinationSum": sum(item["urination"] for item in items),
+        "defecationSum": sum(item["defecation"] for item in items),
+        "weight": "NaN",
+    }
+
+
+def make_item(time: str) -> dict:
+    return {
+        "time": time,
+        "food": 100,
+        "water": 0,
+        "urination": 0,
+        "defecation": 0,
+    }
+
+
+class TestIncrementalValidation(unittest.TestCase):
+    def test_skips_unchanged_days(self):
+        yesterday = date.today() - timedelta(days=1)
+        key, day = make_day(yesterday, [make_item("12:00")])
+        broken = day | {"foodSum": 0}
+        with self.assertRaises(ValidationError):
+            UpdateDataModel.model_validate(SETTINGS | {key: broken})
+
+        # Accepted earlier, e.g. before a validation rule was added
+        previous = SETTINGS | {key: broken}
+        UpdateDataModel.model_validate(
+            SETTINGS | {key: dict(broken)},
+            context=validation_context(previous),
+        )
+
+        with self.assertRaises(ValidationError):
+            UpdateDataModel.model_validate(
+                SETTINGS | {key: broken | {"weight": "60 kg"}},
+                context=validation_context(previous),
+            )
+
+    def test_uses_request_time(self):
+        key, day = make_day(date.today(), [make_item("00:01")])
+        context = validation_context()
+        context["now"] = time_cls(0, 0)
+        with self.assertRaises(ValidationError):
+            UpdateDataModel.model_validate(
+                SETTINGS | {key: day}, context=context
+            )
+
+        context["now"] = time_cls(23, 59)
+        UpdateDataModel.model_validate(SETTINGS | {key: day}, context=context)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,13 @@
 from datetime import date, datetime
 from datetime import time as time_cls
-from typing import Any
+from typing import Annotated, Any, Literal
 
 from pydantic import (
     BaseModel,
     Field,
     NonNegativeInt,
     RootModel,
+    ValidationInfo,
     model_validator,
 )
 
@@ -19,14 +20,37 @@ def parse_date_key(key: str) -> date:
         raise ValueError(f"Invalid date key: `{key}`") from e
 
 
-def parse_record_date(value: str) -> date:
+def parse_record_date(value: str, today: date | None = None) -> date:
     try:
         m, d = map(int, value.split("/"))
-        return date.today().replace(month=m, day=d)
+        return (today or date.today()).replace(month=m, day=d)
     except Exception as e:
         raise ValueError(f"Invalid recordDate: `{value}`") from e
 
 
+def validation_context(previous: dict | None = None) -> dict:
+    """Build the pydantic validation context of one request.
+
+    `today` and `now` are read once for every day being validated, and days
+    equal to the same day in `previous`, the last accepted version of the
+    document, are not validated again.
+    """
+    now = datetime.now()
+    return {"today": now.date(), "now": now.time(), "previous": previous or {}}
+
+
+def context_today(info: ValidationInfo) -> date:
+    if info.context is not None and "today" in info.context:
+        return info.context["today"]
+    return date.today()
+
+
+def context_now(info: ValidationInfo) -> time_cls:
+    if info.context is not None and "now" in info.context:
+        return info.context["now"]
+    return datetime.now().time()
+
+
 def parse_time(value: str) -> time_cls:
     try:
         return datetime.strptime(value, "%H:%M").time()
@@ -53,7 +77,7 @@ class DailyRecord(BaseModel):
     weight: str
 
     @model_validator(mode="after")
-    def validate_all(self):
+    def validate_all(self, info: ValidationInfo):
         if self.count != len(self.data):
             raise ValueError("count does not match data length")
 
@@ -65,8 +89,9 @@ class DailyRecord(BaseModel):
                     f"{field}Sum expected {expected}, got {actual}"
                 )
 
-        record_date = parse_record_date(self.recordDate)
-        if record_date > date.today():
+        today = context_today(info)
+        record_date = parse_record_date(self.recordDate, today)
+        if record_date > today:
             raise ValueError(f"recordDate is in the future: {self.recordDate}")
 
         if self.weight != "NaN":
@@ -82,11 +107,12 @@ class DailyRecord(BaseModel):
             if weight_val <= 0:
                 raise ValueError("weight must be a positive floating number")
 
+        if record_date < today:
+            return self
+
+        now = context_now(info)
         for record in self.data:
-            if record_date < date.today():
-                continue
             input_time = parse_time(record.time)
-            now = datetime.now().time()
             if input_time > now:
                 raise ValueError(f"time {input_time} is in the future")
 
@@ -102,7 +128,7 @@ class PatientData(BaseModel):
 
     @model_validator(mode="before")
     @classmethod
-    def split_records(cls, values: dict[str, Any]):
+    def split_records(cls, values: dict[str, Any], info: ValidationInfo):
         values = values.copy()
         reserved = {
             "isEditing",
@@ -110,7 +136,13 @@ class PatientData(BaseModel):
             "foodCheckboxChecked",
             "waterCheckboxChecked",
         }
-        records = {k: v for k, v in values.items() if k not in reserved}
+        # Days unchanged since the last accepted version are already valid
+        previous = (info.context or {}).get("previous", {})
+        records = {
+            k: v
+            for k, v in values.items()
+            if k not in reserved and (k not in previous or previous[k] != v)
+        }
 
         values["records"] = records
         for key in list(values):
@@ -120,20 +152,124 @@ class PatientData(BaseModel):
         return values
 
     @model_validator(mode="after")
-    def check_key_and_record_date(self):
+    def check_key_and_record_date(self, info: ValidationInfo):
+        today = context_today(info)
         for key, record in self.records.items():
-            key_date = parse_date_key(key)
-            if key_date > date.today():
-                raise ValueError(f"record key {key} is in the future")
-            record_date = parse_record_date(record.recordDate)
-            if (
-                key_date.month != record_date.month
-                or key_date.day != record_date.day
-            ):
-                raise ValueError(
-                    f"recordDate {record_date} should be equal to record key {key_date}"
-                )
+            check_key_and_record_date(key, record, today)
+
+
+def check_key_and_record_date(
+    key: str, record: DailyRecord, today: date | None = None
+):
+    today = today or date.today()
+    key_date = parse_date_key(key)
+    if key_date > today:
+        raise ValueError(f"record key {key} is in the future")
+    record_date = parse_record_date(record.recordDate, today)
+    if key_date.month != record_date.month or key_date.day != record_date.day:
+        raise ValueError(
+            f"recordDate {record_date} should be equal to record key {key_date}"
+        )
 
 
 class UpdateDataModel(RootModel[PatientData]):
     pass
+
+
+class AppendItemPatch(BaseModel):
+    op: Literal["append_item"]
+    date: str
+    item: RecordItem
+
+
+class EditItemPatch(BaseModel):
+    op: Literal["edit_item"]
+    date: str
+    index: NonNegativeInt
+    item: RecordItem
+
+
+class RemoveItemPatch(BaseModel):
+    op: Literal["remove_item"]
+    date: str
+    index: NonNegativeInt
+
+
+class SetWeightPatch(BaseModel):
+    op: Literal["set_weight"]
+    date: str
+    weight: str
+
+
+class SetRestrictsPatch(BaseModel):
+    op: Literal["set_restricts"]
+    limitAmount: str
+    foodCheckboxChecked: bool
+    waterCheckboxChecked: bool
+
+
+class PatchModel(
+    RootModel[
+        Annotated[
+            AppendItemPatch
+            | EditItemPatch
+            | RemoveItemPatch
+            | SetWeightPatch
+            | SetRestrictsPatch,
+            Field(discriminator="op"),
+        ]
+    ]
+):
+    pass
+
+
+def empty_daily_record(key: str) -> dict:
+    key_date = parse_date_key(key)
+    return {
+        "data": [],
+        "count": 0,
+        "recordDate": f"{key_date.month}/{key_date.day}",
+        "foodSum": 0,
+        "waterSum": 0,
+        "urinationSum": 0,
+        "defecationSum": 0,
+        "weight": "NaN",
+    }
+
+
+def apply_patch(record: dict, patch: BaseModel) -> dict:
+    """Apply one patch operation to a patient document.
+
+    Returns the top-level keys that changed. Only the touched
+    `DailyRecord` is validated, so the cost does not depend on the length
+    of the patient's history.
+    """
+    if isinstance(patch, SetRestrictsPatch):
+        return patch.model_dump(exclude={"op"})
+
+    day = dict(record.get(patch.date) or empty_daily_record(patch.date))
+    items = list(day["data"])
+    if isinstance(patch, AppendItemPatch):
+        items.append(patch.item.model_dump())
+    elif isinstance(patch, (EditItemPatch, RemoveItemPatch)):
+        if patch.index >= len(items):
+            raise ValueError(f"Item index out of range: {patch.index}")
+        if isinstance(patch, EditItemPatch):
+            items[patch.index] = patch.item.model_dump()
+        else:
+            del items[patch.index]
+    elif isinstance(patch, SetWeightPatch):
+        day["weight"] = patch.weight
+
+    day["data"] = items
+    day["count"] = len(items)
+    for field in ["food", "water", "urination", "defecation"]:
+        day[f"{field}Sum"] = sum(item[field] for item in items)
+
+    context = validation_context()
+    check_key_and_record_date(
+        patch.date,
+        DailyRecord.model_validate(day, context=context),
+        context["today"],
+    )
+    return {patch.date: day}
@@ -20,6 +20,8 @@ Vue.createApp({
       currentDateYY_MM_DD: "",
       // Patient
       patientRecords: {},
+      patientRevisions: {},
+      session: null,
       patientAccounts: [], // monitoredPatients
       unmonitoredPatients: [],
       patientAccountsWithPasswords: [],
@@ -55,6 +57,9 @@ Vue.createApp({
       transferTo: "",
       // Internal Usage
       syncIntervalId: null,
+      pushController: null,
+      pushConnected: false,
+      pushMissed: false,
       dietaryItems: ["food", "water", "urination", "defecation"],
       keysToFilter: {
         isEditing: false,
@@ -152,6 +157,28 @@ Vue.createApp({
         this.confirmResolver = null;
       }
     },
+    credentials() {
+      // A session token skips the password check on the server
+      return this.session !== null
+        ? { session: this.session }
+        : { account: this.account, password: this.password };
+    },
+    async login() {
+      const response = await this.postRequest({
+        event: this.events.LOGIN,
+        account: this.account,
+        password: this.password,
+      });
+      if (response.message === this.events.messages.AUTH_SUCCESS) {
+        this.session = response["session"];
+      }
+    },
+    async logout() {
+      if (this.session === null) return;
+      const session = this.session;
+      this.session = null;
+      await this.postRequest({ event: this.events.LOGOUT, session });
+    },
     async postRequest(payload) {
       try {
         const response = await fetch(this.apiUrl, {
@@ -176,7 +203,23 @@ Vue.createApp({
       }
     },
     processFetchedData(fetchedData) {
-      this.patientRecords = fetchedData["patient_records"];
+      // Only changed patients are sent, partial ones hold changed keys only
+      const patientRecords = {};
+      fetchedData["patient_accounts"].forEach(([patientAccount]) => {
+        const fetchedRecord = fetchedData["patient_records"][patientAccount];
+        if (fetchedRecord === undefined) {
+          patientRecords[patientAccount] = this.patientRecords[patientAccount];
+        } else if (fetchedData["partial_records"].includes(patientAccount)) {
+          patientRecords[patientAccount] = Object.assign(
+            this.patientRecords[patientAccount],
+            fetchedRecord,
+          );
+        } else {
+          patientRecords[patientAccount] = fetchedRecord;
+        }
+      });
+      this.patientRecords = patientRecords;
+      this.patientRevisions = fetchedData["revisions"];
       this.patientAccountsWithPasswords = fetchedData["patient_accounts"];
       this.patientAccounts = this.patientAccountsWithPasswords.map(
         (account) => account[0],
@@ -197,15 +240,18 @@ Vue.createApp({
     },
     async syncMonitorData() {
       if (!this.authenticated) return;
+      // Record changes are pushed while the event stream is up, but
+      // unmonitored patients are not, so those are still polled
       if (
+        !(this.pushConnected && !this.pushMissed) &&
         !this.isEditingRestriction &&
         this.editingRecordIndex === -1 &&
         !this.confirming
       ) {
         const fetchedData = await this.postRequest({
           event: this.events.FETCH_MONITORING_PATIENTS,
-          account: this.account,
-          password: this.password,
+          ...this.credentials(),
+          since: this.patientRevisions,
         });
         if (
           !this.confirming &&
@@ -215,10 +261,116 @@ Vue.createApp({
         ) {
           this.processFetchedData(fetchedData);
           this.searchPatient();
+          this.pushMissed = false;
+        } else if (
+          fetchedData.message === this.events.messages.NOT_MODIFIED
+        ) {
+          this.pushMissed = false;
+        } else if (
+          fetchedData.message === this.events.messages.SESSION_EXPIRED
+        ) {
+          this.session = null;
+          await this.login();
         }
       }
       await this.fetchUnmonitoredPatients();
     },
+    async startPushStream() {
+      if (this.pushController !== null) return;
+      const controller = new AbortController();
+      this.pushController = controller;
+      try {
+        const response = await fetch(
+          `${this.apiUrl.replace(/\/$/, "")}/events`,
+          {
+            method: "POST",
+            mode: "cors",
+            headers: {
+              Accept: "text/event-stream",
+              "Content-Type": "application/json",
+            },
+            body: JSON.stringify({
+              ...this.credentials(),
+              since: this.patientRevisions,
+            }),
+            signal: controller.signal,
+          },
+        );
+        const contentType = response.headers.get("Content-Type") || "";
+        if (!response.ok || !contentType.startsWith("text/event-stream")) {
+          throw new Error("Failed to open the event stream.");
+        }
+
+        this.pushConnected = true;
+        const reader = response.body
+          .pipeThrough(new TextDecoderStream())
+          .getReader();
+        let buffer = "";
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += value;
+          const messages = buffer.split("\n\n");
+          buffer = messages.pop();
+          for (const message of messages) {
+            if (message.startsWith("data: ")) {
+              this.handlePushEvent(JSON.parse(message.slice(6)));
+            }
+          }
+        }
+      } catch (error) {
+        if (!controller.signal.aborted) {
+          console.error("Event stream closed:", error);
+        }
+      } finally {
+        // Fall back to polling and retry the stream later
+        this.pushConnected = false;
+        this.pushController = null;
+        if (this.authenticated && !controller.signal.aborted) {
+          setTimeout(() => this.startPushStream(), 5000);
+        }
+      }
+    },
+    stopPushStream() {
+      if (this.pushController !== null) {
+        this.pushController.abort();
+      }
+    },
+    handlePushEvent(data) {
+      if (!Object.hasOwn(data, "event")) return;
+      if (
+        this.isEditingRestriction ||
+        this.editingRecordIndex !== -1 ||
+        this.confirming
+      ) {
+        // Do not overwrite local edits, catch up by polling afterwards
+        this.pushMissed = true;
+        return;
+      }
+
+      const patientAccounts = this.patientAccountsWithPasswords.filter(
+        ([patientAccount]) => patientAccount !== data.patient,
+      );
+      const revisions = { ...this.patientRevisions };
+      delete revisions[data.patient];
+      const fetchedData = {
+        patient_accounts: patientAccounts,
+        patient_records: {},
+        partial_records: [],
+        revisions: revisions,
+      };
+      if (data.event === this.events.UPDATE_RECORD) {
+        patientAccounts.push([data.patient, data.password]);
+        patientAccounts.sort(([a], [b]) => (a < b ? -1 : a > b ? 1 : 0));
+        fetchedData.patient_records[data.patient] = data.record;
+        if (data.partial) {
+          fetchedData.partial_records.push(data.patient);
+        }
+        revisions[data.patient] = data.revision;
+      }
+      this.processFetchedData(fetchedData);
+      this.searchPatient();
+    },
     startSyncInterval() {
       if (this.syncIntervalId === null) {
         this.syncIntervalId = setInterval(() => {
@@ -251,10 +403,26 @@ Vue.createApp({
         patient: patientAccount,
         data: record,
       };
+      // Edits of the displayed record are rejected if someone else changed
+      // the same days since it was fetched
+      if (
+        record === this.patientRecords[patientAccount] &&
+        patientAccount in this.patientRevisions
+      ) {
+        payload.revision = this.patientRevisions[patientAccount];
+      }
       const { message } = await this.postRequest(payload);
       if (message === this.events.messages.UPDATE_RECORD_SUCCESS) {
         // TODO: Remove this console.log
         console.log(message);
+      } else if (message === this.events.messages.UPDATE_CONFLICT) {
+        this.showAlert(
+          `${patientAccount} 的資料已被其他裝置修改，已重新載入`,
+          "alert-danger",
+        );
+        delete this.patientRevisions[patientAccount];
+        this.pushMissed = true;
+        await this.syncMonitorData();
       } else {
         console.error("Error:", message);
       }
@@ -262,8 +430,7 @@ Vue.createApp({
     async fetchUnmonitoredPatients() {
       const payload = {
         event: this.events.FETCH_UNMONITORED_PATIENTS,
-        account: this.account,
-        password: this.password,
+        ...this.credentials(),
       };
       const response = await this.postRequest(payload);
       if (
@@ -278,19 +445,29 @@ Vue.createApp({
       }
     },
     async addPatientToMonitor(patient) {
-      const payload = {
-        event: this.events.ADD_PATIENT,
+      // Add the patient and refetch the unmonitored list in one request
+      const response = await this.postRequest({
+        event: this.events.BATCH,
         account: this.account,
         password: this.password,
-        patient: patient,
-      };
-      const { message } = await this.postRequest(payload);
-      if (message === this.events.messages.ADD_PATIENT_SUCCESS) {
+        operations: [
+          { event: this.events.ADD_PATIENT, patient: patient },
+          { event: this.events.FETCH_UNMONITORED_PATIENTS },
+        ],
+      });
+      if (response.message !== this.events.messages.BATCH_SUCCESS) {
+        console.error(response.message);
+        return;
+      }
+      const [added, unmonitored] = response.results;
+      if (added.message === this.events.messages.ADD_PATIENT_SUCCESS) {
         // TODO: Remove this console.log
-        console.log(message);
-        await this.fetchUnmonitoredPatients();
+        console.log(added.message);
+        this.unmonitoredPatients = unmonitored["unmonitored_patients"].map(
+          (patient) => patient[1],
+        );
       } else {
-        console.error(message);
+        console.error(added.message);
       }
     },
     openTransferModal(fromPatient) {
@@ -465,10 +642,12 @@ Vue.createApp({
             this.authenticated = true;
             localStorage.setItem("account", this.account);
             localStorage.setItem("password", this.password);
+            await this.login();
 
             this.processFetchedData(fetchedData);
             this.filteredPatientAccounts = this.patientAccounts;
             await this.fetchUnmonitoredPatients();
+            this.startPushStream();
         }
       }
     },
@@ -791,9 +970,12 @@ Vue.createApp({
     async confirmLogout() {
       const confirmed = await this.showConfirm("請確認是否要登出");
       if (confirmed) {
+        await this.logout();
         this.account = "";
         this.password = "";
         this.authenticated = false;
+        this.stopPushStream();
+        this.patientRevisions = {};
         localStorage.removeItem("account");
         localStorage.removeItem("password");
       }
@@ -29,6 +29,11 @@ Vue.createApp({
       inputWeight: 0,
       showNotification: false,
       records: {},
+      revision: null,
+      session: null,
+      pushController: null,
+      pushConnected: false,
+      pushMissed: false,
       selectedLanguage: "zh-TW",
       supportedLanguages: [],
       curLangTexts: {},
@@ -136,7 +141,13 @@ Vue.createApp({
         weight: "NaN",
       };
     },
-    async fetchRecords() {
+    credentials() {
+      // A session token skips the password check on the server
+      return this.session !== null
+        ? { session: this.session }
+        : { account: this.account, password: this.password };
+    },
+    async login() {
       try {
         const response = await fetch(this.apiUrl, {
           method: "POST",
@@ -146,10 +157,51 @@ Vue.createApp({
             "Content-Type": "application/json",
           },
           body: JSON.stringify({
-            event: this.events.FETCH_RECORD,
+            event: this.events.LOGIN,
             account: this.account,
             password: this.password,
+          }),
+        });
+        const data = await response.json();
+        if (data.message === this.events.messages.AUTH_SUCCESS) {
+          this.session = data["session"];
+        }
+      } catch (error) {
+        console.error("Failed to start a session:", error);
+      }
+    },
+    async logout() {
+      if (this.session === null) return;
+      const session = this.session;
+      this.session = null;
+      try {
+        await fetch(this.apiUrl, {
+          method: "POST",
+          mode: "cors",
+          headers: {
+            Accept: "application/json",
+            "Content-Type": "application/json",
+          },
+          body: JSON.stringify({ event: this.events.LOGOUT, session }),
+        });
+      } catch (error) {
+        console.error("Failed to end the session:", error);
+      }
+    },
+    async fetchRecords() {
+      try {
+        const response = await fetch(this.apiUrl, {
+          method: "POST",
+          mode: "cors",
+          headers: {
+            Accept: "application/json",
+            "Content-Type": "application/json",
+          },
+          body: JSON.stringify({
+            event: this.events.FETCH_RECORD,
+            ...this.credentials(),
             patient: this.account,
+            since: this.revision,
           }),
         });
 
@@ -163,6 +215,82 @@ Vue.createApp({
         throw new Error(error.message);
       }
     },
+    async startPushStream() {
+      if (this.pushController !== null) return;
+      const controller = new AbortController();
+      this.pushController = controller;
+      try {
+        const response = await fetch(
+          `${this.apiUrl.replace(/\/$/, "")}/events`,
+          {
+            method: "POST",
+            mode: "cors",
+            headers: {
+              Accept: "text/event-stream",
+              "Content-Type": "application/json",
+            },
+            body: JSON.stringify({
+              ...this.credentials(),
+              since: { [this.account]: this.revision },
+            }),
+            signal: controller.signal,
+          },
+        );
+        const contentType = response.headers.get("Content-Type") || "";
+        if (!response.ok || !contentType.startsWith("text/event-stream")) {
+          throw new Error("Failed to open the event stream.");
+        }
+
+        this.pushConnected = true;
+        const reader = response.body
+          .pipeThrough(new TextDecoderStream())
+          .getReader();
+        let buffer = "";
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += value;
+          const messages = buffer.split("\n\n");
+          buffer = messages.pop();
+          for (const message of messages) {
+            if (message.startsWith("data: ")) {
+              this.handlePushEvent(JSON.parse(message.slice(6)));
+            }
+          }
+        }
+      } catch (error) {
+        if (!controller.signal.aborted) {
+          console.error("Event stream closed:", error);
+        }
+      } finally {
+        // Fall back to polling and retry the stream later
+        this.pushConnected = false;
+        this.pushController = null;
+        if (this.authenticated && !controller.signal.aborted) {
+          setTimeout(() => this.startPushStream(), 5000);
+        }
+      }
+    },
+    stopPushStream() {
+      if (this.pushController !== null) {
+        this.pushController.abort();
+      }
+    },
+    handlePushEvent(data) {
+      if (data.event !== this.events.UPDATE_RECORD) return;
+      if (this.confirming) {
+        // Catch up by polling once the confirmation is closed
+        this.pushMissed = true;
+        return;
+      }
+      if (data.partial) {
+        Object.assign(this.records, data.record);
+      } else {
+        this.records = data.record;
+      }
+      this.revision = data.revision;
+      this.processRestrictionText();
+    },
     togglePasswordVisibility() {
       this.showPassword = !this.showPassword;
     },
@@ -243,9 +371,12 @@ Vue.createApp({
           default:
             this.authenticated = true;
             this.records = fetchedData["account_records"];
+            this.revision = fetchedData["revision"];
             this.processRestrictionText();
             sessionStorage.setItem("account", this.account);
             sessionStorage.setItem("password", this.password);
+            await this.login();
+            this.startPushStream();
         }
       }
     },
@@ -276,14 +407,17 @@ Vue.createApp({
     async confirmLogout() {
       const confirmed = await this.showConfirm(this.curLangText.confirm_logout);
       if (confirmed) {
+        await this.logout();
         this.account = "";
         this.password = "";
         this.authenticated = false;
+        this.stopPushStream();
+        this.revision = null;
         sessionStorage.removeItem("account");
         sessionStorage.removeItem("password");
       }
     },
-    async updateRecords() {
+    async patchRecords(operation) {
       try {
         const response = await fetch(this.apiUrl, {
           method: "POST",
@@ -293,31 +427,31 @@ Vue.createApp({
             "Content-Type": "application/json",
           },
           body: JSON.stringify({
-            event: this.events.UPDATE_RECORD,
+            event: this.events.PATCH_RECORD,
             account: this.account,
             password: this.password,
             patient: this.account,
-            data: this.records,
+            operation: operation,
           }),
         });
 
         if (!response.ok) {
           console.error(
-            "Network response was not ok, failed to post patient records.",
+            "Network response was not ok, failed to patch patient records.",
           );
           return false;
         }
 
         const { message } = await response.json();
-        if (message === this.events.messages.UPDATE_RECORD_SUCCESS) {
-          console.log("Patient records posted successfully");
+        if (message === this.events.messages.PATCH_RECORD_SUCCESS) {
+          console.log("Patient records patched successfully");
           return true;
         } else {
           console.error("Error:", message);
           return false;
         }
       } catch (error) {
-        console.error("Error during posting patient records:", error);
+        console.error("Error during patching patient records:", error);
         return false;
       }
     },
@@ -376,6 +510,11 @@ Vue.createApp({
           urination: parseInt(this.inputUrination),
           defecation: parseInt(this.inputDefecation),
         };
+        let operation = {
+          op: "append_item",
+          date: currentDate,
+          item: currentData,
+        };
         const lastRecord = this.records[currentDate]["data"].pop();
         if (lastRecord !== undefined) {
           if (lastRecord["time"] === currentData["time"]) {
@@ -383,6 +522,12 @@ Vue.createApp({
               lastRecord[dietaryItem] += currentData[dietaryItem];
             }
             this.records[currentDate]["data"].push(lastRecord);
+            operation = {
+              op: "edit_item",
+              date: currentDate,
+              index: this.records[currentDate]["data"].length - 1,
+              item: lastRecord,
+            };
           } else {
             this.records[currentDate]["data"].push(lastRecord);
             this.records[currentDate]["data"].push(currentData);
@@ -410,7 +555,7 @@ Vue.createApp({
         this.customInputWater = "";
         this.customInputUrination = "";
         // post to database
-        if (await this.updateRecords()) {
+        if (await this.patchRecords(operation)) {
           this.showNotification = true;
           setTimeout(() => {
             this.hideNotification();
@@ -433,7 +578,15 @@ Vue.createApp({
         // init again
         this.inputWeight = 0;
         // post to database
-        if ((await this.updateRecords()) && this.showNotification === false) {
+        const operation = {
+          op: "set_weight",
+          date: currentDate,
+          weight: this.records[currentDate]["weight"],
+        };
+        if (
+          (await this.patchRecords(operation)) &&
+          this.showNotification === false
+        ) {
           this.showNotification = true;
           setTimeout(() => {
             this.hideNotification();
@@ -462,7 +615,11 @@ Vue.createApp({
         }
         this.records[date]["data"].splice(index, 1);
 
-        await this.updateRecords();
+        await this.patchRecords({
+          op: "remove_item",
+          date: date,
+          index: parseInt(index),
+        });
         this.removingRecord = false;
       }
       this.confirming = false;
@@ -511,15 +668,36 @@ Vue.createApp({
     }
 
     setInterval(async () => {
-      if (this.authenticated && !this.confirming) {
+      // Changes are pushed while the event stream is up
+      if (
+        this.authenticated &&
+        (!this.pushConnected || this.pushMissed) &&
+        !this.confirming
+      ) {
         const fetchedData = await this.fetchRecords();
         if (
           !this.confirming &&
           Object.hasOwn(fetchedData, "message") &&
           fetchedData.message === this.events.messages.FETCH_RECORD_SUCCESS
         ) {
-          this.records = fetchedData["account_records"];
+          if (fetchedData["partial"]) {
+            Object.assign(this.records, fetchedData["account_records"]);
+          } else {
+            this.records = fetchedData["account_records"];
+          }
+          this.revision = fetchedData["revision"];
           this.processRestrictionText();
+          this.pushMissed = false;
+        } else if (
+          !this.confirming &&
+          fetchedData.message === this.events.messages.NOT_MODIFIED
+        ) {
+          this.pushMissed = false;
+        } else if (
+          fetchedData.message === this.events.messages.SESSION_EXPIRED
+        ) {
+          this.session = null;
+          await this.login();
         }
       }
     }, 3000);